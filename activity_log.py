@@ -0,0 +1,159 @@
+# activity_log.py - Activity log: recent events in a ring buffer, full history in a rotating audit file
+
+import collections
+import datetime
+import itertools
+import json
+import os
+
+# Event types the stores and handlers record (filters on the 📜 Activity Logs screen)
+EVENT_TYPES = ("ORDER CREATED", "PAYMENT SUBMITTED", "ORDER APPROVED", "ORDER REJECTED", "STOCK ADDED",
+               "CATEGORY ADDED", "NOTIFICATION SENT", "OFFER BROADCAST", "COUNTERS RECOMPUTED",
+               "STATEMENT RECONCILED", "ORDERS ARCHIVED", "ORDER EXPIRED")
+
+
+def format_entry(entry):
+    """One display line: "[HH:MM dd Mon] EVENT — detail"."""
+    stamp = entry.get('stamp') or datetime.datetime.fromisoformat(entry['at']).strftime('%H:%M %d %b')
+    return f"[{stamp}] {entry['event']} — {entry['detail']}" if entry['detail'] else f"[{stamp}] {entry['event']}"
+
+
+def _reversed_lines(path, block_size=65536):
+    """Yields a file's lines last to first, reading it backwards in blocks."""
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        return
+    with f:
+        position = f.seek(0, os.SEEK_END)
+        tail = b''
+        while position > 0:
+            step = min(block_size, position)
+            position -= step
+            f.seek(position)
+            lines = (f.read(step) + tail).split(b'\n')
+            tail = lines.pop(0)
+            for line in reversed(lines):
+                if line:
+                    yield line
+        if tail:
+            yield tail
+
+
+class ActivityLog:
+    """Admin-visible activity, kept outside the main store.
+
+    The newest `keep` events stay in memory (a deque ring buffer) for the logs screen.
+    Every event is also appended as one JSON line ({"at", "event", "detail"}) to `path`;
+    once the file passes max_bytes it is rotated to path.1 … path.<backups>, the oldest
+    being dropped. Older pages and filtered views are read from those files, newest
+    first and backwards, so only as much history is read as a page needs.
+
+    With `shared`, several processes (cluster.py's workers) append to the same file:
+    each reopens it after another has rotated it, rotation is serialised by a lock
+    file, and pages are always read from the files, since the ring buffer only holds
+    this process's events.
+    """
+
+    def __init__(self, path='activity.log', keep=200, max_bytes=1048576, backups=10, shared=False):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.shared = shared
+        self._recent = collections.deque(maxlen=keep)
+        self._complete = True   # True while the ring buffer still holds the entire history
+        self._file = None
+
+    def load(self):
+        """Opens the audit file and refills the ring buffer from its newest entries."""
+        entries = []
+        for line in self._history_lines():
+            if len(entries) == self._recent.maxlen:
+                self._complete = False
+                break
+            entries.append(json.loads(line))
+        self._recent.extend(reversed(entries))
+        self._file = open(self.path, 'a', encoding='utf-8')
+        return self
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def import_legacy(self, lines):
+        """One-shot import of the old "[HH:MM dd Mon] ACTION — detail" lines kept in the store (oldest first).
+
+        Skipped if the audit file already has history, so it can never import twice.
+        """
+        if self._file.tell() or not lines:
+            return 0
+        for line in lines:
+            stamp, _, action = line[1:].partition('] ')
+            event, _, detail = action.partition(' — ')
+            self._write({"at": None, "stamp": stamp, "event": event, "detail": detail})
+        return len(lines)
+
+    def record(self, event, detail=""):
+        """Records one event (e.g. "ORDER APPROVED", "order_101")."""
+        self._write({"at": datetime.datetime.now().isoformat(timespec='seconds'), "event": event, "detail": detail})
+
+    def _write(self, entry):
+        if len(self._recent) == self._recent.maxlen:
+            self._complete = False
+        self._recent.append(entry)
+        if self.shared and self._rotated_elsewhere():
+            self._file.close()
+            self._file = open(self.path, 'a', encoding='utf-8')
+        self._file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self._file.flush()
+        if self._file.tell() >= self.max_bytes:
+            self._rotate()
+
+    def _rotated_elsewhere(self):
+        """True if `path` is no longer the file this process has open (another process rotated it)."""
+        try:
+            return os.stat(self.path).st_ino != os.fstat(self._file.fileno()).st_ino
+        except FileNotFoundError:
+            return True
+
+    def _rotate(self):
+        self._file.close()
+        if not self.shared:
+            self._shift_files()
+        else:
+            import fcntl  # shared logs are only used by cluster.py, which runs on POSIX
+            with open(f"{self.path}.lock", 'a') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                # Another process may have rotated the file while this one waited for the lock
+                if os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+                    self._shift_files()
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def _shift_files(self):
+        for n in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{n}"):
+                os.replace(f"{self.path}.{n}", f"{self.path}.{n + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+    # --- Reading ---
+
+    def _history_lines(self):
+        """Every audit line on disk, newest first (current file, then path.1, path.2, …)."""
+        paths = [self.path] + [f"{self.path}.{n}" for n in range(1, self.backups + 1)]
+        return itertools.chain.from_iterable(_reversed_lines(p) for p in paths)
+
+    def page(self, event=None, page=0, per_page=15):
+        """Returns (entries newest first, has_more) for one page, optionally of one event type."""
+        wanted = (page + 1) * per_page + 1
+        matches = [e for e in reversed(self._recent) if event is None or e['event'] == event]
+        if self.shared or (len(matches) < wanted and not self._complete):
+            # Beyond the ring buffer (or other processes' events): read the on-disk history, only as far as this page
+            self._file.flush()
+            entries = (json.loads(line) for line in self._history_lines())
+            matches = list(itertools.islice((e for e in entries if event is None or e['event'] == event), wanted))
+        start = page * per_page
+        return matches[start:start + per_page], len(matches) > start + per_page
@@ -0,0 +1,229 @@
+# archive.py - Cold archive: finished orders moved out of the hot store into compressed monthly segments
+
+import asyncio
+import bisect
+import collections
+import datetime
+import gzip
+import json
+import logging
+import os
+
+from models import Order
+from storage import order_number
+
+logger = logging.getLogger(__name__)
+
+# Index row per archived order: everything search and the counters need, without the credential
+_INDEX_FIELDS = ('user_id', 'status', 'price', 'txn_id', 'sender_number')
+
+
+def _write_atomic(path, data):
+    """Writes bytes to `path` through a temporary file and a rename, so readers never see half a file."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class OrderArchive:
+    """Delivered, rejected and expired orders that have left the hot store.
+
+    Orders live in one gzip-compressed JSON segment per month of creation
+    (`directory`/orders-YYYY-MM.json.gz, {order_id: order} in the database.json layout). `directory`/index.json
+    holds one small row per archived order (its segment and the fields search,
+    history and the counters need), loaded into memory at startup. A segment is
+    only read when one of its orders is shown, and the `cached_segments` most
+    recently used ones are kept decompressed.
+
+    The query methods mirror Storage's, so Storage.search_orders() and
+    Storage.orders_page() consult the archive the same way as the hot store.
+    """
+
+    def __init__(self, directory='archive', cached_segments=4):
+        self.directory = directory
+        self.cached_segments = cached_segments
+        self._index = {}                                   # order_id -> [month, *_INDEX_FIELDS]
+        self._index_mtime = None                           # of the index file last read or written
+        self._segments = collections.OrderedDict()         # month -> {order_id: Order}, least recently used first
+
+    def _segment_path(self, month):
+        return os.path.join(self.directory, f"orders-{month}.json.gz")
+
+    @property
+    def _index_path(self):
+        return os.path.join(self.directory, "index.json")
+
+    # --- Loading ---
+
+    def load(self):
+        """Reads the index and builds the lookups over it (at startup, and again from refresh())."""
+        try:
+            with open(self._index_path, 'r', encoding='utf-8') as f:
+                self._index_mtime = os.fstat(f.fileno()).st_mtime_ns
+                self._index = json.load(f)
+        except FileNotFoundError:
+            self._index, self._index_mtime = {}, None
+        self._build_lookups()
+        self._segments.clear()
+        return self
+
+    def refresh(self):
+        """Reloads the index if another process has rewritten it since (several bot processes, one archiver)."""
+        try:
+            mtime = os.stat(self._index_path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime != self._index_mtime:
+            self.load()
+
+    def _build_lookups(self):
+        self._order_ids_ci = {}                                  # order_id.lower() -> order_id
+        self._by_user = collections.defaultdict(list)            # user_id (int) -> sorted [(order_number, order_id)]
+        self._by_txn = collections.defaultdict(list)             # TXN ID -> [order_id]
+        self._by_sender = collections.defaultdict(list)          # sender number -> [order_id]
+        for order_id in sorted(self._index, key=order_number):
+            _, user_id, _, _, txn_id, sender_number = self._index[order_id]
+            self._order_ids_ci[order_id.lower()] = order_id
+            self._by_user[int(user_id)].append((order_number(order_id), order_id))
+            if txn_id:
+                self._by_txn[txn_id].append(order_id)
+            if sender_number:
+                self._by_sender[sender_number].append(order_id)
+        self._txn_sorted = sorted(self._by_txn)
+
+    def _segment(self, month):
+        segment = self._segments.get(month)
+        if segment is None:
+            try:
+                with gzip.open(self._segment_path(month), 'rt', encoding='utf-8') as f:
+                    segment = {order_id: Order.from_dict(o) for order_id, o in json.load(f).items()}
+            except FileNotFoundError:
+                segment = {}
+            self._segments[month] = segment
+            while len(self._segments) > self.cached_segments:
+                self._segments.popitem(last=False)
+        else:
+            self._segments.move_to_end(month)
+        return segment
+
+    def _orders(self, order_ids):
+        return [(order_id, self.get_order(order_id)) for order_id in order_ids]
+
+    # --- Queries (same shapes as Storage's) ---
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, order_id):
+        return order_id in self._index
+
+    def get_order(self, order_id):
+        row = self._index.get(order_id)
+        return self._segment(row[0]).get(order_id) if row else None
+
+    def resolve_order_id(self, term):
+        return self._order_ids_ci.get(term.lower())
+
+    def get_order_by_txn(self, txn_id):
+        order_ids = self._by_txn.get(txn_id)
+        return (order_ids[0], self.get_order(order_ids[0])) if order_ids else None
+
+    def orders_by_txn_prefix(self, prefix, limit=10):
+        if not prefix:
+            return []
+        order_ids = []
+        i = bisect.bisect_left(self._txn_sorted, prefix)
+        while i < len(self._txn_sorted) and self._txn_sorted[i].startswith(prefix) and len(order_ids) < limit:
+            order_ids += self._by_txn[self._txn_sorted[i]]
+            i += 1
+        return self._orders(order_ids[:limit])
+
+    def orders_by_sender(self, sender_number):
+        return self._orders(self._by_sender.get(sender_number, ()))
+
+    def orders_for_user(self, user_id):
+        return self._orders(order_id for _, order_id in self._by_user.get(int(user_id), ()))
+
+    def orders_page(self, user_id, after=None, before=None, limit=10):
+        """One page of a user's archived orders; same cursors and result as Storage.orders_page()."""
+        entries = self._by_user.get(int(user_id), ())
+        if after is not None:
+            start = bisect.bisect_left(entries, (after + 1,))
+            end = min(start + limit, len(entries))
+        else:
+            end = len(entries) if before is None else bisect.bisect_left(entries, (before,))
+            start = max(end - limit, 0)
+        return self._orders(order_id for _, order_id in entries[start:end]), start > 0, end < len(entries)
+
+    def records(self, exclude=()):
+        """Yields (user_id, status, price) per archived order not in `exclude`, for recomputing counters."""
+        for order_id, (_, user_id, status, price, _, _) in self._index.items():
+            if order_id not in exclude:
+                yield user_id, status, price
+
+    # --- Writing ---
+
+    def write(self, orders):
+        """Adds finished orders [(order_id, order), ...] to their monthly segments, then to the index.
+
+        Segments are written before the index and both are replaced atomically, so a
+        crash leaves the archive consistent. Writing an order twice just overwrites it.
+        Blocking; the archiver runs it in a thread.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        by_month = collections.defaultdict(dict)
+        for order_id, order in orders:
+            by_month[order.created_at[:7]][order_id] = order.to_dict()
+        for month, month_orders in by_month.items():
+            try:
+                with gzip.open(self._segment_path(month), 'rt', encoding='utf-8') as f:
+                    segment = json.load(f)
+            except FileNotFoundError:
+                segment = {}
+            segment.update(month_orders)
+            _write_atomic(self._segment_path(month),
+                          gzip.compress(json.dumps(segment, ensure_ascii=False, separators=(',', ':')).encode('utf-8')))
+        index = dict(self._index)
+        for month, month_orders in by_month.items():
+            for order_id, order in month_orders.items():
+                index[order_id] = [month, *(order.get(k) for k in _INDEX_FIELDS)]
+        _write_atomic(self._index_path, json.dumps(index, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+        return index
+
+    def adopt(self, index):
+        """Switches the in-memory lookups to an index returned by write() (on the event loop)."""
+        self._index = index
+        self._index_mtime = os.stat(self._index_path).st_mtime_ns
+        self._build_lookups()
+        self._segments.clear()  # cached copies of rewritten segments are stale
+
+
+async def archive_finished_orders(store, max_age_days):
+    """Moves finished orders created more than `max_age_days` ago, and all expired ones, from the hot store into its archive.
+
+    The archive is written (in a thread) before the orders leave the hot store, so an
+    order is never only in memory. Returns the number of orders archived.
+    """
+    cutoff = (datetime.datetime.now() - datetime.timedelta(days=max_age_days)).isoformat()
+    orders = store.archivable_orders(cutoff)
+    if not orders:
+        return 0
+    index = await asyncio.to_thread(store.archive.write, orders)
+    store.archive.adopt(index)
+    store.remove_archived_orders([order_id for order_id, _ in orders])
+    return len(orders)
+
+
+async def run_archiver(store, max_age_days, interval):
+    """Background task: archives finished orders every `interval` seconds."""
+    while True:
+        try:
+            archived = await archive_finished_orders(store, max_age_days)
+            if archived:
+                logger.info("Archived %d finished orders.", archived)
+        except OSError:
+            logger.exception("Archiving finished orders failed; they stay in the hot store.")
+        await asyncio.sleep(interval)
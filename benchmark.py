@@ -0,0 +1,418 @@
+# benchmark.py - Handler-level benchmarks against synthetic stores, with no network
+#
+# Generates a synthetic database per size (orders spread over users and products,
+# deep stock queues), loads it into the configured backend and drives the real
+# handlers from main.py through fake Update/CallbackQuery/Bot objects:
+#     python benchmark.py --sizes 1000,100000 --backend json --output bench.json
+#     python benchmark.py --sizes 1000 --compare bench.json      # after a change
+#
+# Per handler it reports p50/p99 latency, the memory a call allocates and keeps
+# (net) and its peak, plus the process's peak RSS per dataset. Results are saved as
+# JSON; --compare prints the change in p50/p99 against an earlier results file.
+# --routing times how long a button tap takes to find its handler: the callback
+# router's lookup against the chain of regex patterns it replaced.
+
+import argparse
+import asyncio
+import datetime
+import gc
+import json
+import logging
+import os
+import platform
+import random
+import re
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import callbacks
+import main
+from activity_log import ActivityLog
+from archive import OrderArchive
+from catalog import CatalogCache
+from sqlite_store import SqliteStore, migrate_json_to_sqlite
+from storage import JsonStore
+
+# Share of generated orders per status; pending_approval orders feed the approve benchmark
+STATUS_MIX = (("delivered", 0.70), ("rejected", 0.15), ("pending_approval", 0.10), ("waiting_payment", 0.05))
+
+
+# --- Synthetic datasets ---
+
+def generate_database(orders, products=200, categories=20, stock_per_product=5000, users=None, seed=1):
+    """Returns a database.json layout with `orders` orders and consistent stock (counters are seeded on load)."""
+    rng = random.Random(seed)
+    users = users or max(orders // 10, 10)
+    now = datetime.datetime.now()
+    db = {"users": {}, "categories": {}, "products": {}, "stock": {}, "orders": {}, "next_order_id": 100, "settings": {}}
+    for c in range(categories):
+        db['categories'][f"cat_{c}"] = {"name": f"Category {c}", "banner": "N/A"}
+    for p in range(products):
+        db['products'][f"prod_{p}"] = {"cat_id": f"cat_{p % categories}", "name": f"Product {p}", "duration": "1 Month",
+                                       "price": 100 + p % 50 * 10, "country": "N/A", "rules": "N/A", "photo": "N/A"}
+        db['stock'][f"prod_{p}"] = {"available": [f"p{p}s{i}@mail.test|pw{i}" for i in range(stock_per_product)],
+                                    "used": []}
+    for u in range(users):
+        user_id = str(10_000 + u)
+        db['users'][user_id] = {"username": f"user{u}", "name": f"User {u}", "first_order": now.isoformat(),
+                                "last_order": None, "level": "NEW"}
+
+    statuses, weights = zip(*STATUS_MIX)
+    for n in range(orders):
+        order_id = f"order_{100 + n}"
+        prod_id = f"prod_{rng.randrange(products)}"
+        status = rng.choices(statuses, weights)[0]
+        order = {"user_id": 10_000 + rng.randrange(users), "product_id": prod_id,
+                 "price": db['products'][prod_id]['price'], "status": status,
+                 "created_at": (now - datetime.timedelta(minutes=orders - n)).isoformat()}
+        if status != "waiting_payment":
+            order.update(txn_id=f"TXN{n:09d}", sender_number=f"01{rng.randrange(10**9):09d}",
+                         submitted_amount=order['price'])
+        if status == "delivered":
+            # Sold items are appended to the ledger instead of taken from the benchmark's queue
+            credential = f"sold{n}@mail.test|pw"
+            db['stock'][prod_id]['used'].append({"credential": credential, "order_id": order_id})
+            order['delivery_credential'] = credential
+        db['orders'][order_id] = order
+    db['next_order_id'] = 100 + orders
+    return db
+
+
+def open_store(db, directory, backend):
+    """Writes `db` as a snapshot in `directory` and opens it with the chosen backend."""
+    path = os.path.join(directory, "database.json")
+    with open(path, 'w') as f:
+        json.dump(db, f, separators=(',', ':'))
+    archive = OrderArchive(os.path.join(directory, "archive")).load()
+    if backend == "sqlite":
+        migrate_json_to_sqlite(path, os.path.join(directory, "database.sqlite3"), archive=archive)
+        store = SqliteStore(os.path.join(directory, "database.sqlite3"))
+    else:
+        store = JsonStore(path)
+    store.attach_archive(archive)
+    store.load()
+    return store
+
+
+# --- Fake Telegram objects (only what the handlers touch) ---
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.username = f"user{user_id}"
+        self.full_name = f"User {user_id}"
+
+
+class FakeMessage:
+    def __init__(self, user, text):
+        self.from_user = user
+        self.text = text
+        self.replies = []
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+        return self
+
+    async def edit_text(self, text, **kwargs):
+        self.replies.append(text)
+        return self
+
+
+class FakeCallbackQuery:
+    def __init__(self, user, data):
+        self.from_user = user
+        self.data = data
+        self.edits = []
+
+    async def answer(self, *args, **kwargs):
+        return True
+
+    async def edit_message_text(self, text, **kwargs):
+        self.edits.append(text)
+        return True
+
+
+class FakeUpdate:
+    def __init__(self, user, message=None, callback_query=None):
+        self.effective_user = user
+        self.message = message
+        self.callback_query = callback_query
+        self.effective_message = message
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent += 1
+        return FakeMessage(None, text)
+
+
+class FakeContext:
+    def __init__(self, bot):
+        self.bot = bot
+        self.user_data = {}
+        self.bot_data = {}
+
+
+# --- Scenarios: setup (not timed) returns the call to time ---
+
+class Scenarios:
+    """One setup function per handler; each returns a coroutine function that runs the handler once."""
+
+    def __init__(self, store, db, seed=2):
+        self.store = store
+        self.rng = random.Random(seed)
+        self.bot = FakeBot()
+        self.admin = FakeUser(main.ADMIN_ID)
+        self.router = main.build_router()
+        self.user_ids = [int(user_id) for user_id in db['users']]
+        self.product_ids = list(db['products'])
+        # Approvals consume these; newer ones are created on demand once they run out
+        self.pending = [order_id for order_id, o in db['orders'].items() if o['status'] == "pending_approval"]
+        orders = list(db['orders'].items())
+        self.search_terms = []
+        for order_id, order in self.rng.sample(orders, min(len(orders), 50)):
+            self.search_terms += [order_id, str(order['user_id'])]
+            if order.get('txn_id'):
+                self.search_terms += [order['txn_id'], order['txn_id'][:-3]]
+
+    def _user(self):
+        return FakeUser(self.rng.choice(self.user_ids))
+
+    def _call(self, handler, update, context):
+        return lambda: handler(update, context)
+
+    def show_categories(self):
+        user = self._user()
+        return self._call(main.show_categories, FakeUpdate(user, FakeMessage(user, "🛒 Buy Subscription")),
+                          FakeContext(self.bot))
+
+    def buy_now_action(self):
+        user = self._user()
+        context = FakeContext(self.bot)
+        context.user_data['current_product_id'] = self.rng.choice(self.product_ids)
+        return lambda: main.buy_now_action(FakeCallbackQuery(user, callbacks.BUY.data()), context)
+
+    def handle_payment_submission(self):
+        user = self._user()
+        prod_id = self.rng.choice(self.product_ids)
+        price = self.store.get_product(prod_id).price
+        context = FakeContext(self.bot)
+        context.user_data['waiting_payment_for_order'] = self.store.create_order(user.id, prod_id, price)
+        text = f"BT{self.rng.randrange(10**12):012d}|01{self.rng.randrange(10**9):09d}|{price}"
+        return self._call(main.handle_payment_submission, FakeUpdate(user, FakeMessage(user, text)), context)
+
+    def handle_admin_order_action(self):
+        if self.pending:
+            order_id = self.pending.pop()
+        else:
+            user = self._user()
+            prod_id = self.rng.choice(self.product_ids)
+            order_id = self.store.create_order(user.id, prod_id, self.store.get_product(prod_id).price)
+            self.store.submit_payment(order_id, f"BA{self.rng.randrange(10**12):012d}", "01700000000",
+                                      self.store.get_product(prod_id).price)
+        # Through the router, as a tap on the Approve button arrives
+        query = FakeCallbackQuery(self.admin, callbacks.APPROVE.data(order_id))
+        return self._call(self.router.dispatch, FakeUpdate(self.admin, callback_query=query), FakeContext(self.bot))
+
+    def process_admin_search_input(self):
+        term = self.rng.choice(self.search_terms)
+        return self._call(main.process_admin_search_input, FakeUpdate(self.admin, FakeMessage(self.admin, term)),
+                          FakeContext(self.bot))
+
+    def show_stats(self):
+        query = FakeCallbackQuery(self.admin, callbacks.STATS.data())
+        return lambda: main.show_stats(query, FakeContext(self.bot))
+
+
+HANDLERS = ("show_categories", "buy_now_action", "handle_payment_submission", "handle_admin_order_action",
+            "process_admin_search_input", "show_stats")
+
+
+# --- Measurement ---
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+async def measure(setup, iterations, alloc_iterations):
+    """Times `iterations` calls, then traces `alloc_iterations` more with tracemalloc (slower, so kept apart)."""
+    timings = []
+    for _ in range(iterations):
+        call = setup()
+        start = time.perf_counter_ns()
+        await call()
+        timings.append((time.perf_counter_ns() - start) / 1e6)
+
+    net, peaks = [], []
+    tracemalloc.start()
+    for _ in range(alloc_iterations):
+        call = setup()
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        await call()
+        after, peak = tracemalloc.get_traced_memory()
+        net.append((after - before) / 1024)
+        peaks.append((peak - before) / 1024)
+    tracemalloc.stop()
+    return {
+        "iterations": iterations,
+        "p50_ms": round(percentile(timings, 0.50), 4),
+        "p99_ms": round(percentile(timings, 0.99), 4),
+        "mean_ms": round(statistics.fmean(timings), 4),
+        "net_alloc_kib": round(statistics.fmean(net), 2) if net else None,
+        "peak_alloc_kib": round(max(peaks), 2) if peaks else None,
+    }
+
+
+async def run_dataset(store, db, handlers, iterations, alloc_iterations):
+    # The handlers use main's module-level objects, so point them at the synthetic store
+    main.store = store
+    main.catalog = CatalogCache(store)
+    scenarios = Scenarios(store, db)
+    store.start()
+    try:
+        results = {}
+        for name in handlers:
+            gc.collect()
+            results[name] = await measure(getattr(scenarios, name), iterations, alloc_iterations)
+            print(f"  {name:28} p50 {results[name]['p50_ms']:9.3f} ms   p99 {results[name]['p99_ms']:9.3f} ms   "
+                  f"peak {results[name]['peak_alloc_kib']} KiB")
+        return results
+    finally:
+        await store.close()
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, baseline_path):
+    """Prints p50/p99 changes against an earlier results file, for datasets and handlers both contain."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    old = {(r['orders'], r['backend'], name): stats
+           for r in baseline['datasets'] for name, stats in r['handlers'].items()}
+    print(f"\nCompared with {baseline_path} (revision {baseline.get('revision')}):")
+    for r in results['datasets']:
+        for name, stats in r['handlers'].items():
+            before = old.get((r['orders'], r['backend'], name))
+            if before:
+                changes = "   ".join(f"{key[:3]} {before[key]:.3f} → {stats[key]:.3f} ms ({stats[key] / before[key] - 1:+.0%})"
+                                     for key in ("p50_ms", "p99_ms") if before[key])
+                print(f"  {r['orders']:>9} {r['backend']:6} {name:28} {changes}")
+
+
+# --- Callback routing ---
+
+# The CallbackQueryHandler patterns the router replaced, in their old registration
+# order: each tap was matched against them one by one until one took it.
+LEGACY_PATTERNS = [re.compile(p) for p in (
+    "^ADMIN_CAT_ADD$", "^ADMIN_STOCK_START_ADD$", "^STOCK_ADD_PROD_", "^ADMIN_SEARCH_START$",
+    "^ADMIN_BROADCAST_START$", "^ADMIN_RECONCILE_START$", "^BACK_CATEGORIES$", "^CAT_ID_", "^BACK_TO_PRODUCTS_", "^PROD_ID_", "^BUY_NOW$",
+    "^MY_ORDERS_", "^ADMIN_PANEL_BACK$", "^ADMIN_", "^ADMIN_(APPROVE|REJECT)_", "^ADMIN_ORDER_VIEW_",
+)]
+
+
+def routing_samples(count, seed=3):
+    """(new callback data, old callback data) pairs for a spread of button taps."""
+    rng = random.Random(seed)
+    taps = (
+        lambda n: (callbacks.PRODUCTS.data(f"cat_{n}"), f"CAT_ID_cat_{n}"),
+        lambda n: (callbacks.PRODUCT.data(f"prod_{n}"), f"PROD_ID_prod_{n}"),
+        lambda n: (callbacks.BUY.data(), "BUY_NOW"),
+        lambda n: (callbacks.MY_ORDERS.data(f"b{n}"), f"MY_ORDERS_b{n}"),
+        lambda n: (callbacks.APPROVE.data(f"order_{n}"), f"ADMIN_APPROVE_order_{n}"),
+        lambda n: (callbacks.ORDER_VIEW.data(f"a{n}"), f"ADMIN_ORDER_VIEW_order_{n}"),
+        lambda n: (callbacks.STATS.data(), "ADMIN_STATS"),
+    )
+    return [rng.choice(taps)(rng.randrange(1, 10**6)) for _ in range(count)]
+
+
+def benchmark_routing(count=100_000):
+    """Per-tap time to find the handler: first matching legacy pattern vs CallbackRouter.resolve()."""
+    router = main.build_router()
+    samples = routing_samples(count)
+    results = {}
+    started = time.perf_counter()
+    for _, old in samples:
+        next(p for p in LEGACY_PATTERNS if p.match(old))
+    results['legacy_patterns_us'] = (time.perf_counter() - started) / count * 1e6
+    started = time.perf_counter()
+    for new, _ in samples:
+        router.resolve(new)
+    results['router_us'] = (time.perf_counter() - started) / count * 1e6
+    started = time.perf_counter()
+    for _, old in samples:
+        router.resolve(old)
+    results['router_legacy_data_us'] = (time.perf_counter() - started) / count * 1e6
+    for name, us in results.items():
+        print(f"  {name:<24} {us:6.2f} µs per tap")
+    return {name: round(us, 3) for name, us in results.items()}
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Benchmark the bot's handlers against synthetic stores.")
+    parser.add_argument("--sizes", default="1000,100000", help="comma-separated order counts, e.g. 1000,100000,1000000")
+    parser.add_argument("--backend", choices=("json", "sqlite"), default="json")
+    parser.add_argument("--products", type=int, default=200)
+    parser.add_argument("--stock", type=int, default=5000, help="unused stock items per product")
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument("--alloc-iterations", type=int, default=50)
+    parser.add_argument("--handlers", default=",".join(HANDLERS))
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--routing", action="store_true", help="also time callback routing (no store needed)")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    handlers = args.handlers.split(",")
+    results = {"revision": git_revision(), "python": platform.python_version(),
+               "at": datetime.datetime.now().isoformat(), "datasets": []}
+    for size in (int(s) for s in args.sizes.split(",")):
+        print(f"{size} orders, {args.products} products × {args.stock} stock ({args.backend}):")
+        db = generate_database(size, products=args.products, stock_per_product=args.stock)
+        with tempfile.TemporaryDirectory() as directory:
+            started = time.perf_counter()
+            store = open_store(db, directory, args.backend)
+            load_s = time.perf_counter() - started
+            # Activity goes to a throwaway audit file, as main's does in production
+            activity = ActivityLog(os.path.join(directory, "activity.log")).load()
+            store.add_activity_listener(activity.record)
+            try:
+                handler_results = asyncio.run(run_dataset(store, db, handlers, args.iterations, args.alloc_iterations))
+            finally:
+                activity.close()
+        results['datasets'].append({
+            "orders": size, "backend": args.backend, "products": args.products, "stock_per_product": args.stock,
+            "load_s": round(load_s, 3),
+            # ru_maxrss is KiB on Linux, bytes on macOS
+            "max_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // (1024 if sys.platform == "darwin" else 1),
+            "handlers": handler_results,
+        })
+        del db
+    if args.routing:
+        print("Callback routing:")
+        results['routing'] = benchmark_routing()
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nSaved results to {args.output}.")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,186 @@
+# broadcast.py - Rate-limited concurrent message broadcasts (pending reminders, offers)
+
+import asyncio
+import collections
+import datetime
+import logging
+import string
+import time
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TelegramError
+
+logger = logging.getLogger(__name__)
+
+# Per-recipient outcomes
+SENT, BLOCKED, FAILED = "sent", "blocked", "failed"
+
+
+def _seconds(retry_after):
+    """RetryAfter.retry_after is an int or a timedelta depending on the PTB version/settings."""
+    if isinstance(retry_after, datetime.timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+class RateLimiter:
+    """Spaces sends to at most `rate` per second overall and one per `chat_interval` seconds per chat.
+
+    Slots are reserved up front, so concurrent senders queue behind each other instead
+    of all waking at once. pause() (after a RetryAfter) holds every sender until it has passed.
+    """
+
+    def __init__(self, rate=25, chat_interval=1.0):
+        self.interval = 1.0 / rate
+        self.chat_interval = chat_interval
+        self._next_slot = 0.0
+        self._paused_until = 0.0
+        self._chat_next = {}
+
+    def pause(self, seconds):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def wait(self, chat_id):
+        while True:
+            now = time.monotonic()
+            start = max(now, self._next_slot, self._paused_until, self._chat_next.get(chat_id, 0.0))
+            self._next_slot = start + self.interval
+            self._chat_next[chat_id] = start + self.chat_interval
+            if start > now:
+                await asyncio.sleep(start - now)
+            if time.monotonic() >= self._paused_until:
+                break
+        if len(self._chat_next) > 10000:
+            now = time.monotonic()
+            self._chat_next = {c: t for c, t in self._chat_next.items() if t > now}
+
+
+class BroadcastResult:
+    """Outcome of every recipient of one broadcast, plus running totals for progress reports."""
+
+    def __init__(self, total):
+        self.total = total
+        self.outcomes = {}  # chat_id (or send_each key) -> (SENT | BLOCKED | FAILED, error text or None)
+        self.counts = collections.Counter()
+        self.retries = 0
+        self.started = time.monotonic()
+
+    @property
+    def done(self):
+        return len(self.outcomes)
+
+    def record(self, chat_id, outcome, error=None):
+        self.outcomes[chat_id] = (outcome, error)
+        self.counts[outcome] += 1
+
+    def failures(self):
+        """Returns [(chat_id, outcome, error), ...] for every recipient that was not reached."""
+        return [(chat_id, outcome, error) for chat_id, (outcome, error) in self.outcomes.items() if outcome != SENT]
+
+    def summary(self):
+        return (f"Progress: {self.done}/{self.total}\n"
+                f"✅ Sent: {self.counts[SENT]}\n"
+                f"🚫 Blocked: {self.counts[BLOCKED]}\n"
+                f"⚠️ Failed: {self.counts[FAILED]}\n"
+                f"⏱ {time.monotonic() - self.started:.0f}s")
+
+
+class Broadcaster:
+    """Sends one message to many chats with bounded concurrency under Telegram's rate limits.
+
+    One instance is shared by every broadcast of the bot, so the global limit holds even
+    when two broadcasts run at the same time. Flood control (RetryAfter) pauses all sends
+    and the message is retried; network errors are retried with backoff; blocked bots and
+    bad chats are recorded, not retried.
+    """
+
+    def __init__(self, rate=25, chat_interval=1.0, concurrency=8, max_retries=3, progress_interval=3.0):
+        self.limiter = RateLimiter(rate, chat_interval)
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.progress_interval = progress_interval
+
+    async def send(self, bot, recipients, template, parse_mode=None, progress=None):
+        """Sends `template` to every recipient and returns a BroadcastResult.
+
+        `recipients` is either a dict of chat ID -> fields for the template's $placeholders
+        (string.Template) or a plain iterable of chat IDs (the text is sent unchanged).
+        `progress(result)` is awaited every progress_interval seconds while sending.
+        """
+        if not isinstance(recipients, dict):
+            recipients = dict.fromkeys(recipients)
+        compiled = string.Template(template)
+        messages = ((chat_id, chat_id, compiled.safe_substitute(fields) if fields else template)
+                    for chat_id, fields in recipients.items())
+        return await self._run(bot, messages, len(recipients), parse_mode, progress)
+
+    async def send_each(self, bot, messages, parse_mode=None, progress=None):
+        """Sends individual messages, e.g. order deliveries: `messages` is a dict of key -> (chat ID, text).
+
+        Outcomes are recorded under the key, so one chat can receive several messages.
+        """
+        items = ((key, chat_id, text) for key, (chat_id, text) in messages.items())
+        return await self._run(bot, items, len(messages), parse_mode, progress)
+
+    async def _run(self, bot, messages, total, parse_mode, progress):
+        result = BroadcastResult(total)
+        if not total:
+            return result
+
+        async def worker():
+            # Workers share one iterator, so each message is taken exactly once
+            for key, chat_id, text in messages:
+                await self._deliver(bot, key, chat_id, text, parse_mode, result)
+
+        reporter = asyncio.create_task(self._report(progress, result)) if progress else None
+        try:
+            await asyncio.gather(*(worker() for _ in range(min(self.concurrency, total))))
+        finally:
+            if reporter:
+                reporter.cancel()
+        logger.info("Broadcast finished: %d sent, %d blocked, %d failed, %d retries.",
+                    result.counts[SENT], result.counts[BLOCKED], result.counts[FAILED], result.retries)
+        return result
+
+    async def _deliver(self, bot, key, chat_id, text, parse_mode, result):
+        error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                result.retries += 1
+            await self.limiter.wait(chat_id)
+            try:
+                await bot.send_message(chat_id, text, parse_mode=parse_mode)
+                result.record(key, SENT)
+                return
+            except RetryAfter as e:
+                self.limiter.pause(_seconds(e.retry_after))
+                error = e
+            except Forbidden as e:
+                result.record(key, BLOCKED, str(e))
+                return
+            except BadRequest as e:
+                result.record(key, FAILED, str(e))
+                return
+            except NetworkError as e:
+                error = e
+                await asyncio.sleep(2 ** attempt)
+            except TelegramError as e:
+                result.record(key, FAILED, str(e))
+                return
+            except Exception as e:
+                logger.exception("Unexpected error broadcasting to %s", chat_id)
+                result.record(key, FAILED, repr(e))
+                return
+        result.record(key, FAILED, f"gave up after {self.max_retries} retries: {error}")
+
+    async def _report(self, progress, result):
+        reported = 0
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            if result.done == reported:
+                continue  # Telegram rejects an edit that changes nothing
+            reported = result.done
+            try:
+                await progress(result)
+            except Exception as e:
+                # A failed progress edit must never stop the broadcast itself
+                logger.debug("Broadcast progress update failed: %s", e)
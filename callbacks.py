@@ -0,0 +1,212 @@
+# callbacks.py - Compact, versioned callback data and the table that routes button taps to handlers
+
+import re
+
+from storage import order_number
+
+# Callback data is VERSION + action code, then its arguments separated by ":", e.g. "1ap:101".
+# Bump VERSION when an action's arguments change, so old buttons are recognised as stale.
+VERSION = "1"
+SEP = ":"
+
+# Telegram rejects callback_data longer than this (in bytes)
+MAX_DATA_BYTES = 64
+
+
+class Arg:
+    """How one argument is written into callback data and read back."""
+
+    __slots__ = ('encode', 'decode')
+
+    def __init__(self, encode, decode):
+        self.encode = encode
+        self.decode = decode
+
+
+STR = Arg(str, str)
+INT = Arg(str, int)
+OPTIONAL_INT = Arg(lambda v: "-" if v is None else str(v), lambda s: None if s == "-" else int(s))
+# Order IDs travel as their number ("order_101" -> "101")
+ORDER = Arg(lambda order_id: str(order_number(order_id)), lambda s: f"order_{int(s)}")
+
+_CURSOR = re.compile(r'[ab][0-9]*')
+
+
+def _cursor(s):
+    if not _CURSOR.fullmatch(s):
+        raise ValueError(f"Not a page cursor: {s!r}")
+    return s
+
+
+# Page cursors of main.page_cursor: "a<n>", "b<n>" or a bare "b"
+CURSOR = Arg(str, _cursor)
+
+
+class Action:
+    """A button action: a short code plus typed arguments. Only the last argument may contain SEP."""
+
+    __slots__ = ('code', 'args', '_prefix')
+
+    def __init__(self, code, *args):
+        self.code = code
+        self.args = args
+        self._prefix = VERSION + code
+
+    def data(self, *values):
+        """Encodes callback_data for this action."""
+        if len(values) != len(self.args):
+            raise TypeError(f"Action {self.code!r} takes {len(self.args)} arguments, got {len(values)}")
+        data = SEP.join((self._prefix, *(arg.encode(v) for arg, v in zip(self.args, values))))
+        if len(data.encode('utf-8')) > MAX_DATA_BYTES:
+            raise ValueError(f"Callback data {data!r} is longer than {MAX_DATA_BYTES} bytes")
+        return data
+
+    def decode(self, rest):
+        """Returns the arguments encoded in `rest` (the data after the code), or None if malformed."""
+        if not self.args:
+            return [] if not rest else None
+        parts = rest.split(SEP, len(self.args) - 1) if rest else []
+        if len(parts) != len(self.args):
+            return None
+        try:
+            return [arg.decode(part) for arg, part in zip(self.args, parts)]
+        except ValueError:
+            return None
+
+    def parse(self, data):
+        """Returns the arguments if `data` is this action, else None."""
+        code, _, rest = data[len(VERSION):].partition(SEP)
+        return self.decode(rest) if data[:len(VERSION)] == VERSION and code == self.code else None
+
+    def matches(self, data):
+        """CallbackQueryHandler pattern for handlers outside the router (conversation steps)."""
+        return isinstance(data, str) and self.parse(data) is not None
+
+
+# --- Actions ---
+
+# Customer side
+CATEGORIES = Action("c")
+PRODUCTS = Action("p", STR)                     # cat_id
+PRODUCT = Action("d", STR)                      # prod_id
+BUY = Action("b")
+MY_ORDERS = Action("o", CURSOR)
+
+# Admin panel
+ADMIN_PANEL = Action("A")
+CATEGORY_MANAGER = Action("mc")
+PRODUCT_MANAGER = Action("mp")
+STOCK_MANAGER = Action("ms")
+PENDING_ORDERS = Action("po")
+ORDER_VIEW = Action("ov", CURSOR)
+APPROVE = Action("ap", ORDER)
+REJECT = Action("rj", ORDER)
+BULK = Action("k", STR, CURSOR)                 # verb, page cursor
+BULK_TOGGLE = Action("kt", CURSOR, ORDER)
+STATS = Action("st")
+STATS_RECOUNT = Action("sr")
+HEALTH = Action("h")
+LOGS = Action("l", OPTIONAL_INT, INT)           # EVENT_TYPES index (None: all), page
+NOTIFY = Action("n")
+
+# Admin conversations (handled by their ConversationHandler, not the router)
+CATEGORY_ADD = Action("ca")
+STOCK_ADD = Action("sa")
+STOCK_PRODUCT = Action("sp", STR)               # prod_id
+STOCK_CANCEL = Action("sx")
+SEARCH = Action("q")
+BROADCAST = Action("bc")
+RECONCILE = Action("rc")
+
+
+def _legacy_order_view(rest):
+    """ADMIN_ORDER_VIEW_ carried the order itself ("order_100") before it carried a cursor."""
+    if rest.startswith("order_"):
+        return _cursor(f"b{order_number(rest) + 1}")    # that order, or the next older one still pending
+    return _cursor(rest)
+
+
+def _legacy_my_orders(rest):
+    """MY_ORDERS_ buttons with a page number rather than a cursor open the newest page."""
+    return "b" if rest.isdigit() else _cursor(rest)
+
+
+# Buttons sent before the versioned encoding, still under old messages: the old
+# payload maps to an action whose only argument is decoded from the rest of the
+# payload; if that fails (ValueError), the button is treated as expired.
+_LEGACY_EXACT = {
+    "BACK_CATEGORIES": CATEGORIES, "BUY_NOW": BUY, "ADMIN_PANEL_BACK": ADMIN_PANEL,
+    "ADMIN_MANAGER_CATEGORY": CATEGORY_MANAGER, "ADMIN_MANAGER_STOCK": STOCK_MANAGER,
+    "ADMIN_ORDERS_PENDING": PENDING_ORDERS, "ADMIN_STATS": STATS, "ADMIN_HEALTH": HEALTH, "ADMIN_NOTIFY": NOTIFY,
+}
+_LEGACY_PREFIXES = (
+    ("ADMIN_APPROVE_", APPROVE, str), ("ADMIN_REJECT_", REJECT, str),
+    ("ADMIN_ORDER_VIEW_", ORDER_VIEW, _legacy_order_view), ("MY_ORDERS_", MY_ORDERS, _legacy_my_orders),
+    ("CAT_ID_", PRODUCTS, str), ("BACK_TO_PRODUCTS_", PRODUCTS, str), ("PROD_ID_", PRODUCT, str),
+)
+
+
+class Route:
+    __slots__ = ('action', 'handler', 'admin')
+
+    def __init__(self, action, handler, admin):
+        self.action = action
+        self.handler = handler
+        self.admin = admin
+
+
+class CallbackRouter:
+    """Resolves each callback query to its handler with one dict lookup on the action code.
+
+    Registered as a single CallbackQueryHandler after the conversations. The router
+    answers the query, checks `is_admin` for admin routes, then awaits
+    handler(query, context, *arguments). Taps on unknown or stale buttons get a short
+    notice instead of silence.
+    """
+
+    def __init__(self, is_admin):
+        self.is_admin = is_admin
+        self.routes = {}        # action code -> Route
+
+    def add(self, action, handler, admin=False):
+        if action.code in self.routes:
+            raise ValueError(f"Action code {action.code!r} is already routed")
+        self.routes[action.code] = Route(action, handler, admin)
+
+    def resolve(self, data):
+        """Returns (route, arguments) for callback data, or None if no route takes it."""
+        if not data:
+            return None
+        if data[:len(VERSION)] == VERSION:
+            code, _, rest = data[len(VERSION):].partition(SEP)
+            route = self.routes.get(code)
+            if route is None:
+                return None
+            args = route.action.decode(rest)
+            return (route, args) if args is not None else None
+        return self._resolve_legacy(data)
+
+    def _resolve_legacy(self, data):
+        action, args = _LEGACY_EXACT.get(data), []
+        if action is None:
+            for prefix, prefixed_action, decode in _LEGACY_PREFIXES:
+                if data.startswith(prefix):
+                    try:
+                        action, args = prefixed_action, [decode(data[len(prefix):])]
+                    except ValueError:
+                        return None
+                    break
+        route = action and self.routes.get(action.code)
+        return (route, args) if route else None
+
+    async def dispatch(self, update, context):
+        query = update.callback_query
+        resolved = self.resolve(query.data)
+        if resolved is None:
+            await query.answer("This button has expired. Please open the menu again.")
+            return
+        route, args = resolved
+        await query.answer()
+        if route.admin and not self.is_admin(query.from_user.id):
+            return
+        await route.handler(query, context, *args)
@@ -0,0 +1,119 @@
+# catalog.py - Pre-rendered catalog screens (category list, product lists, product cards)
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+import callbacks
+
+
+class CatalogCache:
+    """Finished text + markup for every catalog screen, built once from the store.
+
+    Browsing only reads these dicts: no storage access, no markup building. Products
+    are indexed by category, so a product list never scans the whole catalog. The
+    store reports each category/product change (Storage.add_catalog_listener),
+    including a product selling out or coming back into stock, and only the screens
+    showing it are dropped, to be rebuilt on the next tap.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._categories = None     # (text, markup) of the category list; () when empty, None when not built
+        self._by_category = None    # cat_id -> [prod_id, ...] in catalog order
+        self._product_cat = {}      # prod_id -> cat_id
+        self._product_lists = {}    # cat_id -> (text, markup)
+        self._cards = {}            # prod_id -> (text, markup)
+        store.add_catalog_listener(self.invalidate)
+
+    def invalidate(self, kind, key):
+        """Drops the rendered screens that show the changed category or product."""
+        if kind == "category":
+            self._categories = None
+            self._product_lists.pop(key, None)
+        elif kind == "product":
+            self._cards.pop(key, None)
+            if self._by_category is None:
+                return
+            product = self.store.get_product(key)
+            # The product may have been added, removed or moved to another category
+            for cat_id in {self._product_cat.get(key), product and product.cat_id} - {None}:
+                self._by_category[cat_id] = [prod_id for prod_id, _ in self.store.products_in_category(cat_id)]
+                self._product_lists.pop(cat_id, None)
+            if product:
+                self._product_cat[key] = product.cat_id
+            else:
+                self._product_cat.pop(key, None)
+
+    def _index(self):
+        if self._by_category is None:
+            self._by_category, self._product_cat = {}, {}
+            for prod_id, product in self.store.list_products():
+                self._by_category.setdefault(product.cat_id, []).append(prod_id)
+                self._product_cat[prod_id] = product.cat_id
+        return self._by_category
+
+    # --- Rendered screens ---
+
+    def categories(self):
+        """Returns (text, markup) for the category list, or None if there are no categories."""
+        if self._categories is None:
+            categories = self.store.list_categories()
+            keyboard = [[InlineKeyboardButton(cat_data.name, callback_data=callbacks.PRODUCTS.data(cat_id))]
+                        for cat_id, cat_data in categories]
+            # An empty catalog is cached as () so it is not re-read on every tap either
+            self._categories = ("📂 **Select Category**", InlineKeyboardMarkup(keyboard)) if categories else ()
+        return self._categories or None
+
+    def products(self, cat_id):
+        """Returns (text, markup) listing a category's products."""
+        rendered = self._product_lists.get(cat_id)
+        if rendered is None:
+            keyboard = []
+            product_list_text = "📦 **Available Products:**\n\n"
+            prod_ids = self._index().get(cat_id, [])
+            for prod_id in prod_ids:
+                prod_data = self.store.get_product(prod_id)
+                if self.sold_out(prod_id):
+                    product_list_text += f"• {prod_data.name} – {prod_data.duration} – ❌ Sold out\n"
+                    label = f"{prod_data.name} (Sold out)"
+                else:
+                    product_list_text += f"• {prod_data.name} – {prod_data.duration} – {prod_data.price}৳\n"
+                    label = f"{prod_data.name} ({prod_data.price}৳)"
+                keyboard.append([InlineKeyboardButton(label, callback_data=callbacks.PRODUCT.data(prod_id))])
+
+            if not prod_ids:
+                product_list_text += "*No products available in this category.*"
+
+            keyboard.append([InlineKeyboardButton("⬅ Back to Categories", callback_data=callbacks.CATEGORIES.data())])
+            rendered = (product_list_text, InlineKeyboardMarkup(keyboard))
+            if prod_ids:
+                # Empty (or unknown) categories are cheap to render and not worth a cache slot each
+                self._product_lists[cat_id] = rendered
+        return rendered
+
+    def product_card(self, prod_id):
+        """Returns (text, markup) for a product's order summary, or None if it does not exist."""
+        rendered = self._cards.get(prod_id)
+        if rendered is None:
+            product = self.store.get_product(prod_id)
+            if not product:
+                return None
+            summary = (
+                "🧾 **ORDER SUMMARY**\n\n"
+                f"Product: **{product.name}**\n"
+                f"Duration: **{product.duration}**\n"
+                f"Country: **{product.country}**\n"
+                f"Price: **{product.price}৳**\n\n"
+                "📜 **Rules:**\n"
+                f"{product.rules}\n\n"
+            )
+            keyboard = [[InlineKeyboardButton("⬅ Back", callback_data=callbacks.PRODUCTS.data(product.cat_id))]]
+            if self.sold_out(prod_id):
+                summary += "❌ **Sold out.** Please check back soon."
+            else:
+                keyboard.insert(0, [InlineKeyboardButton("🛒 Buy Now", callback_data=callbacks.BUY.data())])
+            rendered = self._cards[prod_id] = (summary, InlineKeyboardMarkup(keyboard))
+        return rendered
+
+    def sold_out(self, prod_id):
+        """True if the product has no unsold stock (a maintained counter, not a scan)."""
+        return self.store.stock_counts(prod_id)[0] == 0
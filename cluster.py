@@ -0,0 +1,264 @@
+# cluster.py - Multi-process deployment: a webhook front door hashing updates by user to a pool of bot workers
+#
+# main.py runs the whole bot in one asyncio process, so it is limited to one core.
+# Running this script instead spreads the handlers over CLUSTER_WORKERS processes:
+#     python cluster.py
+# This process is the front door. It receives Telegram's webhook on WEBHOOK_LISTEN:WEBHOOK_PORT
+# (same WEBHOOK_* settings as main.py), reads only the sender out of each update and
+# forwards the raw update over a local socket to worker (user ID % CLUSTER_WORKERS).
+# A user always reaches the same worker, in arrival order. PTB keeps conversation
+# state and user_data (e.g. waiting_payment_for_order) in the worker's memory, so
+# that state stays with the process that holds it; it is also saved to the shared
+# store (persistence.py), so a restarted worker picks its users up where they were.
+#
+# Workers run main.py's handlers on a shared STORAGE_BACKEND = "sqlite" file; its
+# transactions keep order transitions atomic across processes (see SqliteStore).
+# Worker 0 also runs the archiver; each worker expires its own users' unpaid orders. With METRICS_ENABLED, worker N serves its metrics
+# on METRICS_PORT + N. A worker that dies is restarted; until it is back, its updates
+# get a 503 and Telegram retries them.
+
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import secrets
+import signal
+import socket
+import struct
+
+import tornado.httpserver
+import tornado.web
+from telegram import Bot, Update
+from telegram.ext import BaseUpdateProcessor
+
+from storage import EntityLocks
+
+logger = logging.getLogger(__name__)
+
+# Each update travels to its worker as a 4-byte big-endian length, then the raw JSON
+_FRAME_HEADER = struct.Struct('>I')
+
+# Seconds between checks that every worker is alive, and to wait for one to finish on shutdown
+_WATCH_INTERVAL = 1.0
+_STOP_TIMEOUT = 30.0
+
+
+class UserOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Runs up to `max_concurrent_updates` updates at once, but each user's one at a time, in arrival order.
+
+    PTB starts processing updates in the order they arrive and asyncio locks are first
+    come, first served, so a user's second message waits for their first instead of
+    racing it. Used by main.py both alone and in each worker of the cluster.
+
+    The user's lock is taken before one of the `max_concurrent_updates` slots: an update
+    waiting for its user's previous one holds no slot, so a user sending a burst
+    occupies one slot at a time and everyone else's updates keep flowing.
+    """
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        self._senders = EntityLocks()
+
+    async def process_update(self, update, coroutine):
+        sender = isinstance(update, Update) and (update.effective_user or update.effective_chat)
+        if not sender:
+            await super().process_update(update, coroutine)
+            return
+        async with self._senders("user", sender.id):
+            await super().process_update(update, coroutine)
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+
+def routing_key(update):
+    """The ID of the user (else the chat) a raw Bot API update comes from, or None."""
+    for value in update.values():
+        if isinstance(value, dict):
+            for field in ('from', 'user', 'chat'):
+                sender = value.get(field)
+                if isinstance(sender, dict) and 'id' in sender:
+                    return sender['id']
+    return None
+
+
+# --- Workers ---
+
+def run_worker(index, workers, sock):
+    """Worker process `index` of `workers`: runs the bot's handlers on the updates the front door sends over `sock`."""
+    # Ctrl+C reaches the whole process group; the front door decides when workers stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    import main as bot
+    bot.join_cluster(index, workers)
+    bot.open_storage()
+    application = bot.build_application(updater=False)
+    asyncio.run(_serve_worker(bot, application, sock))
+
+
+async def _serve_worker(bot, application, sock):
+    reader, _ = await asyncio.open_connection(sock=sock)
+    try:
+        async with application:
+            await bot.on_startup(application)
+            await application.start()
+            try:
+                while True:
+                    try:
+                        header = await reader.readexactly(_FRAME_HEADER.size)
+                        body = await reader.readexactly(_FRAME_HEADER.unpack(header)[0])
+                    except asyncio.IncompleteReadError:
+                        break   # the front door closed the stream: finish what is queued and exit
+                    await application.update_queue.put(Update.de_json(json.loads(body), application.bot))
+            finally:
+                await application.stop()
+    finally:
+        # After the application's shutdown, which writes out the persisted user state (as in run_polling)
+        await bot.on_shutdown(application)
+
+
+class Worker:
+    """One worker process and the stream the front door writes its updates to."""
+
+    def __init__(self, index, workers):
+        self.index = index
+        self.workers = workers
+        self.process = None
+        self.writer = None
+
+    @property
+    def alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    async def start(self):
+        parent_sock, child_sock = socket.socketpair()
+        context = multiprocessing.get_context('spawn')
+        self.process = context.Process(target=run_worker, args=(self.index, self.workers, child_sock), name=f"bot-worker-{self.index}")
+        self.process.start()
+        child_sock.close()
+        _, self.writer = await asyncio.open_connection(sock=parent_sock)
+
+    async def forward(self, body):
+        """Sends one raw update to the worker; False if it could not be handed over."""
+        if self.writer is None or self.writer.is_closing() or not self.alive:
+            return False
+        # Written before the first await, so updates leave in the order they arrived
+        self.writer.write(_FRAME_HEADER.pack(len(body)) + body)
+        try:
+            await self.writer.drain()
+        except ConnectionError:
+            return False
+        return True
+
+    async def stop(self):
+        """Closes the stream (the worker finishes its queued updates and exits) and waits for the process."""
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        if self.process is not None:
+            await asyncio.to_thread(self.process.join, _STOP_TIMEOUT)
+            if self.process.is_alive():
+                logger.warning("Worker %d did not stop in %.0fs; terminating it.", self.index, _STOP_TIMEOUT)
+                self.process.terminate()
+                await asyncio.to_thread(self.process.join)
+
+
+class WebhookHandler(tornado.web.RequestHandler):
+    """Accepts Telegram's webhook POSTs and hands each update to its user's worker."""
+
+    def initialize(self, front_door):
+        self.front_door = front_door
+
+    async def post(self):
+        token = self.request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not secrets.compare_digest(token.encode(), self.front_door.secret_token.encode()):
+            raise tornado.web.HTTPError(403)
+        try:
+            update = json.loads(self.request.body)
+        except ValueError:
+            raise tornado.web.HTTPError(400)
+        if not await self.front_door.worker_for(update).forward(self.request.body):
+            # Telegram retries updates that were not acknowledged
+            raise tornado.web.HTTPError(503)
+
+
+class FrontDoor:
+    """The webhook endpoint plus the pool of workers behind it; restarts workers that die."""
+
+    def __init__(self, workers, secret_token):
+        self.workers = [Worker(index, workers) for index in range(workers)]
+        self.secret_token = secret_token
+
+    def worker_for(self, update):
+        key = routing_key(update)
+        return self.workers[(update.get('update_id', 0) if key is None else key) % len(self.workers)]
+
+    async def run(self, listen, port, path, webhook_url, max_connections, allowed_updates, bot):
+        for worker in self.workers:
+            await worker.start()
+        app = tornado.web.Application([(rf"/{path}/?", WebhookHandler, {"front_door": self})])
+        server = tornado.httpserver.HTTPServer(app)
+        server.listen(port, listen)
+        await bot.set_webhook(url=webhook_url, secret_token=self.secret_token,
+                              max_connections=max_connections, allowed_updates=allowed_updates)
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop.set)
+        print(f"Front door is receiving updates on {listen}:{port}/{path} for {len(self.workers)} workers...")
+        try:
+            while not stop.is_set():
+                try:
+                    await asyncio.wait_for(stop.wait(), _WATCH_INTERVAL)
+                except asyncio.TimeoutError:
+                    await self._restart_dead_workers()
+        finally:
+            server.stop()
+            await asyncio.gather(*(worker.stop() for worker in self.workers))
+
+    async def _restart_dead_workers(self):
+        for worker in self.workers:
+            if not worker.alive:
+                logger.error("Worker %d exited (code %s); restarting it.", worker.index, worker.process.exitcode)
+                await worker.stop()
+                await worker.start()
+
+
+async def _run_cluster(bot_module, workers):
+    from config import BOT_TOKEN, BOT_API_BASE_URL, BOT_API_BASE_FILE_URL, WEBHOOK_LISTEN, WEBHOOK_PORT
+    from config import WEBHOOK_PATH, WEBHOOK_URL, WEBHOOK_SECRET_TOKEN, WEBHOOK_MAX_CONNECTIONS
+    # Schema upgrades and the one-shot moves run once here, before the workers open the store together
+    bot_module.open_storage()
+    await bot_module.store.close()
+    bot_module.activity.close()
+
+    front_door = FrontDoor(workers, WEBHOOK_SECRET_TOKEN or secrets.token_urlsafe(32))
+    async with Bot(BOT_TOKEN, base_url=BOT_API_BASE_URL, base_file_url=BOT_API_BASE_FILE_URL) as bot:
+        await front_door.run(WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+                             WEBHOOK_MAX_CONNECTIONS, bot_module.ALLOWED_UPDATES, bot)
+
+
+def main():
+    try:
+        from config import STORAGE_BACKEND, CLUSTER_WORKERS
+    except ImportError:
+        print("FATAL ERROR: config.py not found or incomplete. Exiting.")
+        exit()
+    if STORAGE_BACKEND != "sqlite":
+        # The JSON store lives in one process's memory; workers can only share the SQLite file
+        print('FATAL ERROR: cluster.py needs STORAGE_BACKEND = "sqlite" in config.py. Exiting.')
+        exit()
+    import main as bot
+    bot.prepare_store()
+    asyncio.run(_run_cluster(bot, CLUSTER_WORKERS or os.cpu_count() or 1))
+
+
+if __name__ == "__main__":
+    main()
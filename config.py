@@ -11,3 +11,92 @@ ADMIN_USERNAME = "@MinexxProo"
 
 # ৩. পেমেন্টের জন্য মোবাইল ব্যাংকিং নম্বর
 PAYMENT_NUMBER = "01877576843"
+
+# ৪. ডাটাবেস সেটিংস
+# ডাটাবেস মেমোরিতে থাকে; প্রতি DB_FLUSH_INTERVAL সেকেন্ড পরপর অথবা
+# DB_FLUSH_THRESHOLD সংখ্যক পরিবর্তন জমা হলে ফাইলে সেভ হয় (বন্ধ করার সময়ও সেভ হয়)
+DB_FILE = "database.json"
+DB_FLUSH_INTERVAL = 5
+DB_FLUSH_THRESHOLD = 100
+
+# ৫. জার্নাল ও কমপ্যাকশন
+# প্রতিটি পরিবর্তন ছোট রেকর্ড হিসেবে DB_JOURNAL_FILE-এ যোগ হয়; প্রতি DB_COMPACT_INTERVAL
+# সেকেন্ড পরপর অথবা জার্নাল DB_COMPACT_BYTES ছাড়ালে তা DB_FILE স্ন্যাপশটে একীভূত হয়
+DB_JOURNAL_FILE = "database.journal"
+DB_COMPACT_INTERVAL = 300
+DB_COMPACT_BYTES = 1048576
+
+# ৬. স্টোরেজ ব্যাকএন্ড: "json" (database.json + জার্নাল) অথবা "sqlite"
+# "sqlite" প্রথমবার চালু করলে database.json থেকে ডাটা স্বয়ংক্রিয়ভাবে SQLITE_FILE-এ মাইগ্রেট হয়
+# (ম্যানুয়ালি: python sqlite_store.py database.json database.sqlite3)
+STORAGE_BACKEND = "json"
+SQLITE_FILE = "database.sqlite3"
+
+# ৭. একসাথে কতগুলো আপডেট প্রসেস হবে (1 = একটির পর একটি)
+CONCURRENT_UPDATES = 32
+
+# ৮. ব্রডকাস্ট (পেন্ডিং রিমাইন্ডার ও অফার): সেকেন্ডে সর্বোচ্চ BROADCAST_RATE টি মেসেজ,
+# একই চ্যাটে BROADCAST_CHAT_INTERVAL সেকেন্ডে একটি, একসাথে BROADCAST_CONCURRENCY টি পাঠানো হয়
+BROADCAST_RATE = 25
+BROADCAST_CHAT_INTERVAL = 1
+BROADCAST_CONCURRENCY = 8
+BROADCAST_MAX_RETRIES = 3
+
+# ৯. আপডেট গ্রহণের পদ্ধতি: WEBHOOK_ENABLED = False হলে long polling, True হলে ওয়েবহুক
+# ওয়েবহুকে Telegram সরাসরি https://<WEBHOOK_URL>/<WEBHOOK_PATH>-এ আপডেট পাঠায়
+# (WEBHOOK_URL হলো পাবলিক HTTPS ঠিকানা, যা WEBHOOK_LISTEN:WEBHOOK_PORT-এ ফরওয়ার্ড হয়)।
+# WEBHOOK_SECRET_TOKEN খালি থাকলে প্রতিবার চালু করার সময় র‍্যান্ডম টোকেন তৈরি হয়।
+WEBHOOK_ENABLED = False
+WEBHOOK_LISTEN = "0.0.0.0"
+WEBHOOK_PORT = 8443
+WEBHOOK_PATH = "telegram"
+WEBHOOK_URL = "https://example.com"
+WEBHOOK_SECRET_TOKEN = ""
+WEBHOOK_MAX_CONNECTIONS = 40
+
+# ১০. Bot API সার্ভারের ঠিকানা (লোকাল Bot API সার্ভার বা টেস্টের জন্য fake_bot_api.py ব্যবহার করতে বদলান)
+BOT_API_BASE_URL = "https://api.telegram.org/bot"
+BOT_API_BASE_FILE_URL = "https://api.telegram.org/file/bot"
+
+# ১১. অ্যাক্টিভিটি লগ: সাম্প্রতিক ACTIVITY_LOG_RECENT টি ইভেন্ট মেমোরিতে থাকে, সব ইভেন্ট ACTIVITY_LOG_FILE-এ
+# যোগ হয়; ফাইল ACTIVITY_LOG_MAX_BYTES ছাড়ালে .1, .2 … নামে সরে যায় (সর্বোচ্চ ACTIVITY_LOG_BACKUPS টি)
+ACTIVITY_LOG_FILE = "activity.log"
+ACTIVITY_LOG_RECENT = 200
+ACTIVITY_LOG_MAX_BYTES = 1048576
+ACTIVITY_LOG_BACKUPS = 10
+
+# ১২. পুরনো অর্ডারের আর্কাইভ: ARCHIVE_AFTER_DAYS দিনের বেশি পুরনো ডেলিভারড/রিজেক্টেড অর্ডার এবং সব
+# এক্সপায়ার্ড অর্ডার (বয়স যা-ই হোক) প্রতি ARCHIVE_INTERVAL সেকেন্ড পরপর মূল ডাটাবেস থেকে ARCHIVE_DIR-এ
+# মাসভিত্তিক সংকুচিত ফাইলে সরে যায়; সার্চ ও "My Orders" থেকে সেগুলো আগের মতোই দেখা যায় (সর্বোচ্চ ARCHIVE_CACHED_SEGMENTS টি মাস মেমোরিতে থাকে)
+ARCHIVE_DIR = "archive"
+ARCHIVE_AFTER_DAYS = 30
+ARCHIVE_INTERVAL = 3600
+ARCHIVE_CACHED_SEGMENTS = 4
+
+# ১৩. মেট্রিক্স: প্রতিটি হ্যান্ডলার, ডাটাবেস কল ও Telegram API কলের সময় মাপা হয় (অ্যাডমিন প্যানেলের "📈 Health")।
+# METRICS_ENABLED = True হলে http://METRICS_LISTEN:METRICS_PORT/metrics-এ Prometheus ফরম্যাটেও পাওয়া যায়
+METRICS_ENABLED = False
+METRICS_LISTEN = "127.0.0.1"
+METRICS_PORT = 9464
+
+# ১৪. মাল্টি-প্রসেস ডিপ্লয়মেন্ট (python main.py-এর বদলে python cluster.py): একটি ওয়েবহুক প্রসেস আপডেট গ্রহণ করে
+# এবং ইউজার আইডি অনুযায়ী CLUSTER_WORKERS টি বট প্রসেসে ভাগ করে দেয় (0 = CPU কোর সংখ্যা)।
+# STORAGE_BACKEND = "sqlite" এবং WEBHOOK_* সেটিংস প্রয়োজন। প্রতিটি প্রসেস প্রতি CLUSTER_SYNC_INTERVAL
+# সেকেন্ড পরপর অন্য প্রসেসের ক্যাটাগরি ও আর্কাইভ পরিবর্তন দেখে নেয়।
+CLUSTER_WORKERS = 0
+CLUSTER_SYNC_INTERVAL = 1
+
+# ১৫. লো-স্টক অ্যালার্ট: কোনো প্রোডাক্টের অবিক্রীত স্টক LOW_STOCK_THRESHOLD-এ নেমে এলে এবং শেষ হয়ে গেলে
+# অ্যাডমিনকে মেসেজ পাঠানো হয়। প্রোডাক্ট অনুযায়ী আলাদা সীমা: /lowstock <product ID> <সংখ্যা>
+# স্টক শেষ হলে প্রোডাক্টটি "Sold out" দেখায় এবং কেনা যায় না।
+LOW_STOCK_THRESHOLD = 5
+
+# ১৬. পেমেন্টের সময়সীমা: Buy Now চাপার পর ORDER_PAYMENT_TIMEOUT সেকেন্ডের মধ্যে পেমেন্ট জমা না দিলে অর্ডারটি
+# "expired" হয়ে যায় এবং পরের আর্কাইভ রানে মূল ডাটাবেস থেকে আর্কাইভে সরে যায় (0 = কখনো না)।
+# ORDER_EXPIRY_NOTIFY = True হলে ইউজারকে মেসেজ দিয়ে জানানো হয়
+ORDER_PAYMENT_TIMEOUT = 3600
+ORDER_EXPIRY_NOTIFY = True
+
+# ১৭. রিস্টার্টের পরও ইউজারের চলমান ধাপ (পেমেন্টের অপেক্ষায় থাকা অর্ডার, অ্যাডমিনের কথোপকথন) ডাটাবেসে
+# সংরক্ষিত থাকে; পরিবর্তনগুলো প্রতি PERSISTENCE_INTERVAL সেকেন্ড পরপর একসাথে লেখা হয় (বন্ধ করার সময়ও)
+PERSISTENCE_INTERVAL = 10
@@ -0,0 +1,106 @@
+# expiry.py - Expires unpaid orders once their payment deadline passes, in deadline order from a min-heap
+
+import asyncio
+import datetime
+import heapq
+import logging
+import time
+
+from models import OrderStatus
+
+logger = logging.getLogger(__name__)
+
+
+class OrderExpiry:
+    """Expires orders still waiting for payment `ttl` seconds after they were created (ttl 0: never).
+
+    Deadlines sit in a min-heap of (deadline, order_id), so a sweep pops only the orders
+    that are due: O(expired · log n), never a scan of the store. The store is read once,
+    in start(), for orders created before this process; after that buy_now_action adds
+    each new order with track(). Paid orders are not removed from the heap: when their
+    deadline comes up, expire_orders() leaves them alone, as it only moves orders still
+    waiting for payment. In a cluster each worker tracks only the orders of the users
+    routed to it (start()'s `owns_user`), whose user_data it holds.
+
+    Expired orders are finished orders, so the archiver moves them out of the hot store
+    on its next pass (Storage.archivable_orders).
+    """
+
+    def __init__(self, store, ttl, batch_size=500, retry_interval=30):
+        self.store = store
+        self.ttl = ttl
+        self.batch_size = batch_size
+        self.retry_interval = retry_interval
+        self._heap = []         # (deadline as a Unix timestamp, order_id)
+        self._wakeup = None
+        self._sweeper = None
+
+    def __len__(self):
+        return len(self._heap)
+
+    def track(self, order_id, created_at=None):
+        """Schedules an order's expiry; `created_at` is its ISO timestamp (default: now)."""
+        if not self.ttl:
+            return
+        created = time.time() if created_at is None else datetime.datetime.fromisoformat(created_at).timestamp()
+        entry = (created + self.ttl, order_id)
+        heapq.heappush(self._heap, entry)
+        if self._wakeup is not None and self._heap[0] is entry:
+            self._wakeup.set()   # new earliest deadline: the sweeper is sleeping until a later one
+
+    def sweep(self, now=None):
+        """Expires up to batch_size orders whose deadline has passed; returns the expired order IDs."""
+        now = time.time() if now is None else now
+        due = []
+        while self._heap and self._heap[0][0] <= now and len(due) < self.batch_size:
+            due.append(heapq.heappop(self._heap)[1])
+        if not due:
+            return []
+        try:
+            expired, _ = self.store.expire_orders(due)
+        except Exception:
+            # Put them back so the next attempt still sees them
+            for order_id in due:
+                heapq.heappush(self._heap, (now, order_id))
+            raise
+        return expired
+
+    # --- Background task ---
+
+    def start(self, on_expired, owns_user=None):
+        """Loads the unpaid orders and starts sweeping on the running event loop.
+
+        `on_expired(order_ids)` (a coroutine function) is awaited after each sweep that expired orders.
+        With `owns_user(user_id)`, only the orders of users it accepts are loaded.
+        """
+        if self._sweeper is not None or not self.ttl:
+            return
+        for order_id, order in self.store.orders_with_status(OrderStatus.WAITING_PAYMENT):
+            if owns_user is None or owns_user(order.user_id):
+                self.track(order_id, order.created_at)
+        self._wakeup = asyncio.Event()
+        self._sweeper = asyncio.create_task(self._run(on_expired))
+
+    async def _run(self, on_expired):
+        while True:
+            delay = self._heap[0][0] - time.time() if self._heap else None
+            if delay is None or delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                expired = self.sweep()
+                if expired:
+                    logger.info("Expired %d unpaid orders.", len(expired))
+                    await on_expired(expired)
+            except Exception:
+                logger.exception("Expiring unpaid orders failed; retrying in %ss.", self.retry_interval)
+                await asyncio.sleep(self.retry_interval)
+
+    def close(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = self._wakeup = None
@@ -0,0 +1,221 @@
+# fake_bot_api.py - Local stand-in for the Telegram Bot API, for end-to-end tests of polling and webhook mode
+#
+# Point the bot at it in config.py:
+#     BOT_API_BASE_URL = "http://127.0.0.1:8081/bot"
+#     BOT_API_BASE_FILE_URL = "http://127.0.0.1:8081/file/bot"
+# and, for webhook mode, WEBHOOK_ENABLED = True, WEBHOOK_LISTEN = "127.0.0.1",
+# WEBHOOK_URL = "http://127.0.0.1:8443". Start this script, then the bot (use a
+# throwaway database):
+#     python fake_bot_api.py --port 8081 --updates 500 --concurrency 20
+#
+# It answers the bot's API calls, feeds it synthetic text messages from distinct users
+# (POSTed to the webhook once one is registered, otherwise handed out by getUpdates)
+# and reports the latency from each update to the bot's first reply to that chat.
+
+import argparse
+import concurrent.futures
+import itertools
+import json
+import statistics
+import threading
+import time
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Fake Bot", "username": "fake_bot",
+            "can_join_groups": True, "can_read_all_group_messages": False, "supports_inline_queries": False}
+
+
+class FakeBotAPI:
+    """Bot API state: the registered webhook, pending updates and the replies seen per chat."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.webhook = None                 # setWebhook parameters, once registered
+        self.updates = []                   # handed out by getUpdates when no webhook is set
+        self.updates_ready = threading.Condition(self.lock)
+        self.ready = threading.Event()      # the bot has started receiving (polling or webhook)
+        self.replies = {}                   # chat_id -> threading.Event, set on the first reply
+        self.calls = {}                     # method -> count
+        self._message_ids = itertools.count(1)
+        self._update_ids = itertools.count(1)
+
+    # --- Bot API methods ---
+
+    def call(self, method, params):
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        handler = getattr(self, f"api_{method}", None)
+        return handler(params) if handler else True
+
+    def api_getMe(self, params):
+        return BOT_USER
+
+    def api_setWebhook(self, params):
+        self.webhook = params
+        self.ready.set()
+        return True
+
+    def api_deleteWebhook(self, params):
+        self.webhook = None
+        return True
+
+    def api_getWebhookInfo(self, params):
+        webhook = self.webhook or {}
+        return {"url": webhook.get("url", ""), "has_custom_certificate": False,
+                "pending_update_count": len(self.updates)}
+
+    def api_getUpdates(self, params):
+        # Like Telegram, updates stay queued until a later call's offset confirms them
+        self.ready.set()
+        timeout = min(float(params.get("timeout") or 0), 1.0)
+        limit = int(params.get("limit") or 100)
+        offset = int(params.get("offset") or 0)
+        with self.updates_ready:
+            self.updates = [u for u in self.updates if u["update_id"] >= offset]
+            if not self.updates and timeout:
+                self.updates_ready.wait(timeout)
+            return self.updates[:limit]
+
+    def _message(self, params):
+        chat_id = int(params["chat_id"])
+        event = self.replies.get(chat_id)
+        if event is not None:
+            event.set()
+        return {"message_id": next(self._message_ids), "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"}, "from": BOT_USER, "text": params.get("text", "")}
+
+    api_sendMessage = _message
+    api_editMessageText = _message
+    api_sendDocument = _message
+    api_sendPhoto = _message
+
+    # --- Synthetic updates ---
+
+    def make_update(self, chat_id, text):
+        message = {"message_id": next(self._message_ids), "date": int(time.time()),
+                   "chat": {"id": chat_id, "type": "private", "first_name": "Load"},
+                   "from": {"id": chat_id, "is_bot": False, "first_name": "Load", "username": f"load{chat_id}"},
+                   "text": text}
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": next(self._update_ids), "message": message}
+
+    def deliver(self, update):
+        """Pushes an update to the bot the way Telegram would in the current mode."""
+        webhook = self.webhook
+        if webhook is None:
+            with self.updates_ready:
+                self.updates.append(update)
+                self.updates_ready.notify_all()
+            return
+        request = urllib.request.Request(webhook["url"], data=json.dumps(update).encode(), method="POST",
+                                         headers={"Content-Type": "application/json"})
+        if webhook.get("secret_token"):
+            request.add_header("X-Telegram-Bot-Api-Secret-Token", webhook["secret_token"])
+        with urllib.request.urlopen(request, timeout=10) as response:
+            response.read()
+
+
+def _parse_params(handler):
+    length = int(handler.headers.get("Content-Length") or 0)
+    body = handler.rfile.read(length).decode() if length else ""
+    if handler.headers.get("Content-Type", "").startswith("application/json"):
+        return json.loads(body or "{}")
+    params = {}
+    for key, value in urllib.parse.parse_qsl(body or urllib.parse.urlparse(handler.path).query):
+        try:
+            params[key] = json.loads(value)
+        except ValueError:
+            params[key] = value
+    return params
+
+
+def make_server(api, host, port):
+    class Handler(BaseHTTPRequestHandler):
+        def _handle(self):
+            # /bot<token>/<method>
+            method = urllib.parse.urlparse(self.path).path.rsplit("/", 1)[-1]
+            result = api.call(method, _parse_params(self))
+            body = json.dumps({"ok": True, "result": result}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        do_GET = do_POST = _handle
+
+        def log_message(self, format, *args):
+            pass
+
+    server_class = type("Server", (ThreadingHTTPServer,), {"request_queue_size": 256})
+    return server_class((host, port), Handler)
+
+
+def drive(api, count, concurrency, text, timeout):
+    """Sends `count` updates from distinct chats and returns the update -> first reply latencies."""
+    if api.webhook:
+        concurrency = min(concurrency, int(api.webhook.get("max_connections") or 40))
+    latencies, missed = [], 0
+
+    def one(chat_id):
+        event = api.replies[chat_id] = threading.Event()
+        started = time.perf_counter()
+        api.deliver(api.make_update(chat_id, text))
+        replied = event.wait(timeout)
+        return time.perf_counter() - started if replied else None
+
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as pool:
+        for latency in pool.map(one, range(100000, 100000 + count)):
+            if latency is None:
+                missed += 1
+            else:
+                latencies.append(latency)
+    return latencies, missed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Telegram Bot API stand-in with a latency driver.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--updates", type=int, default=200, help="synthetic updates to send (0 = just serve)")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--text", default="🆘 Support", help="message text of every synthetic update")
+    parser.add_argument("--timeout", type=float, default=10.0, help="seconds to wait for each reply")
+    args = parser.parse_args()
+
+    api = FakeBotAPI()
+    server = make_server(api, args.host, args.port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Fake Bot API listening on http://{args.host}:{args.port}/bot<token>/ — start the bot now.")
+
+    try:
+        if not args.updates:
+            threading.Event().wait()
+        api.ready.wait()
+        time.sleep(0.5)
+        mode = "webhook " + api.webhook["url"] if api.webhook else "polling"
+        print(f"Bot connected ({mode}); sending {args.updates} updates, {args.concurrency} at a time...")
+        started = time.perf_counter()
+        latencies, missed = drive(api, args.updates, args.concurrency, args.text, args.timeout)
+        elapsed = time.perf_counter() - started
+    except KeyboardInterrupt:
+        return
+    finally:
+        server.shutdown()
+
+    if latencies:
+        latencies.sort()
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        print(f"{len(latencies)} replies in {elapsed:.2f}s ({len(latencies) / elapsed:.0f}/s), {missed} missed")
+        print(f"latency p50 {statistics.median(latencies) * 1000:.1f} ms, p99 {p99 * 1000:.1f} ms, "
+              f"max {latencies[-1] * 1000:.1f} ms")
+    else:
+        print(f"No replies received ({missed} missed).")
+    print("API calls:", ", ".join(f"{m}={n}" for m, n in sorted(api.calls.items())))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,37 @@
 # main.py - Power Point Break Bot - Final Absolute Fixed Implementation
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, KeyboardButton, ReplyKeyboardMarkup
+from telegram.helpers import escape_markdown
 from telegram.ext import (
     Application, CommandHandler, CallbackQueryHandler, MessageHandler, 
-    filters, ConversationHandler, ContextTypes
+    filters, ConversationHandler, ContextTypes, TypeHandler
 )
+import asyncio
 import json
-import uuid
-import re
 import datetime
 import os 
 import logging
+import secrets
+import tempfile
+import time
+
+from models import User
+from storage import JsonStore, OrderStateError, order_number
+from sqlite_store import SqliteStore, migrate_json_to_sqlite
+from broadcast import Broadcaster, SENT, BLOCKED, FAILED
+from catalog import CatalogCache
+from stock_alerts import StockAlerts
+from expiry import OrderExpiry
+from persistence import StorePersistence
+from activity_log import ActivityLog, EVENT_TYPES, format_entry
+from archive import OrderArchive, run_archiver
+from metrics import Metrics, InstrumentedRequest
+from profiler import ProfileCapture, handler_functions, summarize
+import callbacks
+from callbacks import CallbackRouter
+from cluster import UserOrderedUpdateProcessor
+import stock_import
+import reconcile
 
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
                     level=logging.INFO)
@@ -18,6 +39,20 @@ logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s
 # Import configuration settings
 try:
     from config import BOT_TOKEN, ADMIN_ID, PAYMENT_NUMBER, ADMIN_USERNAME
+    from config import DB_FILE, DB_JOURNAL_FILE, DB_FLUSH_INTERVAL, DB_FLUSH_THRESHOLD
+    from config import DB_COMPACT_INTERVAL, DB_COMPACT_BYTES
+    from config import STORAGE_BACKEND, SQLITE_FILE
+    from config import CONCURRENT_UPDATES
+    from config import BROADCAST_RATE, BROADCAST_CHAT_INTERVAL, BROADCAST_CONCURRENCY, BROADCAST_MAX_RETRIES
+    from config import WEBHOOK_ENABLED, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_URL
+    from config import WEBHOOK_SECRET_TOKEN, WEBHOOK_MAX_CONNECTIONS, BOT_API_BASE_URL, BOT_API_BASE_FILE_URL
+    from config import ACTIVITY_LOG_FILE, ACTIVITY_LOG_RECENT, ACTIVITY_LOG_MAX_BYTES, ACTIVITY_LOG_BACKUPS
+    from config import ARCHIVE_DIR, ARCHIVE_AFTER_DAYS, ARCHIVE_INTERVAL, ARCHIVE_CACHED_SEGMENTS
+    from config import METRICS_ENABLED, METRICS_LISTEN, METRICS_PORT
+    from config import CLUSTER_SYNC_INTERVAL
+    from config import LOW_STOCK_THRESHOLD
+    from config import ORDER_PAYMENT_TIMEOUT, ORDER_EXPIRY_NOTIFY
+    from config import PERSISTENCE_INTERVAL
 except ImportError:
     print("FATAL ERROR: config.py not found or incomplete. Exiting.")
     exit()
@@ -26,27 +61,81 @@ except ImportError:
 CATEGORY_NAME, CATEGORY_BANNER = range(2)
 STOCK_INPUT, STOCK_SELECT_PRODUCT = range(9, 11)
 SEARCH_INPUT = 11 
+BROADCAST_INPUT = 12
+RECONCILE_INPUT = 13
+
+# Only messages and button presses are handled, so Telegram need not send anything else
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY]
 
 # --- Core Utility Functions (Database & Logging) ---
 
-def load_db():
-    """Loads data from database.json."""
-    try:
-        with open('database.json', 'r') as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        return {"users": {}, "categories": {}, "products": {}, "stock": {}, "orders": {}, "logs": [], "next_order_id": 100}
-
-def save_db(db):
-    """Saves data back to database.json."""
-    with open('database.json', 'w') as f:
-        json.dump(db, f, indent=2)
-
-def log_activity(db, action):
-    """Saves an entry to the activity log."""
-    db['logs'].insert(0, f"[{datetime.datetime.now().strftime('%H:%M %d %b')}] {action}")
-    if len(db['logs']) > 50:
-        db['logs'] = db['logs'][:50]
+# Handlers only use the storage.Storage interface, so the backend is a config choice:
+# - "json":   resident in memory, changes journaled to DB_JOURNAL_FILE and compacted
+#             into the DB_FILE snapshot (storage.JsonStore)
+# - "sqlite": indexed tables in SQLITE_FILE (sqlite_store.SqliteStore)
+if STORAGE_BACKEND == "sqlite":
+    store = SqliteStore(SQLITE_FILE)
+else:
+    store = JsonStore(DB_FILE, journal_path=DB_JOURNAL_FILE,
+                      flush_interval=DB_FLUSH_INTERVAL, flush_threshold=DB_FLUSH_THRESHOLD,
+                      compact_interval=DB_COMPACT_INTERVAL, compact_bytes=DB_COMPACT_BYTES)
+
+# Cold archive: finished orders older than ARCHIVE_AFTER_DAYS leave the hot store for
+# monthly compressed segments in ARCHIVE_DIR; search and order history still find them.
+archive = OrderArchive(ARCHIVE_DIR, cached_segments=ARCHIVE_CACHED_SEGMENTS)
+store.attach_archive(archive)
+
+# Latency histograms for every handler, storage call and Bot API request (📈 Health,
+# and GET /metrics on METRICS_LISTEN:METRICS_PORT when METRICS_ENABLED)
+metrics = Metrics()
+metrics.instrument_store(store)
+metrics.add_gauges(lambda: {"pending_approval_orders": store.order_status_counts().get('pending_approval', 0)})
+
+# On-demand cProfile capture of the running bot (/profiler)
+profiler = ProfileCapture()
+PROFILER_MAX_SECONDS = 300
+
+# Activity log (📜 Activity Logs): ring buffer in memory, full history in ACTIVITY_LOG_FILE.
+# The store reports its own mutations; handlers record the rest directly.
+activity = ActivityLog(ACTIVITY_LOG_FILE, keep=ACTIVITY_LOG_RECENT,
+                       max_bytes=ACTIVITY_LOG_MAX_BYTES, backups=ACTIVITY_LOG_BACKUPS)
+store.add_activity_listener(activity.record)
+
+# Pre-rendered catalog screens, invalidated by the store when a category/product changes
+catalog = CatalogCache(store)
+
+# Low-stock / sold-out alerts to the admin, checked as the store reports each stock change
+stock_alerts = StockAlerts(store, default_threshold=LOW_STOCK_THRESHOLD)
+
+# Unpaid (waiting_payment) orders expire ORDER_PAYMENT_TIMEOUT seconds after Buy Now, earliest deadline first
+order_expiry = OrderExpiry(store, ORDER_PAYMENT_TIMEOUT)
+PAYMENT_MINUTES = max(1, round(ORDER_PAYMENT_TIMEOUT / 60))
+
+# Shared by every broadcast so Telegram's global rate limit holds across them
+broadcaster = Broadcaster(rate=BROADCAST_RATE, chat_interval=BROADCAST_CHAT_INTERVAL,
+                          concurrency=BROADCAST_CONCURRENCY, max_retries=BROADCAST_MAX_RETRIES)
+
+# Index of this process in cluster.py's worker pool and the pool's size; None when the bot runs on its own (python main.py)
+worker_index = None
+worker_count = None
+
+def join_cluster(index, workers) -> None:
+    """Makes this process worker `index` of cluster.py's pool of `workers`; call before open_storage().
+
+    The workers share the SQLite store, so each polls it for the catalog and archive
+    changes the others make, and they append to one shared activity log.
+    """
+    global worker_index, worker_count
+    worker_index, worker_count = index, workers
+    store.watch_interval = CLUSTER_SYNC_INTERVAL
+    activity.shared = True
+
+def owns_user(user_id):
+    """True if this process receives the user's updates (cluster.py routes by user ID % workers).
+
+    Only that process holds the user's live user_data and conversation state, so only it may change them.
+    """
+    return worker_index is None or int(user_id) % worker_count == worker_index
 
 def is_admin(user_id):
     """Checks if the user ID matches the defined Admin ID."""
@@ -63,14 +152,17 @@ MAIN_MENU_KEYBOARD = [
 def get_admin_menu_keyboard():
     """Returns the main Admin Panel Inline Keyboard."""
     keyboard = [
-        [InlineKeyboardButton("📁 Category Manager", callback_data="ADMIN_MANAGER_CATEGORY"), 
-         InlineKeyboardButton("📦 Product Manager (WIP)", callback_data="ADMIN_MANAGER_PRODUCT_DUMMY")],
-        [InlineKeyboardButton("📦 Stock Manager", callback_data="ADMIN_MANAGER_STOCK")],
-        [InlineKeyboardButton("🧾 Pending Orders", callback_data="ADMIN_ORDERS_PENDING"),
-         InlineKeyboardButton("🔍 Search Order/User", callback_data="ADMIN_SEARCH_START")],
-        [InlineKeyboardButton("📊 Stats", callback_data="ADMIN_STATS"), 
-         InlineKeyboardButton("📜 Activity Logs", callback_data="ADMIN_LOGS")],
-        [InlineKeyboardButton("🔔 Notify Pending Users", callback_data="ADMIN_NOTIFY")]
+        [InlineKeyboardButton("📁 Category Manager", callback_data=callbacks.CATEGORY_MANAGER.data()), 
+         InlineKeyboardButton("📦 Product Manager (WIP)", callback_data=callbacks.PRODUCT_MANAGER.data())],
+        [InlineKeyboardButton("📦 Stock Manager", callback_data=callbacks.STOCK_MANAGER.data())],
+        [InlineKeyboardButton("🧾 Pending Orders", callback_data=callbacks.PENDING_ORDERS.data()),
+         InlineKeyboardButton("🔍 Search Order/User", callback_data=callbacks.SEARCH.data())],
+        [InlineKeyboardButton("📊 Stats", callback_data=callbacks.STATS.data()), 
+         InlineKeyboardButton("📜 Activity Logs", callback_data=callbacks.LOGS.data(None, 0))],
+        [InlineKeyboardButton("🔔 Notify Pending Users", callback_data=callbacks.NOTIFY.data()),
+         InlineKeyboardButton("📣 Broadcast Offer", callback_data=callbacks.BROADCAST.data())],
+        [InlineKeyboardButton("🏦 Reconcile Statement", callback_data=callbacks.RECONCILE.data()),
+         InlineKeyboardButton("📈 Health", callback_data=callbacks.HEALTH.data())]
     ]
     return InlineKeyboardMarkup(keyboard)
 
@@ -79,7 +171,6 @@ def get_admin_menu_keyboard():
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handles the /start command. (FIXED: Shows Admin Panel if admin)."""
     user = update.effective_user
-    db = load_db()
     
     # 1. ADMIN CHECK
     if is_admin(user.id):
@@ -91,21 +182,13 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         return
 
     # 2. USER FLOW
-    user_id_str = str(user.id)
-    if user_id_str not in db['users']:
-        db['users'][user_id_str] = {
-            "username": user.username or f"id_{user.id}",
-            "name": user.full_name,
-            "total_spent": 0,
-            "total_orders": 0,
-            "completed_orders": 0,
-            "pending_orders": 0,
-            "rejected_orders": 0,
-            "first_order": datetime.datetime.now().isoformat(),
-            "last_order": None,
-            "level": "NEW"
-        }
-        save_db(db)
+    if store.get_user(user.id) is None:
+        store.register_user(user.id, User(
+            username=user.username or f"id_{user.id}",
+            name=user.full_name,
+            first_order=datetime.datetime.now().isoformat(),
+            level="NEW",
+        ))
     
     reply_markup = ReplyKeyboardMarkup(MAIN_MENU_KEYBOARD, resize_keyboard=True)
     
@@ -131,58 +214,33 @@ async def handle_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         await show_profile(update, context)
 
 async def show_categories(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Shows the list of product categories (Fixed Message/Query handling)."""
-    db = load_db()
-    keyboard = []
+    """Shows the list of product categories (main menu button)."""
+    rendered = catalog.categories()
     
-    if not db['categories']:
-        if update.callback_query:
-            await update.callback_query.edit_message_text("📂 No categories available right now. Please check back later.")
-        else:
-            await update.message.reply_text("📂 No categories available right now. Please check back later.")
+    if not rendered:
+        await update.message.reply_text("📂 No categories available right now. Please check back later.")
         return
 
-    for cat_id, cat_data in db['categories'].items():
-        keyboard.append([InlineKeyboardButton(cat_data['name'], callback_data=f"CAT_ID_{cat_id}")])
-
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    text, reply_markup = rendered
     
-    if update.callback_query:
-        await update.callback_query.edit_message_text(
-            "📂 **Select Category**",
-            reply_markup=reply_markup,
-            parse_mode='Markdown'
-        )
-    else:
-        await update.message.reply_text(
-            "📂 **Select Category**",
-            reply_markup=reply_markup,
-            parse_mode='Markdown'
-        )
-
-async def show_products(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Shows the list of products in a selected category."""
-    query = update.callback_query
-    await query.answer()
-    
-    cat_id = query.data.split('_')[-1] 
-    db = load_db()
-    
-    keyboard = []
-    product_list_text = "📦 **Available Products:**\n\n"
-    products_found = False
-    
-    for prod_id, prod_data in db['products'].items():
-        if prod_data['cat_id'] == cat_id:
-            products_found = True
-            product_list_text += f"• {prod_data['name']} – {prod_data['duration']} – {prod_data['price']}৳\n"
-            keyboard.append([InlineKeyboardButton(f"{prod_data['name']} ({prod_data['price']}৳)", callback_data=f"PROD_ID_{prod_id}")])
+    await update.message.reply_text(
+        text,
+        reply_markup=reply_markup,
+        parse_mode='Markdown'
+    )
 
-    if not products_found:
-        product_list_text += "*No products available in this category.*"
+async def browse_categories(query, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Back to the category list from a product list."""
+    rendered = catalog.categories()
+    if not rendered:
+        await query.edit_message_text("📂 No categories available right now. Please check back later.")
+        return
+    text, reply_markup = rendered
+    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
 
-    keyboard.append([InlineKeyboardButton("⬅ Back to Categories", callback_data="BACK_CATEGORIES")])
-    reply_markup = InlineKeyboardMarkup(keyboard)
+async def show_products(query, context: ContextTypes.DEFAULT_TYPE, cat_id) -> None:
+    """Shows the list of products in a selected category."""
+    product_list_text, reply_markup = catalog.products(cat_id)
     
     await query.edit_message_text(
         product_list_text,
@@ -190,80 +248,53 @@ async def show_products(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         parse_mode='Markdown'
     )
 
-async def show_product_details(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def show_product_details(query, context: ContextTypes.DEFAULT_TYPE, prod_id) -> None:
     """Shows the details of a selected product."""
-    query = update.callback_query
-    await query.answer()
-    
-    prod_id = query.data.split('_')[-1]
-    db = load_db()
-    product = db['products'].get(prod_id)
+    rendered = catalog.product_card(prod_id)
     
-    if not product:
+    if not rendered:
         await query.edit_message_text("Product not found.")
         return
 
     context.user_data['current_product_id'] = prod_id
 
-    summary = (
-        "🧾 **ORDER SUMMARY**\n\n"
-        f"Product: **{product['name']}**\n"
-        f"Duration: **{product['duration']}**\n"
-        f"Country: **{product['country']}**\n"
-        f"Price: **{product['price']}৳**\n\n"
-        "📜 **Rules:**\n"
-        f"{product['rules']}\n\n"
-    )
-
-    keyboard = [
-        [InlineKeyboardButton("🛒 Buy Now", callback_data="BUY_NOW")],
-        [InlineKeyboardButton("⬅ Back", callback_data=f"BACK_TO_PRODUCTS_{product['cat_id']}")],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    summary, reply_markup = rendered
     
     await query.edit_message_text(summary, reply_markup=reply_markup, parse_mode='Markdown')
 
-async def buy_now_action(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def buy_now_action(query, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Initiates the order and payment process."""
-    query = update.callback_query
-    await query.answer()
-
     prod_id = context.user_data.get('current_product_id')
-    user_id = update.effective_user.id
-    db = load_db()
+    user_id = query.from_user.id
+    product = store.get_product(prod_id) if prod_id else None
 
-    if not prod_id or prod_id not in db['products']:
+    if not product:
         await query.edit_message_text("Error: Product selection failed. Please start again from the menu.")
         return
+    if catalog.sold_out(prod_id):
+        # Refused here rather than failing at approval, after the customer has paid
+        await query.edit_message_text(f"❌ **{product.name}** is sold out right now. Please check back soon.",
+                                      parse_mode='Markdown')
+        return
 
-    product = db['products'][prod_id]
-    
-    order_id_num = db['next_order_id']
-    order_id = f"order_{order_id_num}"
-    db['next_order_id'] += 1
-
-    db['orders'][order_id] = {
-        "user_id": user_id,
-        "product_id": prod_id,
-        "price": product['price'],
-        "status": "waiting_payment",
-        "created_at": datetime.datetime.now().isoformat()
-    }
-    log_activity(db, f"ORDER CREATED — {order_id}")
-    save_db(db)
-
-    context.user_data['waiting_payment_for_order'] = order_id
+    # Per-user lock: a double tap must not interleave with this user's payment flow
+    async with store.locks("user", user_id):
+        order_id = store.create_order(user_id, prod_id, product.price)
+        order_expiry.track(order_id)
+        context.user_data['waiting_payment_for_order'] = order_id
     
     payment_info = (
         f"🧾 **ORDER ID: {order_id}**\n\n"
-        f"Product: **{product['name']}**\n"
-        f"Price: **{product['price']}৳**\n\n"
+        f"Product: **{product.name}**\n"
+        f"Price: **{product.price}৳**\n\n"
         "📤 **Submit payment as:**\n"
         "`TXNID|SENDER_NUMBER|AMOUNT`\n\n"
         f"**Send money to:**\n"
         f"`{PAYMENT_NUMBER}`\n\n"
         "**Please reply to this message with the payment format above after sending money.**"
     )
+    if ORDER_PAYMENT_TIMEOUT:
+        payment_info += f"\n\n⏳ The order expires if payment is not submitted within {PAYMENT_MINUTES} minutes."
     
     await query.edit_message_text(payment_info, parse_mode='Markdown')
 
@@ -271,44 +302,56 @@ async def handle_payment_submission(update: Update, context: ContextTypes.DEFAUL
     """Handles the user's payment submission message (TXNID|NUMBER|AMOUNT)."""
     user = update.effective_user
     message_text = update.message.text.strip()
-    order_id = context.user_data.get('waiting_payment_for_order')
 
-    if not order_id: return
+    if not context.user_data.get('waiting_payment_for_order'): return
 
-    parts = message_text.split('|')
-    if len(parts) != 3:
-        await update.message.reply_text("❌ **Invalid format.** Please submit payment as: `TXNID|SENDER_NUMBER|AMOUNT` (e.g., `TXN99882|01755667788|250`)")
-        return
+    # Per-user lock: two payment messages processed concurrently must not both submit
+    async with store.locks("user", user.id):
+        order_id = context.user_data.get('waiting_payment_for_order')
+        if not order_id: return
 
-    txn_id, sender_number, amount_str = parts
-    txn_id = txn_id.upper()
-    
-    db = load_db()
-    order = db['orders'].get(order_id)
-    
-    if not order:
-        await update.message.reply_text("Error finding your order. Please contact support.")
-        del context.user_data['waiting_payment_for_order']
-        return
+        parts = message_text.split('|')
+        if len(parts) != 3:
+            await update.message.reply_text("❌ **Invalid format.** Please submit payment as: `TXNID|SENDER_NUMBER|AMOUNT` (e.g., `TXN99882|01755667788|250`)")
+            return
 
-    try:
-        amount = int(amount_str)
-    except ValueError:
-        await update.message.reply_text("❌ **Amount must be a number.**")
-        return
+        txn_id, sender_number, amount_str = parts
+        txn_id = txn_id.upper()
+        
+        order = store.get_order(order_id)
+        if order is None and order_id in archive:
+            order = archive.get_order(order_id)   # expired, and already moved to the archive
+        
+        if not order:
+            await update.message.reply_text("Error finding your order. Please contact support.")
+            context.user_data.pop('waiting_payment_for_order', None)
+            return
+        if order.status == "expired":
+            context.user_data.pop('waiting_payment_for_order', None)
+            await update.message.reply_text(expired_message(order_id), parse_mode='Markdown')
+            return
 
-    if amount != order['price']:
-         await update.message.reply_text(f"❌ **Amount mismatch.** You submitted {amount}৳ but the required price is {order['price']}৳.")
-         return
+        try:
+            amount = int(amount_str)
+        except ValueError:
+            await update.message.reply_text("❌ **Amount must be a number.**")
+            return
 
-    order['status'] = "pending_approval"
-    order['txn_id'] = txn_id
-    order['sender_number'] = sender_number
-    order['submitted_amount'] = amount
-    log_activity(db, f"PAYMENT SUBMITTED — {order_id}")
-    save_db(db)
+        if amount != order.price:
+             await update.message.reply_text(f"❌ **Amount mismatch.** You submitted {amount}৳ but the required price is {order.price}৳.")
+             return
 
-    del context.user_data['waiting_payment_for_order']
+        try:
+            store.submit_payment(order_id, txn_id, sender_number, amount)
+        except OrderStateError as e:
+            context.user_data.pop('waiting_payment_for_order', None)
+            if e.status == "expired":
+                await update.message.reply_text(expired_message(order_id), parse_mode='Markdown')
+            else:
+                await update.message.reply_text(f"ℹ️ Payment for order `{order_id}` was already submitted.", parse_mode='Markdown')
+            return
+
+        context.user_data.pop('waiting_payment_for_order', None)
 
     await update.message.reply_text(
         "✅ **Payment submitted!**\n"
@@ -316,21 +359,21 @@ async def handle_payment_submission(update: Update, context: ContextTypes.DEFAUL
     )
 
     # Admin Notification
-    product_name = db['products'][order['product_id']]['name']
+    product_name = store.get_product(order.product_id).name
     admin_message = (
         f"🔔 **ACTION REQUIRED: NEW PENDING ORDER**\n\n"
         f"**Order ID:** `{order_id}`\n"
         f"**Product:** {product_name}\n"
         f"**User:** @{user.username or user.full_name} (ID: {user.id})\n"
-        f"**Price:** {order['price']}৳\n\n"
+        f"**Price:** {order.price}৳\n\n"
         f"**Submitted TXN:** `{txn_id}`\n"
         f"**Sender:** `{sender_number}`\n"
         f"**Amount:** {amount}৳"
     )
 
     admin_keyboard = [
-        [InlineKeyboardButton("✔ Approve", callback_data=f"ADMIN_APPROVE_{order_id}"),
-         InlineKeyboardButton("❌ Reject", callback_data=f"ADMIN_REJECT_{order_id}")]
+        [InlineKeyboardButton("✔ Approve", callback_data=callbacks.APPROVE.data(order_id)),
+         InlineKeyboardButton("❌ Reject", callback_data=callbacks.REJECT.data(order_id))]
     ]
     
     await context.bot.send_message(
@@ -340,24 +383,57 @@ async def handle_payment_submission(update: Update, context: ContextTypes.DEFAUL
         parse_mode='Markdown'
     )
 
-async def show_user_orders(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Displays the user's order history."""
-    user_id = update.effective_user.id
-    db = load_db()
-    
-    user_orders = {k: v for k, v in db['orders'].items() if v['user_id'] == user_id}
-    
+def expired_message(order_id):
+    return (f"⌛ Order `{order_id}` has **expired**: no payment was submitted within {PAYMENT_MINUTES} minutes.\n"
+            "Please tap 🛒 Buy Now again to order. If you already sent money, contact support with your TXN ID.")
+
+async def notify_expired_orders(application: Application, order_ids):
+    """Ends the payment step of orders the sweeper expired and, with ORDER_EXPIRY_NOTIFY, tells their owners."""
+    messages = {}
+    for order_id in order_ids:
+        order = store.get_order(order_id)
+        if order is None:
+            continue
+        user_data = application.user_data.get(order.user_id) if owns_user(order.user_id) else None
+        if user_data and user_data.get('waiting_payment_for_order') == order_id:
+            user_data.pop('waiting_payment_for_order', None)
+            application.mark_data_for_update_persistence(user_ids=order.user_id)
+        messages[order_id] = (order.user_id, expired_message(order_id))
+    if ORDER_EXPIRY_NOTIFY and messages:
+        # In the background: a long backlog of notices must not hold up the next sweep
+        application.create_task(broadcaster.send_each(application.bot, messages, parse_mode='Markdown'))
+
+USER_ORDERS_PAGE_SIZE = 15
+
+def user_orders_page(user_id, cursor):
+    """Text and keyboard for one page of a user's order history, newest first (cursor: see page_cursor)."""
+    user_orders, has_older, has_newer = store.orders_page(user_id=user_id, limit=USER_ORDERS_PAGE_SIZE,
+                                                          **page_cursor(cursor))
     if not user_orders:
-        await update.effective_message.reply_text("📦 **YOUR ORDERS**\n\nYou have no orders yet.")
-        return
+        return "📦 **YOUR ORDERS**\n\nYou have no orders yet.", None
 
     order_list_text = "📦 **YOUR ORDERS**\n\n"
     
-    for order_id, order in user_orders.items():
-        status_display = order['status'].upper()
+    for order_id, order in reversed(user_orders):
+        status_display = order.status.upper()
         order_list_text += f"`{order_id}` — **{status_display}**\n"
 
-    await update.effective_message.reply_text(order_list_text, parse_mode='Markdown')
+    nav = []
+    if has_newer:
+        nav.append(InlineKeyboardButton("« Newer", callback_data=callbacks.MY_ORDERS.data(f"a{order_number(user_orders[-1][0])}")))
+    if has_older:
+        nav.append(InlineKeyboardButton("Older »", callback_data=callbacks.MY_ORDERS.data(f"b{order_number(user_orders[0][0])}")))
+    return order_list_text, InlineKeyboardMarkup([nav]) if nav else None
+
+async def show_user_orders(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Displays the newest page of the user's order history."""
+    text, reply_markup = user_orders_page(update.effective_user.id, "b")
+    await update.effective_message.reply_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+
+async def handle_user_orders_page(query, context: ContextTypes.DEFAULT_TYPE, cursor) -> None:
+    """Handles the Newer/Older buttons under the order history."""
+    text, reply_markup = user_orders_page(query.from_user.id, cursor)
+    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
 
 async def show_support(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Displays support information."""
@@ -369,22 +445,23 @@ async def show_support(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     )
 
 async def show_offers(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Displays current offers."""
-    await update.effective_message.reply_text("🎁 **OFFERS**\n\nCurrently no offers available.")
+    """Displays the offer the admin last broadcast."""
+    offer = store.get_setting("offer")
+    offer_text = offer['text'] if offer else "Currently no offers available."
+    await update.effective_message.reply_text(f"🎁 **OFFERS**\n\n{offer_text}")
 
 async def show_profile(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Displays user profile information."""
     user = update.effective_user
-    db = load_db()
-    user_data = db['users'].get(str(user.id), {})
-
-    user_orders = [o for o in db['orders'].values() if o['user_id'] == user.id]
-    completed = sum(1 for o in user_orders if o['status'] == 'delivered')
-    pending = sum(1 for o in user_orders if o['status'] == 'pending_approval' or o['status'] == 'waiting_payment')
-    rejected = sum(1 for o in user_orders if o['status'] == 'rejected')
-    total_orders = len(user_orders)
+    user_data = store.get_user(user.id) or User()
+
+    # Counters are maintained by the store on every order transition
+    completed = user_data.completed_orders
+    pending = user_data.pending_orders
+    rejected = user_data.rejected_orders
+    total_orders = user_data.total_orders
         
-    first_order_date = user_data.get('first_order', 'N/A')
+    first_order_date = user_data.first_order or 'N/A'
     try:
         first_order_date = datetime.datetime.fromisoformat(first_order_date).strftime('%d %b %Y')
     except:
@@ -399,9 +476,9 @@ async def show_profile(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         f"✅ **Completed:** {completed}\n"
         f"⌛ **Pending:** {pending}\n"
         f"❌ **Rejected:** {rejected}\n\n"
-        f"💰 **Total Spent:** {user_data.get('total_spent', 0)}৳\n"
+        f"💰 **Total Spent:** {user_data.total_spent}৳\n"
         f"🧾 **First Order:** {first_order_date}\n"
-        f"⭐ **Customer Level:** {user_data.get('level', 'NEW')}"
+        f"⭐ **Customer Level:** {user_data.level or 'NEW'}"
     )
     await update.effective_message.reply_text(profile_text, parse_mode='Markdown')
 
@@ -418,48 +495,98 @@ async def admin_panel_command(update: Update, context: ContextTypes.DEFAULT_TYPE
         parse_mode='Markdown'
     )
 
+async def profiler_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Admin only: /profiler [seconds] or /profiler <n> updates — profiles the running bot, then sends a report."""
+    if not is_admin(update.effective_user.id):
+        return
+
+    args = context.args or []
+    try:
+        amount = int(args[0]) if args else 30
+    except ValueError:
+        amount = 0
+    if amount <= 0:
+        await update.message.reply_text("Usage: /profiler [seconds] or /profiler <n> updates")
+        return
+    if profiler.active:
+        await update.message.reply_text("🔬 A profile capture is already running.")
+        return
+
+    by_updates = len(args) > 1 and args[1].lower().startswith("update")
+    profiler.start(max_updates=amount if by_updates else None)
+    max_seconds = PROFILER_MAX_SECONDS if by_updates else min(amount, PROFILER_MAX_SECONDS)
+    await update.message.reply_text(
+        f"🔬 Profiling the next {amount} updates (at most {max_seconds}s)…" if by_updates
+        else f"🔬 Profiling for {max_seconds}s…"
+    )
+    # The capture outlives this update; the report is sent when it ends
+    context.application.create_task(send_profile(context.application, update.effective_chat.id, max_seconds))
+
+async def send_profile(application: Application, chat_id, max_seconds):
+    """Ends the running capture and sends the ranked summary plus the raw .prof file."""
+    stats = await profiler.finish(max_seconds)
+    report = summarize(stats, handler_functions(application))
+    path = os.path.join(tempfile.gettempdir(), f"bot-profile-{datetime.datetime.now():%Y%m%d-%H%M%S}.prof")
+    stats.dump_stats(path)
+    try:
+        # Plain text: function and file names contain underscores
+        await application.bot.send_message(chat_id, report[:4000])
+        with open(path, 'rb') as f:
+            await application.bot.send_document(chat_id, f, filename=os.path.basename(path),
+                                                caption="Raw cProfile data (python -m pstats, snakeviz)")
+    finally:
+        os.remove(path)
+
+async def lowstock_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Admin only: /lowstock lists alert levels; /lowstock <product ID> <items|default> sets one."""
+    if not is_admin(update.effective_user.id):
+        return
+
+    args = context.args or []
+    if not args:
+        thresholds = stock_alerts.thresholds()
+        lines = [f"`{prod_id}` {product.name}: {store.stock_counts(prod_id)[0]} left, alert at "
+                 f"{thresholds.get(prod_id, stock_alerts.default_threshold)}"
+                 for prod_id, product in store.list_products()]
+        await update.message.reply_text(
+            "📦 **Low-stock alert levels**\n\n" + ("\n".join(lines) or "No products.") +
+            "\n\nUsage: /lowstock <product ID> <items|default>", parse_mode='Markdown')
+        return
+
+    prod_id = args[0]
+    try:
+        threshold = None if len(args) > 1 and args[1].lower() == "default" else int(args[1])
+    except (IndexError, ValueError):
+        threshold = -1
+    if threshold is not None and threshold < 0 or not store.get_product(prod_id):
+        await update.message.reply_text("Usage: /lowstock <product ID> <items|default>")
+        return
+    stock_alerts.set_threshold(prod_id, threshold)
+    level = stock_alerts.threshold(prod_id)
+    await update.message.reply_text(f"✅ {store.get_product(prod_id).name}: the admin is alerted when stock drops to {level}.")
+
+async def count_profiled_update(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Runs before every other handler; counts updates for /profiler <n> updates."""
+    profiler.count_update()
+
 async def back_to_admin_panel(query, context: ContextTypes.DEFAULT_TYPE):
     """Callback to return to the main admin menu."""
-    await query.answer()
     await query.edit_message_text(
         "👑 **POWER POINT BREAK — ADMIN PANEL**\n\nPlease choose an option:", 
         reply_markup=get_admin_menu_keyboard(), 
         parse_mode='Markdown'
     )
 
-async def handle_admin_menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handles main Admin Panel button clicks (routes to specific managers)."""
-    query = update.callback_query
-    await query.answer()
-    
-    if not is_admin(query.from_user.id): return
-
-    action = query.data
-
-    if action == "ADMIN_MANAGER_CATEGORY":
-        await show_category_manager(query, context)
-    elif action == "ADMIN_MANAGER_STOCK":
-        await show_stock_manager(query, context)
-    elif action == "ADMIN_ORDERS_PENDING":
-        await show_pending_orders(query, context)
-    elif action == "ADMIN_STATS":
-        await show_stats(query, context)
-    elif action == "ADMIN_LOGS":
-        await show_logs(query, context)
-    elif action == "ADMIN_NOTIFY":
-        await notify_pending_users(query, context)
-    elif action.endswith("DUMMY"):
-        await query.edit_message_text("This feature is currently under construction.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅ Back to Admin Panel", callback_data="ADMIN_PANEL_BACK")]]))
-    elif action == "ADMIN_SEARCH_START":
-        await start_admin_search(query, context) 
+async def show_product_manager(query, context: ContextTypes.DEFAULT_TYPE):
+    await query.edit_message_text("This feature is currently under construction.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅ Back to Admin Panel", callback_data=callbacks.ADMIN_PANEL.data())]]))
 
 
 # --- II.A. Category Management ---
 
 def get_category_manager_keyboard():
     return InlineKeyboardMarkup([
-        [InlineKeyboardButton("➕ Add Category", callback_data="ADMIN_CAT_ADD")],
-        [InlineKeyboardButton("⬅ Back to Admin Panel", callback_data="ADMIN_PANEL_BACK")]
+        [InlineKeyboardButton("➕ Add Category", callback_data=callbacks.CATEGORY_ADD.data())],
+        [InlineKeyboardButton("⬅ Back to Admin Panel", callback_data=callbacks.ADMIN_PANEL.data())]
     ])
 
 async def show_category_manager(query, context: ContextTypes.DEFAULT_TYPE):
@@ -479,14 +606,10 @@ async def get_category_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def finish_add_category(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Step 2: Get banner URL and save to DB."""
-    db = load_db()
     cat_name = context.user_data.pop('new_category_name')
     banner = update.message.text if update.message.text else "N/A"
     
-    new_cat_id = f"cat_{uuid.uuid4().hex[:4]}"
-    db['categories'][new_cat_id] = {"name": cat_name, "banner": banner}
-    log_activity(db, f"CATEGORY ADDED — {cat_name}")
-    save_db(db)
+    store.add_category(cat_name, banner)
     
     await update.message.reply_text(f"✅ Category **{cat_name}** added successfully!", parse_mode='Markdown', reply_markup=get_admin_menu_keyboard())
     return ConversationHandler.END
@@ -494,39 +617,43 @@ async def finish_add_category(update: Update, context: ContextTypes.DEFAULT_TYPE
 # --- II.B. Stock Management ---
 
 async def show_stock_manager(query, context: ContextTypes.DEFAULT_TYPE):
-    db = load_db()
-    
-    total_available = sum(len([item for item in stock_list if not item['used']]) for stock_list in db['stock'].values())
-    total_used = sum(len([item for item in stock_list if item['used']]) for stock_list in db['stock'].values())
+    total_available, total_used = store.stock_counts()
     total_stock = total_available + total_used
     
     summary = (
         "🟢 **STOCK MANAGER**\n\n"
         f"Available: **{total_available}**\n"
         f"Used: **{total_used}**\n"
-        f"Total: **{total_stock}**"
+        f"Total: **{total_stock}**\n"
     )
+    thresholds = stock_alerts.thresholds()
+    for prod_id, prod_data in store.list_products():
+        available, used = store.stock_counts(prod_id)
+        threshold = thresholds.get(prod_id, stock_alerts.default_threshold)
+        flag = "❌ " if not available else "⚠️ " if available <= threshold else ""
+        summary += f"\n• {flag}{prod_data.name}: {available} available / {used} used (alert at {threshold})"
+    summary += "\n\nSet a product's alert level with /lowstock <product ID> <items>."
     
     keyboard = [
-        [InlineKeyboardButton("➕ Add Stock", callback_data="ADMIN_STOCK_START_ADD")],
-        [InlineKeyboardButton("⬅ Back to Admin Panel", callback_data="ADMIN_PANEL_BACK")]
+        [InlineKeyboardButton("➕ Add Stock", callback_data=callbacks.STOCK_ADD.data())],
+        [InlineKeyboardButton("⬅ Back to Admin Panel", callback_data=callbacks.ADMIN_PANEL.data())]
     ]
     await query.edit_message_text(summary, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
 
 async def start_add_stock(query, context: ContextTypes.DEFAULT_TYPE):
     """Entry point for ConversationHandler: Select product for stock."""
     await query.answer()
-    db = load_db()
+    products = store.list_products()
     
     keyboard = []
-    if not db['products']:
+    if not products:
         await query.edit_message_text("No products defined. Add a product first.", reply_markup=get_admin_menu_keyboard())
         return ConversationHandler.END
 
-    for prod_id, prod_data in db['products'].items():
-        keyboard.append([InlineKeyboardButton(prod_data['name'], callback_data=f"STOCK_ADD_PROD_{prod_id}")])
+    for prod_id, prod_data in products:
+        keyboard.append([InlineKeyboardButton(prod_data.name, callback_data=callbacks.STOCK_PRODUCT.data(prod_id))])
 
-    keyboard.append([InlineKeyboardButton("❌ Cancel", callback_data="ADMIN_CANCEL_STOCK")])
+    keyboard.append([InlineKeyboardButton("❌ Cancel", callback_data=callbacks.STOCK_CANCEL.data())])
     
     await query.edit_message_text("Select Product to add stock for:", reply_markup=InlineKeyboardMarkup(keyboard))
     return STOCK_SELECT_PRODUCT
@@ -536,57 +663,75 @@ async def get_stock_product_selection_callback(update: Update, context: ContextT
     query = update.callback_query
     await query.answer()
     
-    if query.data == "ADMIN_CANCEL_STOCK":
-        await query.edit_message_text("❌ Stock addition cancelled.", reply_markup=get_admin_menu_keyboard())
-        return ConversationHandler.END
-        
-    prod_id = query.data.split('_')[-1]
-    db = load_db()
+    prod_id, = callbacks.STOCK_PRODUCT.parse(query.data)
+    product = store.get_product(prod_id)
     
     context.user_data['stock_product_id'] = prod_id
     
     await query.edit_message_text(
-        f"Adding stock for **{db['products'][prod_id]['name']}**\n\n"
+        f"Adding stock for **{product.name}**\n\n"
         "Send stock credentials, one per line:\n"
         "`email1|pass1`\n"
         "`email2|pass2`\n"
-        "`email3|pass3`",
+        "`email3|pass3`\n\n"
+        "For larger batches upload a **.txt** file (same format) or a **.csv** file (`email,password` rows).",
         parse_mode='Markdown'
     )
     return STOCK_INPUT 
 
 async def get_stock_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Step 2: Get stock input and save to DB."""
-    db = load_db()
+    """Step 2: Get pasted stock lines and save to DB."""
     prod_id = context.user_data.pop('stock_product_id', None)
     
     if not prod_id:
         await update.message.reply_text("Error: Product ID lost. Please restart stock addition.", reply_markup=get_admin_menu_keyboard())
         return ConversationHandler.END
         
-    stock_lines = update.message.text.split('\n')
-    
-    added_count = 0
-    
-    if prod_id not in db['stock']:
-        db['stock'][prod_id] = []
-        
-    for line in stock_lines:
-        line = line.strip()
-        if re.match(r'.+\|.+', line): 
-            db['stock'][prod_id].append({"credential": line, "used": False})
-            added_count += 1
-            
-    log_activity(db, f"STOCK ADDED — {added_count} items ({db['products'][prod_id]['name']})")
-    save_db(db)
+    stats = stock_import.ImportStats()
+    credentials = stock_import.parse_lines(update.message.text.split('\n'), stats)
+    await reply_stock_import(update, prod_id, store.add_stock(prod_id, credentials), stats)
+    return ConversationHandler.END
+
+async def get_stock_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Step 2 (file): Stream an uploaded .txt/.csv document into stock, deduplicated, in one write."""
+    document = update.message.document
+    file_name = document.file_name or ""
     
-    await update.message.reply_text(
-        f"✅ Added **{added_count}** stock items for **{db['products'][prod_id]['name']}**.",
-        parse_mode='Markdown',
-        reply_markup=get_admin_menu_keyboard()
-    )
+    if not file_name.lower().endswith(stock_import.EXTENSIONS):
+        await update.message.reply_text("❌ Please upload a .txt or .csv file (or paste the lines as a message).")
+        return STOCK_INPUT
+    if document.file_size and document.file_size > stock_import.MAX_FILE_BYTES:
+        await update.message.reply_text("❌ File is too large (max 20 MB). Please split it into smaller files.")
+        return STOCK_INPUT
+
+    prod_id = context.user_data.pop('stock_product_id', None)
+    if not prod_id:
+        await update.message.reply_text("Error: Product ID lost. Please restart stock addition.", reply_markup=get_admin_menu_keyboard())
+        return ConversationHandler.END
+
+    stats = stock_import.ImportStats()
+    # Spills to disk past 1 MB, and is parsed line by line, so big files never sit in memory whole
+    with tempfile.SpooledTemporaryFile(max_size=1024 * 1024) as buffer:
+        telegram_file = await context.bot.get_file(document.file_id)
+        await telegram_file.download_to_memory(out=buffer)
+        buffer.seek(0)
+        result = store.add_stock(prod_id, stock_import.parse_file(buffer, file_name, stats))
+
+    await reply_stock_import(update, prod_id, result, stats)
     return ConversationHandler.END
 
+async def reply_stock_import(update: Update, prod_id, result, stats):
+    """Reports added / duplicate / malformed counts of a stock import."""
+    added_count, duplicate_count = result
+    report = (
+        f"✅ Added **{added_count}** stock items for **{store.get_product(prod_id).name}**.\n\n"
+        f"♻️ Duplicates skipped: **{duplicate_count}**\n"
+        f"⚠️ Malformed lines: **{stats.malformed}**"
+    )
+    if stats.malformed_samples:
+        report += "\n" + "\n".join(f"• line {line_no}: `{text.replace('`', '')}`" for line_no, text in stats.malformed_samples)
+    await update.message.reply_text(report, parse_mode='Markdown', reply_markup=get_admin_menu_keyboard())
+
 async def cancel_admin_action(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Fallback handler to cancel any admin Conversation."""
     if update.callback_query:
@@ -600,165 +745,297 @@ async def cancel_admin_action(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 # --- II.C. Order Management (Pending Orders) ---
 
-async def get_pending_orders_list(db):
-    """Helper to retrieve and sort pending orders."""
-    pending = [k for k, v in db['orders'].items() if v['status'] == 'pending_approval']
-    return pending
+def page_cursor(cursor):
+    """Parses a compact page cursor from callback_data into store.orders_page() arguments.
+
+    "a<n>" is the page after order number n, "b<n>" the page before it and a bare "b" the newest page.
+    Anything else (a stale or tampered button) is read as the newest page rather than raising.
+    """
+    kind, number = cursor[:1], cursor[1:]
+    if kind not in ("a", "b") or not (number == "" or number.isascii() and number.isdigit()):
+        return {"before": None}
+    return {"after" if kind == "a" else "before": int(number) if number else None}
+
+def pending_neighbour(cursor):
+    """The pending order next to a cursor (see page_cursor), as (order_id, order) or None."""
+    orders, _, _ = store.orders_page(status='pending_approval', limit=1, **page_cursor(cursor))
+    return orders[0] if orders else None
 
 async def show_pending_orders(query, context: ContextTypes.DEFAULT_TYPE):
-    db = load_db()
-    pending_orders = await get_pending_orders_list(db)
+    first = pending_neighbour("a0")
     
-    if not pending_orders:
-        await query.edit_message_text("🧾 **Pending Orders**\n\nNo orders are currently pending approval.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅ Back to Admin Panel", callback_data="ADMIN_PANEL_BACK")]]))
+    if not first:
+        await query.edit_message_text("🧾 **Pending Orders**\n\nNo orders are currently pending approval.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅ Back to Admin Panel", callback_data=callbacks.ADMIN_PANEL.data())]]))
         return
     
-    order_id = pending_orders[0]
-    await display_single_order_details(query, context, order_id, pending_orders)
+    await display_single_order_details(query, context, *first)
 
-async def handle_order_view_navigation(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handles navigation between pending orders."""
-    query = update.callback_query
-    await query.answer()
-    order_id = query.data.split('_')[-1]
-    db = load_db()
-    pending_orders = await get_pending_orders_list(db)
-    await display_single_order_details(query, context, order_id, pending_orders)
+async def handle_order_view_navigation(query, context: ContextTypes.DEFAULT_TYPE, cursor):
+    """Handles navigation between pending orders (cursor: see page_cursor)."""
+    neighbour = pending_neighbour(cursor)
+    if not neighbour:
+        # Settled meanwhile: start again from the oldest pending order
+        await show_pending_orders(query, context)
+        return
+    await display_single_order_details(query, context, *neighbour)
 
-async def display_single_order_details(query, context: ContextTypes.DEFAULT_TYPE, order_id, pending_orders):
+async def display_single_order_details(query, context: ContextTypes.DEFAULT_TYPE, order_id, order):
     """Formats and displays a single pending order."""
-    db = load_db()
-    order = db['orders'].get(order_id)
-    if not order or order['product_id'] not in db['products']:
-        await query.edit_message_text("Error: Order or Product details missing.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅ Back to Admin Panel", callback_data="ADMIN_PANEL_BACK")]]))
+    product = store.get_product(order.product_id)
+    if not product:
+        await query.edit_message_text("Error: Order or Product details missing.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅ Back to Admin Panel", callback_data=callbacks.ADMIN_PANEL.data())]]))
         return
         
-    product = db['products'][order['product_id']]
-    user_info = db['users'].get(str(order['user_id']), {'username': 'N/A', 'name': 'N/A'})
-    
-    try:
-        current_index = pending_orders.index(order_id) + 1
-    except ValueError:
-        current_index = "N/A"
+    user_info = store.get_user(order.user_id) or User(username='N/A', name='N/A')
+    pending_count = store.order_status_counts().get('pending_approval', 0)
         
     order_details = (
-        f"**ORDER {order_id}** ({current_index} of {len(pending_orders)} pending)\n\n"
-        f"User: @{user_info['username']} ({user_info['name']})\n"
-        f"Product: {product['name']}\n"
-        f"Price: {order['price']}৳\n\n"
-        f"TXN: `{order.get('txn_id', 'N/A')}`\n"
-        f"Sender: `{order.get('sender_number', 'N/A')}`\n"
-        f"Amount: {order.get('submitted_amount', 0)}৳\n\n"
-        f"Status: **{order['status'].upper()}**"
+        f"**ORDER {order_id}** ({pending_count} pending)\n\n"
+        f"User: @{user_info.username} ({user_info.name})\n"
+        f"Product: {product.name}\n"
+        f"Price: {order.price}৳\n\n"
+        f"TXN: `{order.txn_id or 'N/A'}`\n"
+        f"Sender: `{order.sender_number or 'N/A'}`\n"
+        f"Amount: {order.submitted_amount or 0}৳\n\n"
+        f"Status: **{order.status.upper()}**"
     )
 
     keyboard = [
-        [InlineKeyboardButton("✔ Approve", callback_data=f"ADMIN_APPROVE_{order_id}"),
-         InlineKeyboardButton("❌ Reject", callback_data=f"ADMIN_REJECT_{order_id}")]
+        [InlineKeyboardButton("✔ Approve", callback_data=callbacks.APPROVE.data(order_id)),
+         InlineKeyboardButton("❌ Reject", callback_data=callbacks.REJECT.data(order_id))]
     ]
     
-    try:
-        order_index = pending_orders.index(order_id)
-        nav_buttons = []
-        if order_index > 0:
-            nav_buttons.append(InlineKeyboardButton("« Prev", callback_data=f"ADMIN_ORDER_VIEW_{pending_orders[order_index-1]}"))
-        if order_index < len(pending_orders) - 1:
-            nav_buttons.append(InlineKeyboardButton("Next »", callback_data=f"ADMIN_ORDER_VIEW_{pending_orders[order_index+1]}"))
-        
-        if nav_buttons:
-            keyboard.append(nav_buttons)
-    except:
-        pass
+    num = order_number(order_id)
+    nav_buttons = []
+    if pending_neighbour(f"b{num}"):
+        nav_buttons.append(InlineKeyboardButton("« Prev", callback_data=callbacks.ORDER_VIEW.data(f"b{num}")))
+    if pending_neighbour(f"a{num}"):
+        nav_buttons.append(InlineKeyboardButton("Next »", callback_data=callbacks.ORDER_VIEW.data(f"a{num}")))
+    if nav_buttons:
+        keyboard.append(nav_buttons)
         
-    keyboard.append([InlineKeyboardButton("⬅ Back to Admin Panel", callback_data="ADMIN_PANEL_BACK")])
+    keyboard.append([InlineKeyboardButton("☑️ Bulk Select", callback_data=callbacks.BULK.data("show", "a0"))])
+    keyboard.append([InlineKeyboardButton("⬅ Back to Admin Panel", callback_data=callbacks.ADMIN_PANEL.data())])
 
     await query.edit_message_text(order_details, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
 
-async def handle_admin_order_action(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+def delivery_message(order_id, credential):
+    """The user's delivery message for an approved order (Markdown)."""
+    username, password = credential.split('|', 1)
+    return (
+        f"🎉 **Your order {order_id} has been delivered!**\n\n"
+        f"📧 **Username:** `{username}`\n"
+        f"🔑 **Password:** `{password}`\n\n"
+        f"Need help? Contact **{ADMIN_USERNAME}**"
+    )
+
+def rejection_message(order_id):
+    return f"❌ **Your order {order_id} has been rejected.** Please contact support if you believe this is an error."
+
+async def approve_order_action(query, context: ContextTypes.DEFAULT_TYPE, order_id) -> None:
+    """Approve button on a pending order."""
+    await handle_admin_order_action(query, context, "APPROVE", order_id)
+
+async def reject_order_action(query, context: ContextTypes.DEFAULT_TYPE, order_id) -> None:
+    """Reject button on a pending order."""
+    await handle_admin_order_action(query, context, "REJECT", order_id)
+
+async def handle_admin_order_action(query, context: ContextTypes.DEFAULT_TYPE, action, order_id) -> None:
     """Handles Approve/Reject action on a pending order."""
-    query = update.callback_query
-    await query.answer()
-    
-    if not is_admin(query.from_user.id): return
+    # Per-order lock: a second tap on Approve/Reject waits, then finds the order settled
+    async with store.locks("order", order_id):
+        await apply_admin_order_action(query, context, action, order_id)
 
-    action, order_id = query.data.split('_')[1], query.data.split('_')[2]
-    db = load_db()
-    order = db['orders'].get(order_id)
+async def apply_admin_order_action(query, context: ContextTypes.DEFAULT_TYPE, action, order_id):
+    """Approve/Reject body of handle_admin_order_action; runs under the order's lock."""
+    order = store.get_order(order_id)
     
-    if not order or order['status'] != 'pending_approval':
+    if not order or order.status != 'pending_approval':
         await query.edit_message_text(f"Order {order_id} is no longer pending or doesn't exist.")
         return
 
     # --- APPROVE Logic (Auto-Delivery) ---
     if action == "APPROVE":
-        prod_id = order['product_id']
-        stock_list = db['stock'].get(prod_id, [])
-        credential = None
-        stock_index = -1
-        
-        for i, item in enumerate(stock_list):
-            if not item['used']:
-                credential = item['credential']
-                stock_index = i
-                break
+        prod_id = order.product_id
+        try:
+            credential = store.approve_order(order_id)
+        except OrderStateError:
+            # Settled by another process sharing the store since we read it
+            await query.edit_message_text(f"Order {order_id} is no longer pending or doesn't exist.")
+            return
         
         if credential:
-            stock_list[stock_index]['used'] = True
-            order['status'] = "delivered"
-            order['delivery_credential'] = credential
-            
-            user_data = db['users'].get(str(order['user_id']))
-            if user_data:
-                user_data['completed_orders'] = user_data.get('completed_orders', 0) + 1
-                user_data['total_spent'] = user_data.get('total_spent', 0) + order['price']
-            
-            log_activity(db, f"ORDER APPROVED — {order_id}")
-            save_db(db)
-            
             # Notify User
-            username, password = credential.split('|')
-            user_message = (
-                f"🎉 **Your order {order_id} has been delivered!**\n\n"
-                f"📧 **Username:** `{username}`\n"
-                f"🔑 **Password:** `{password}`\n\n"
-                f"Need help? Contact **{ADMIN_USERNAME}**"
-            )
-            await context.bot.send_message(order['user_id'], user_message, parse_mode='Markdown')
+            await context.bot.send_message(order.user_id, delivery_message(order_id, credential), parse_mode='Markdown')
             
             await query.edit_message_text(f"✔ **Order approved & delivered.**\nDelivery: `{credential}`")
         else:
-            await query.edit_message_text(f"❌ **ERROR:** No stock available for Product {db['products'][prod_id]['name']}. Please add stock first.")
+            await query.edit_message_text(f"❌ **ERROR:** No stock available for Product {store.get_product(prod_id).name}. Please add stock first.")
             
     # --- REJECT Logic ---
     elif action == "REJECT":
-        order['status'] = "rejected"
-        user_data = db['users'].get(str(order['user_id']))
-        if user_data:
-            user_data['rejected_orders'] = user_data.get('rejected_orders', 0) + 1
-        
-        log_activity(db, f"ORDER REJECTED — {order_id}")
-        save_db(db)
+        try:
+            store.reject_order(order_id)
+        except OrderStateError:
+            await query.edit_message_text(f"Order {order_id} is no longer pending or doesn't exist.")
+            return
         
-        await context.bot.send_message(order['user_id'], f"❌ **Your order {order_id} has been rejected.** Please contact support if you believe this is an error.")
+        await context.bot.send_message(order.user_id, rejection_message(order_id))
         
         await query.edit_message_text(f"❌ **Order rejected.**")
 
+# --- II.C.1 Bulk Approve/Reject ---
+
+BULK_PAGE_SIZE = 10
+
+def bulk_selection(context):
+    """Order IDs the admin has ticked on the bulk screen (kept across pages)."""
+    return context.user_data.setdefault('bulk_selected', [])
+
+async def toggle_bulk_selection(query, context: ContextTypes.DEFAULT_TYPE, cursor, order_id):
+    """Ticks or unticks one order on the bulk screen."""
+    selected = bulk_selection(context)
+    if order_id in selected:
+        selected.remove(order_id)
+    else:
+        selected.append(order_id)
+    await show_bulk_orders(query, context, cursor)
+
+async def handle_bulk_callback(query, context: ContextTypes.DEFAULT_TYPE, verb, cursor):
+    """Handles the show/clear/approve/reject/approve_page buttons of the bulk screen (cursor: see page_cursor)."""
+    selected = bulk_selection(context)
+
+    if verb == "clear":
+        selected.clear()
+    elif verb in ("approve", "reject"):
+        if selected:
+            await bulk_settle(query, context, verb, list(selected))
+            return
+    elif verb == "approve_page":
+        order_ids = [order_id for order_id, _ in pending_page(cursor)[0]]
+        if order_ids:
+            await bulk_settle(query, context, "approve", order_ids)
+            return
+    await show_bulk_orders(query, context, cursor)
+
+def pending_page(cursor):
+    """Returns ([(order_id, order), ...], has_older, has_newer) for one bulk page (see page_cursor)."""
+    return store.orders_page(status='pending_approval', limit=BULK_PAGE_SIZE, **page_cursor(cursor))
+
+async def show_bulk_orders(query, context: ContextTypes.DEFAULT_TYPE, cursor="a0"):
+    """Pending orders as a tickable list, with batch approve/reject actions."""
+    orders, has_older, has_newer = pending_page(cursor)
+    if not orders and cursor != "a0":
+        cursor = "a0"
+        orders, has_older, has_newer = pending_page(cursor)
+    total = store.order_status_counts().get('pending_approval', 0)
+    selected = bulk_selection(context)
+
+    lines = []
+    for order_id, order in orders:
+        product = store.get_product(order.product_id)
+        product_name = product.name if product else 'Unknown Product'
+        mark = "☑" if order_id in selected else "☐"
+        lines.append(f"{mark} {order_id} — {product_name} — {order.price}৳ — TXN {order.txn_id or 'N/A'}")
+    text = (
+        f"☑️ BULK APPROVE/REJECT — {total} pending, {len(selected)} selected\n\n"
+        + ("\n".join(lines) if lines else "No orders are currently pending approval.")
+    )
+
+    toggles = [InlineKeyboardButton(("☑ " if order_id in selected else "☐ ") + order_id, callback_data=callbacks.BULK_TOGGLE.data(cursor, order_id))
+               for order_id, _ in orders]
+    keyboard = [toggles[i:i + 2] for i in range(0, len(toggles), 2)]
+    if selected:
+        keyboard.append([InlineKeyboardButton(f"✔ Approve selected ({len(selected)})", callback_data=callbacks.BULK.data("approve", cursor)),
+                         InlineKeyboardButton(f"❌ Reject selected ({len(selected)})", callback_data=callbacks.BULK.data("reject", cursor))])
+        keyboard.append([InlineKeyboardButton("Clear selection", callback_data=callbacks.BULK.data("clear", cursor))])
+    if orders:
+        keyboard.append([InlineKeyboardButton(f"✔ Approve all visible ({len(orders)})", callback_data=callbacks.BULK.data("approve_page", cursor))])
+    nav = []
+    if has_older:
+        nav.append(InlineKeyboardButton("« Prev", callback_data=callbacks.BULK.data("show", f"b{order_number(orders[0][0])}")))
+    if has_newer:
+        nav.append(InlineKeyboardButton("Next »", callback_data=callbacks.BULK.data("show", f"a{order_number(orders[-1][0])}")))
+    if nav:
+        keyboard.append(nav)
+    keyboard.append([InlineKeyboardButton("⬅ Back to Admin Panel", callback_data=callbacks.ADMIN_PANEL.data())])
+
+    # Plain text: TXN IDs are user input and may break Markdown
+    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+
+async def bulk_settle(query, context: ContextTypes.DEFAULT_TYPE, action, order_ids):
+    """Approves or rejects a batch in one store write, then notifies the users in the background."""
+    if action == "approve":
+        delivered, out_of_stock, not_pending = store.approve_orders(order_ids)
+        messages = {order_id: (store.get_order(order_id).user_id, delivery_message(order_id, credential))
+                    for order_id, credential in delivered.items()}
+        parse_mode, title = 'Markdown', "✔ Approving"
+    else:
+        rejected, not_pending = store.reject_orders(order_ids)
+        out_of_stock = []
+        messages = {order_id: (store.get_order(order_id).user_id, rejection_message(order_id)) for order_id in rejected}
+        parse_mode, title = None, "❌ Rejecting"
+
+    selected = bulk_selection(context)
+    # Settled orders leave the selection; out-of-stock ones stay ticked for another try
+    selected[:] = [order_id for order_id in selected if order_id not in order_ids or order_id in out_of_stock]
+
+    await query.edit_message_text(f"{title} {len(order_ids)} orders…")
+    # In the background: the admin's next taps queue behind this handler, not behind the sending
+    context.application.create_task(run_bulk_notify(query, context, action, order_ids, messages, parse_mode, title,
+                                                    out_of_stock, not_pending))
+
+async def run_bulk_notify(query, context: ContextTypes.DEFAULT_TYPE, action, order_ids, messages, parse_mode, title,
+                          out_of_stock, not_pending):
+    """Sends the users of a bulk action their messages, then replaces the progress text with the report."""
+    sent = await broadcaster.send_each(context.bot, messages, parse_mode=parse_mode,
+                                       progress=broadcast_progress(query.edit_message_text, f"{title} {len(order_ids)} orders…"))
+
+    await query.edit_message_text(
+        bulk_report(action, order_ids, sent, out_of_stock, not_pending),
+        reply_markup=InlineKeyboardMarkup([
+            [InlineKeyboardButton("☑️ Back to Bulk Select", callback_data=callbacks.BULK.data("show", "a0"))],
+            [InlineKeyboardButton("⬅ Back to Admin Panel", callback_data=callbacks.ADMIN_PANEL.data())],
+        ])
+    )
+
+def bulk_report(action, order_ids, sent, out_of_stock, not_pending):
+    """Per-order result of a bulk action (plain text, at most 40 order lines)."""
+    settled = "delivered" if action == "approve" else "rejected"
+    out_of_stock, not_pending = set(out_of_stock), set(not_pending)
+    lines = []
+    for order_id in order_ids:
+        if order_id in out_of_stock:
+            lines.append(f"📦 {order_id}: out of stock, still pending")
+        elif order_id in not_pending:
+            lines.append(f"⏭ {order_id}: no longer pending")
+        else:
+            outcome, error = sent.outcomes.get(order_id, (FAILED, "not sent"))
+            lines.append(f"✔ {order_id}: {settled}" if outcome == SENT else f"⚠️ {order_id}: {settled}, user not notified ({error})")
+    done = len(order_ids) - len(out_of_stock) - len(not_pending)
+    counts = f"{done} {settled}, " + (f"{len(out_of_stock)} out of stock, " if action == "approve" else "")
+    report = (f"{'✔ Bulk approve' if action == 'approve' else '❌ Bulk reject'}: {counts}{len(not_pending)} skipped\n\n"
+              + "\n".join(lines[:40]))
+    if len(lines) > 40:
+        report += f"\n…and {len(lines) - 40} more"
+    return report
+
 # --- II.D. Analytics & Notifications ---
 
 async def show_stats(query, context: ContextTypes.DEFAULT_TYPE):
     """Displays bot statistics."""
-    db = load_db()
+    status_counts = store.order_status_counts()
     
-    total_users = len(db['users'])
-    total_orders = len(db['orders'])
+    total_users = store.count_users()
+    total_orders = sum(status_counts.values())
     
-    completed = sum(1 for o in db['orders'].values() if o['status'] == 'delivered')
-    pending_approval = sum(1 for o in db['orders'].values() if o['status'] == 'pending_approval')
-    rejected = sum(1 for o in db['orders'].values() if o['status'] == 'rejected')
+    completed = status_counts.get('delivered', 0)
+    pending_approval = status_counts.get('pending_approval', 0)
+    rejected = status_counts.get('rejected', 0)
     
-    categories = len(db['categories'])
-    products = len(db['products'])
-    stock_available = sum(len([item for item in stock_list if not item['used']]) for stock_list in db['stock'].values())
+    categories = len(store.list_categories())
+    products = len(store.list_products())
+    stock_available, _ = store.stock_counts()
     
     stats_text = (
         "📊 **BOT STATISTICS**\n\n"
@@ -772,49 +1049,157 @@ async def show_stats(query, context: ContextTypes.DEFAULT_TYPE):
         f"🔑 **Stock Available:** {stock_available}"
     )
 
-    await query.edit_message_text(stats_text, parse_mode='Markdown', reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅ Back to Admin Panel", callback_data="ADMIN_PANEL_BACK")]]))
+    keyboard = [
+        [InlineKeyboardButton("🔁 Recount from scratch", callback_data=callbacks.STATS_RECOUNT.data())],
+        [InlineKeyboardButton("⬅ Back to Admin Panel", callback_data=callbacks.ADMIN_PANEL.data())]
+    ]
+    await query.edit_message_text(stats_text, parse_mode='Markdown', reply_markup=InlineKeyboardMarkup(keyboard))
 
-async def show_logs(query, context: ContextTypes.DEFAULT_TYPE):
-    """Displays recent activity logs."""
-    db = load_db()
-    logs = "\n".join(db['logs'][:20])
+async def recount_stats(query, context: ContextTypes.DEFAULT_TYPE):
+    """Recomputes all maintained counters from the raw data and reports (and repairs) any drift."""
+    drift = store.verify_counters()
+    
+    if not drift:
+        result_text = "✅ **Counters verified.** No drift found."
+    else:
+        lines = "\n".join(f"• {line}" for line in drift[:30])
+        more = f"\n…and {len(drift) - 30} more" if len(drift) > 30 else ""
+        result_text = f"⚠️ **Counters repaired.** {len(drift)} corrections:\n\n{lines}{more}"
+    
+    await query.edit_message_text(result_text, reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅ Back to Stats", callback_data=callbacks.STATS.data())]]))
+
+def health_rows(kind, limit):
+    """Lines for the busiest (most total time) histograms of one kind on the health screen."""
+    def ms(seconds):
+        return ">10s" if seconds == float('inf') else f"{seconds * 1000:g}ms"
+    return [f"{name}: {h.count}× p50≤{ms(h.quantile(0.5))} p99≤{ms(h.quantile(0.99))}"
+            + (f" errors {h.errors / h.count:.1%}" if h.errors else "")
+            for name, h in metrics.rows(kind)[:limit]] or ["(no calls yet)"]
+
+async def show_health(query, context: ContextTypes.DEFAULT_TYPE):
+    """Latency and error summary from the metrics layer, plus store and queue gauges."""
+    gauges = metrics.gauges()
+    uptime = datetime.timedelta(seconds=int(time.time() - metrics.started))
+    text = (
+        f"📈 HEALTH — up {uptime}\n\n"
+        f"Database: {gauges.get('db_file_bytes', 0) / 1048576:.1f} MB, {gauges.get('pending_writes', 0)} unwritten changes\n"
+        f"Update queue: {gauges.get('update_queue_depth', 0)}, pending approval: {gauges.get('pending_approval_orders', 0)}\n\n"
+        "Handlers:\n" + "\n".join(health_rows("handler", 8)) + "\n\n"
+        "Storage:\n" + "\n".join(health_rows("storage", 6)) + "\n\n"
+        "Telegram API:\n" + "\n".join(health_rows("telegram", 5)) + "\n\n"
+        "Send /profiler <seconds> to profile the running bot."
+    )
+    # Plain text: handler and method names contain underscores
+    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup([
+        [InlineKeyboardButton("🔄 Refresh", callback_data=callbacks.HEALTH.data())],
+        [InlineKeyboardButton("⬅ Back to Admin Panel", callback_data=callbacks.ADMIN_PANEL.data())],
+    ]))
+
+LOGS_PER_PAGE = 15
+
+async def show_logs(query, context: ContextTypes.DEFAULT_TYPE, event_code=None, page=0):
+    """Displays activity logs, newest first, optionally of one event type (EVENT_TYPES index), a page at a time."""
+    event = None if event_code is None else EVENT_TYPES[event_code]
+    entries, has_more = activity.page(event, page, LOGS_PER_PAGE)
+    logs = "\n".join(escape_markdown(format_entry(entry)) for entry in entries)
     
     log_text = (
-        "📜 **ACTIVITY LOGS**\n\n"
+        f"📜 **ACTIVITY LOGS** — {escape_markdown(event.title()) if event else 'All'} (page {page + 1})\n\n"
         f"{logs if logs else 'No recent activity.'}"
     )
-    
-    await query.edit_message_text(log_text, parse_mode='Markdown', reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅ Back to Admin Panel", callback_data="ADMIN_PANEL_BACK")]]))
+
+    filters_row = [("All", None)] + [(e.title(), i) for i, e in enumerate(EVENT_TYPES)]
+    keyboard = [
+        [InlineKeyboardButton(("• " if code == event_code else "") + label, callback_data=callbacks.LOGS.data(code, 0))
+         for label, code in filters_row[i:i + 2]]
+        for i in range(0, len(filters_row), 2)
+    ]
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("⬅ Newer", callback_data=callbacks.LOGS.data(event_code, page - 1)))
+    if has_more:
+        nav.append(InlineKeyboardButton("Older ➡", callback_data=callbacks.LOGS.data(event_code, page + 1)))
+    if nav:
+        keyboard.append(nav)
+    keyboard.append([InlineKeyboardButton("⬅ Back to Admin Panel", callback_data=callbacks.ADMIN_PANEL.data())])
+    
+    await query.edit_message_text(log_text, parse_mode='Markdown', reply_markup=InlineKeyboardMarkup(keyboard))
+
+REMINDER_TEMPLATE = "⏰ **ORDER REMINDER**\n\nYour order `$order_id` is still pending approval.\nAdmin will review soon."
+
+def broadcast_progress(edit, title):
+    """Returns a progress callback for broadcaster.send that edits the admin's message with the running totals."""
+    async def progress(result):
+        await edit(f"{title}\n\n{result.summary()}")
+    return progress
+
+def broadcast_report(title, result):
+    """Final broadcast summary, listing a few of the recipients that were not reached."""
+    report = f"{title}\n\n{result.summary()}"
+    failures = result.failures()
+    if failures:
+        report += "\n\nNot reached:\n" + "\n".join(f"• {chat_id}: {outcome} ({error})" for chat_id, outcome, error in failures[:10])
+        if len(failures) > 10:
+            report += f"\n…and {len(failures) - 10} more"
+    return report
 
 async def notify_pending_users(query, context: ContextTypes.DEFAULT_TYPE):
-    """Sends a reminder to all users with pending approval orders."""
-    db = load_db()
-    
-    pending_orders = {k:v for k,v in db['orders'].items() if v['status'] == 'pending_approval'}
-    pending_user_ids = {o['user_id'] for o in pending_orders.values()}
+    """Sends a reminder to every user with an order pending approval (one per user, for their first such order)."""
+    recipients = {}
+    for order_id, order in store.orders_with_status('pending_approval'):
+        recipients.setdefault(order.user_id, {"order_id": order_id})
     
-    if not pending_user_ids:
-        await query.edit_message_text("No users with pending orders to notify.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅ Back to Admin Panel", callback_data="ADMIN_PANEL_BACK")]]))
+    if not recipients:
+        await query.edit_message_text("No users with pending orders to notify.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅ Back to Admin Panel", callback_data=callbacks.ADMIN_PANEL.data())]]))
         return
 
-    count = 0
-    for user_id in pending_user_ids:
-        try:
-            order_id = next(k for k,v in pending_orders.items() if v['user_id'] == user_id)
-            
-            await context.bot.send_message(
-                user_id,
-                f"⏰ **ORDER REMINDER**\n\nYour order `{order_id}` is still pending approval.\nAdmin will review soon.",
-                parse_mode='Markdown'
-            )
-            count += 1
-        except Exception:
-            pass 
+    await query.edit_message_text(f"🔔 Sending reminders to {len(recipients)} users…")
+    # In the background, like the offer broadcast: the admin can keep using the panel meanwhile
+    context.application.create_task(run_pending_reminders(query, context, recipients))
+
+async def run_pending_reminders(query, context: ContextTypes.DEFAULT_TYPE, recipients):
+    """Sends the pending-order reminders, reporting progress on the admin's message."""
+    result = await broadcaster.send(context.bot, recipients, REMINDER_TEMPLATE, parse_mode='Markdown',
+                                    progress=broadcast_progress(query.edit_message_text, "🔔 Sending reminders…"))
     
-    log_activity(db, f"NOTIFICATION SENT — {count} users reminded of pending orders")
-    save_db(db)
+    activity.record("NOTIFICATION SENT", f"{result.counts[SENT]} users reminded of pending orders "
+                                         f"({result.counts[BLOCKED]} blocked, {result.counts[FAILED]} failed)")
 
-    await query.edit_message_text(f"🔔 **Notification Sent.** Sent reminder to **{count}** users with pending orders.", parse_mode='Markdown', reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅ Back to Admin Panel", callback_data="ADMIN_PANEL_BACK")]]))
+    await query.edit_message_text(broadcast_report("🔔 Notification Sent.", result), reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅ Back to Admin Panel", callback_data=callbacks.ADMIN_PANEL.data())]]))
+
+async def start_broadcast(query, context: ContextTypes.DEFAULT_TYPE):
+    """Entry point for the offer broadcast conversation."""
+    await query.answer()
+    if not is_admin(query.from_user.id):
+        return ConversationHandler.END
+    await query.edit_message_text(
+        "📣 **BROADCAST OFFER**\n\n"
+        f"Send the offer text. It will be sent to all {store.count_users()} users and shown under 🎁 Offers.\n"
+        "Send /cancel to abort.",
+        parse_mode='Markdown'
+    )
+    return BROADCAST_INPUT
+
+async def process_broadcast_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Saves the offer and starts broadcasting it to every registered user."""
+    offer_text = update.message.text
+    store.set_setting("offer", {"text": offer_text, "at": datetime.datetime.now().isoformat()})
+
+    status_message = await update.message.reply_text("📣 Broadcasting offer…")
+    # Runs in the background so the conversation ends now, not after the last message is sent
+    context.application.create_task(run_offer_broadcast(context, offer_text, status_message), update=update)
+    return ConversationHandler.END
+
+async def run_offer_broadcast(context: ContextTypes.DEFAULT_TYPE, offer_text, status_message):
+    """Sends the offer to all users, reporting progress on the admin's status message."""
+    # Sent as plain text: admin-written text may not be valid Markdown
+    result = await broadcaster.send(context.bot, store.list_user_ids(), f"🎁 NEW OFFER\n\n{offer_text}",
+                                    progress=broadcast_progress(status_message.edit_text, "📣 Broadcasting offer…"))
+
+    activity.record("OFFER BROADCAST", f"sent to {result.counts[SENT]} users "
+                                       f"({result.counts[BLOCKED]} blocked, {result.counts[FAILED]} failed)")
+
+    await status_message.edit_text(broadcast_report("📣 Offer broadcast finished.", result), reply_markup=get_admin_menu_keyboard())
 
 
 # --- II.E. ADMIN SEARCH FUNCTIONALITY ---
@@ -824,30 +1209,14 @@ async def start_admin_search(query, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     await query.edit_message_text(
         "🔍 **ADMIN SEARCH**\n\n"
-        "Enter Order ID (e.g., `order_101`), TXN ID, or User ID to search."
+        "Enter Order ID (e.g., `order_101`), TXN ID (or its first characters), User ID or sender number to search."
     )
     return SEARCH_INPUT
 
 async def process_admin_search_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Processes the search input."""
     search_term = update.message.text.strip()
-    db = load_db()
-    
-    results = []
-    
-    for order_id, order in db['orders'].items():
-        match_type = None
-        if search_term.lower() == order_id.lower():
-            match_type = "Order ID"
-        elif order.get('txn_id') and search_term.upper() == order['txn_id'].upper():
-            match_type = "TXN ID"
-        elif search_term.isdigit() and str(order['user_id']) == search_term:
-             match_type = "User ID"
-             
-        if match_type:
-            results.append((order_id, order, match_type))
-            if match_type != "User ID":
-                break 
+    results = store.search_orders(search_term)
 
     if not results:
         await update.message.reply_text(f"❌ No orders found matching: `{search_term}`", 
@@ -857,17 +1226,18 @@ async def process_admin_search_input(update: Update, context: ContextTypes.DEFAU
 
     response = f"✅ **Search Results for:** `{search_term}`\n\n"
     for order_id, order, match_type in results:
-        user_info = db['users'].get(str(order['user_id']), {})
-        product_name = db['products'].get(order['product_id'], {}).get('name', 'Unknown Product')
+        user_info = store.get_user(order.user_id) or User(username='N/A')
+        product = store.get_product(order.product_id)
+        product_name = product.name if product else 'Unknown Product'
         
         response += (
             f"--- Match by {match_type} ---\n"
             f"ID: **{order_id}**\n"
-            f"User: @{user_info.get('username', 'N/A')} (ID: {order['user_id']})\n"
+            f"User: @{user_info.username} (ID: {order.user_id})\n"
             f"Product: {product_name}\n"
-            f"Status: **{order['status'].upper()}**\n"
-            f"Price: {order['price']}৳\n"
-            f"TXN: `{order.get('txn_id', 'N/A')}`\n\n"
+            f"Status: **{order.status.upper()}**\n"
+            f"Price: {order.price}৳\n"
+            f"TXN: `{order.txn_id or 'N/A'}`\n\n"
         )
         
     await update.message.reply_text(response, 
@@ -877,45 +1247,249 @@ async def process_admin_search_input(update: Update, context: ContextTypes.DEFAU
     return ConversationHandler.END
 
 
+# --- II.F. STATEMENT RECONCILIATION ---
+
+async def start_reconcile(query, context: ContextTypes.DEFAULT_TYPE):
+    """Entry point for the statement reconciliation conversation."""
+    await query.answer()
+    if not is_admin(query.from_user.id):
+        return ConversationHandler.END
+    await query.edit_message_text(
+        "🏦 **RECONCILE STATEMENT**\n\n"
+        "Upload the mobile-banking statement export as a .csv file. It needs a header row with "
+        "TXN ID, sender number and amount columns.\n\n"
+        "Orders pending approval whose TXN ID, sender and amount all match a row are approved "
+        "and delivered. Send /cancel to abort.",
+        parse_mode='Markdown'
+    )
+    return RECONCILE_INPUT
+
+async def process_reconcile_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Joins the uploaded statement against pending orders, then approves and delivers every exact match."""
+    document = update.message.document
+    if not (document.file_name or "").lower().endswith(".csv"):
+        await update.message.reply_text("❌ Please upload the statement as a .csv file.")
+        return RECONCILE_INPUT
+    if document.file_size and document.file_size > stock_import.MAX_FILE_BYTES:
+        await update.message.reply_text("❌ File is too large (max 20 MB). Please split it into smaller files.")
+        return RECONCILE_INPUT
+
+    with tempfile.SpooledTemporaryFile(max_size=1024 * 1024) as buffer:
+        telegram_file = await context.bot.get_file(document.file_id)
+        await telegram_file.download_to_memory(out=buffer)
+        buffer.seek(0)
+        try:
+            result = reconcile.reconcile(reconcile.parse_statement(buffer),
+                                         store.orders_with_status('pending_approval'), store.get_order_by_txn)
+        except reconcile.StatementError as e:
+            await update.message.reply_text(f"❌ {e}")
+            return RECONCILE_INPUT
+
+    status_message = await update.message.reply_text(f"🏦 Approving {len(result.matched)} matched orders…")
+    matched = dict(result.matched)
+    # One batch: the store re-checks every status, so orders settled meanwhile are skipped
+    delivered, out_of_stock, not_pending = store.approve_orders(matched)
+    for order_id in not_pending:
+        result.conflicts.append((None, matched[order_id].txn_id, f"{order_id}: settled while reconciling"))
+    deliveries = {order_id: (matched[order_id].user_id, delivery_message(order_id, credential))
+                  for order_id, credential in delivered.items()}
+    # Delivered in the background so the conversation ends now, not after the last message is sent
+    context.application.create_task(run_reconcile_deliveries(context, status_message, result, deliveries, out_of_stock),
+                                    update=update)
+    return ConversationHandler.END
+
+async def run_reconcile_deliveries(context: ContextTypes.DEFAULT_TYPE, status_message, result, deliveries, out_of_stock):
+    """Sends the matched orders' credentials, then reports the reconciliation on the admin's status message."""
+    sent = await broadcaster.send_each(context.bot, deliveries, parse_mode='Markdown',
+                                       progress=broadcast_progress(status_message.edit_text, "🏦 Delivering matched orders…"))
+
+    activity.record("STATEMENT RECONCILED", f"{len(deliveries)} approved, {len(out_of_stock)} out of stock, "
+                                            f"{len(result.conflicts)} conflicts, {len(result.unmatched)} unmatched")
+
+    await status_message.edit_text(reconcile_report(result, deliveries, out_of_stock, sent), reply_markup=get_admin_menu_keyboard())
+
+def reconcile_report(result, deliveries, out_of_stock, sent):
+    """Plain-text summary of a reconciliation (TXN IDs and reasons are not Markdown-safe)."""
+    def sample(lines):
+        text = "".join(f"\n• {line}" for line in lines[:10])
+        return text + (f"\n…and {len(lines) - 10} more" if len(lines) > 10 else "")
+
+    def row(line_no):
+        return f"row {line_no}" if line_no else "—"
+
+    report = (
+        "🏦 Statement reconciled.\n\n"
+        f"✅ Approved & delivered: {len(deliveries)}"
+    )
+    failures = sent.failures()
+    if failures:
+        report += f"\n⚠️ Approved but delivery message not sent: {len(failures)}" + sample(
+            [f"{order_id}: {outcome} ({error})" for order_id, outcome, error in failures])
+    if out_of_stock:
+        report += f"\n📦 Matched but out of stock (still pending): {len(out_of_stock)}" + sample(out_of_stock)
+    report += f"\n\n❗ Conflicts: {len(result.conflicts)}" + sample(
+        [f"{row(line_no)} {txn_id}: {reason}" for line_no, txn_id, reason in result.conflicts])
+    report += f"\n❔ Unmatched: {len(result.unmatched)}" + sample(
+        [f"{row(line_no)} {txn_id}" for line_no, txn_id in result.unmatched])
+    if result.settled:
+        report += f"\n☑️ Already settled: {len(result.settled)}" + sample(
+            [f"{row(line_no)} {txn_id} ({order_id})" for line_no, txn_id, order_id in result.settled])
+    if result.malformed:
+        report += f"\n⚠️ Malformed rows: {len(result.malformed)} (rows {', '.join(map(str, result.malformed[:10]))})"
+    return report
+
+
 # --- III. MAIN SETUP ---
 
-def main() -> None:
-    """Start the bot and register all handlers."""
-    application = Application.builder().token(BOT_TOKEN).build()
+async def on_startup(application: Application) -> None:
+    """Starts the store's background work (journal flusher/compactor, archiver) once the event loop is running."""
+    store.start()
+    stock_alerts.start(lambda text: application.bot.send_message(ADMIN_ID, text, parse_mode='Markdown'))
+    # In a cluster each worker expires the orders of its own users, whose user_data it holds
+    order_expiry.start(lambda order_ids: notify_expired_orders(application, order_ids), owns_user=owns_user)
+    # In a cluster only worker 0 archives; the others reload the archive index it writes
+    if worker_index in (None, 0):
+        application.bot_data['archiver'] = asyncio.create_task(run_archiver(store, ARCHIVE_AFTER_DAYS, ARCHIVE_INTERVAL))
+    if METRICS_ENABLED:
+        port = METRICS_PORT + (worker_index or 0)
+        application.bot_data['metrics_server'] = await metrics.serve(METRICS_LISTEN, port)
+        print(f"Metrics are served on http://{METRICS_LISTEN}:{port}/metrics")
+
+async def on_shutdown(application: Application) -> None:
+    """Persists anything outstanding (final journal flush + compaction) on exit."""
+    archiver = application.bot_data.pop('archiver', None)
+    if archiver is not None:
+        archiver.cancel()
+    metrics_server = application.bot_data.pop('metrics_server', None)
+    if metrics_server is not None:
+        metrics_server.close()
+    stock_alerts.close()
+    order_expiry.close()
+    await store.close()
+    activity.close()
+
+def build_router() -> CallbackRouter:
+    """Routes every inline button outside the admin conversations (see callbacks.py)."""
+    router = CallbackRouter(is_admin)
+    # Customer side
+    router.add(callbacks.CATEGORIES, browse_categories)
+    router.add(callbacks.PRODUCTS, show_products)
+    router.add(callbacks.PRODUCT, show_product_details)
+    router.add(callbacks.BUY, buy_now_action)
+    router.add(callbacks.MY_ORDERS, handle_user_orders_page)
+    # Admin panel
+    for action, handler in (
+        (callbacks.ADMIN_PANEL, back_to_admin_panel),
+        (callbacks.CATEGORY_MANAGER, show_category_manager),
+        (callbacks.PRODUCT_MANAGER, show_product_manager),
+        (callbacks.STOCK_MANAGER, show_stock_manager),
+        (callbacks.PENDING_ORDERS, show_pending_orders),
+        (callbacks.ORDER_VIEW, handle_order_view_navigation),
+        (callbacks.APPROVE, approve_order_action),
+        (callbacks.REJECT, reject_order_action),
+        (callbacks.BULK, handle_bulk_callback),
+        (callbacks.BULK_TOGGLE, toggle_bulk_selection),
+        (callbacks.STATS, show_stats),
+        (callbacks.STATS_RECOUNT, recount_stats),
+        (callbacks.HEALTH, show_health),
+        (callbacks.LOGS, show_logs),
+        (callbacks.NOTIFY, notify_pending_users),
+    ):
+        router.add(action, handler, admin=True)
+    return router
+
+def prepare_store() -> None:
+    """Creates the starter database.json on first run, and migrates it the first time SQLite is switched on."""
+    if not os.path.exists(DB_FILE) and not (STORAGE_BACKEND == "sqlite" and os.path.exists(SQLITE_FILE)):
+        print("Creating initial database.json with dummy data.")
+        db = {
+            "users": {},
+            "categories": {"cat_1": {"name": "ChatGPT & AI", "banner": "N/A"}, "cat_2": {"name": "YouTube Premium", "banner": "N/A"}},
+            "products": {"prod_1": {"cat_id": "cat_1", "name": "ChatGPT Plus", "duration": "1 Month", "price": 250, "country": "Turkey", "rules": "• Don't change password\n• No refund after delivery", "photo": "N/A"}},
+            "stock": {"prod_1": {"available": ["user@mail.com|pass123", "user4@mail.com|pass456"], "used": []}},
+            "orders": {},
+            "next_order_id": 100
+        }
+        with open(DB_FILE, 'w') as f:
+             json.dump(db, f, indent=2)
+
+    # One-shot migration the first time the SQLite backend is switched on
+    if STORAGE_BACKEND == "sqlite" and not os.path.exists(SQLITE_FILE):
+        counts = migrate_json_to_sqlite(DB_FILE, SQLITE_FILE, DB_JOURNAL_FILE,
+                                        OrderArchive(ARCHIVE_DIR, cached_segments=ARCHIVE_CACHED_SEGMENTS).load())
+        print(f"Migrated {DB_FILE} into {SQLITE_FILE}: " + ", ".join(f"{n} {t}" for t, n in counts.items()))
+
+def open_storage() -> None:
+    """Loads the archive, the store and the activity log (moving the log lines older versions kept in the store)."""
+    archive.load()
+    store.load()
+    activity.load()
+    imported = activity.import_legacy(store.take_legacy_logs())
+    if imported:
+        print(f"Moved {imported} activity log lines from the database into {ACTIVITY_LOG_FILE}.")
+
+def build_application(updater=True) -> Application:
+    """Builds the Application with every handler registered.
+
+    Without an updater (cluster.py's workers) nothing is fetched from Telegram: the
+    caller puts updates on application.update_queue and runs on_startup/on_shutdown.
+    """
+    # Store transitions are atomic and check order status, and multi-step flows hold
+    # per-user/per-order locks, so updates can be processed concurrently; each
+    # user's own updates still run one at a time, in the order they arrived.
+    builder = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .base_url(BOT_API_BASE_URL)
+        .base_file_url(BOT_API_BASE_FILE_URL)
+        .request(InstrumentedRequest(metrics, connection_pool_size=256))
+        .concurrent_updates(UserOrderedUpdateProcessor(CONCURRENT_UPDATES))
+        # user_data, chat_data and conversation states survive restarts, written to the store in batches
+        .persistence(StorePersistence(store, update_interval=PERSISTENCE_INTERVAL))
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+    )
+    if not updater:
+        builder.updater(None)
+    application = builder.build()
 
     # --- Admin Conversation Handlers (Fixed) ---
     
     cat_conv_handler = ConversationHandler(
-        entry_points=[CallbackQueryHandler(start_add_category, pattern=r'^ADMIN_CAT_ADD$')],
+        name="add_category", persistent=True,
+        entry_points=[CallbackQueryHandler(lambda update, context: start_add_category(update.callback_query, context), pattern=callbacks.CATEGORY_ADD.matches)],
         states={
             CATEGORY_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_category_name)],
             CATEGORY_BANNER: [MessageHandler(filters.TEXT & ~filters.COMMAND, finish_add_category)],
         },
         # Added CallbackQuery fallback to ensure buttons work while in conversation
         fallbacks=[CommandHandler("cancel", cancel_admin_action),
-                   CallbackQueryHandler(cancel_admin_action, pattern=r'^ADMIN_PANEL_BACK$')], 
+                   CallbackQueryHandler(cancel_admin_action, pattern=callbacks.ADMIN_PANEL.matches)], 
         allow_reentry=True,
         per_message=False 
     )
     
     stock_conv_handler = ConversationHandler(
-        entry_points=[CallbackQueryHandler(start_add_stock, pattern=r'^ADMIN_STOCK_START_ADD$')],
+        name="add_stock", persistent=True,
+        entry_points=[CallbackQueryHandler(lambda update, context: start_add_stock(update.callback_query, context), pattern=callbacks.STOCK_ADD.matches)],
         states={
             STOCK_SELECT_PRODUCT: [
-                CallbackQueryHandler(get_stock_product_selection_callback, pattern=r'^STOCK_ADD_PROD_')
+                CallbackQueryHandler(get_stock_product_selection_callback, pattern=callbacks.STOCK_PRODUCT.matches)
             ],
             STOCK_INPUT: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, get_stock_input)
+                MessageHandler(filters.TEXT & ~filters.COMMAND, get_stock_input),
+                MessageHandler(filters.Document.ALL, get_stock_file)
             ]
         },
         fallbacks=[CommandHandler("cancel", cancel_admin_action),
-                   CallbackQueryHandler(cancel_admin_action, pattern=r'^ADMIN_CANCEL_STOCK$')], 
+                   CallbackQueryHandler(cancel_admin_action, pattern=callbacks.STOCK_CANCEL.matches)], 
         allow_reentry=True,
         per_message=False
     )
     
     search_conv_handler = ConversationHandler(
-        entry_points=[CallbackQueryHandler(lambda update, context: start_admin_search(update.callback_query, context), pattern=r'^ADMIN_SEARCH_START$')],
+        name="admin_search", persistent=True,
+        entry_points=[CallbackQueryHandler(lambda update, context: start_admin_search(update.callback_query, context), pattern=callbacks.SEARCH.matches)],
         states={
             SEARCH_INPUT: [MessageHandler(filters.TEXT & ~filters.COMMAND, process_admin_search_input)],
         },
@@ -924,10 +1498,34 @@ def main() -> None:
         per_message=False
     )
 
+    broadcast_conv_handler = ConversationHandler(
+        name="offer_broadcast", persistent=True,
+        entry_points=[CallbackQueryHandler(lambda update, context: start_broadcast(update.callback_query, context), pattern=callbacks.BROADCAST.matches)],
+        states={
+            BROADCAST_INPUT: [MessageHandler(filters.TEXT & ~filters.COMMAND, process_broadcast_input)],
+        },
+        fallbacks=[CommandHandler("cancel", cancel_admin_action)],
+        allow_reentry=True,
+        per_message=False
+    )
+
+    reconcile_conv_handler = ConversationHandler(
+        name="reconcile", persistent=True,
+        entry_points=[CallbackQueryHandler(lambda update, context: start_reconcile(update.callback_query, context), pattern=callbacks.RECONCILE.matches)],
+        states={
+            RECONCILE_INPUT: [MessageHandler(filters.Document.ALL, process_reconcile_file)],
+        },
+        fallbacks=[CommandHandler("cancel", cancel_admin_action)],
+        allow_reentry=True,
+        per_message=False
+    )
+
 
     application.add_handler(cat_conv_handler)
     application.add_handler(stock_conv_handler)
     application.add_handler(search_conv_handler) 
+    application.add_handler(broadcast_conv_handler)
+    application.add_handler(reconcile_conv_handler)
     
     # --- USER HANDLERS ---
     application.add_handler(CommandHandler("start", start_command))
@@ -936,6 +1534,8 @@ def main() -> None:
     
     # ADMIN ONLY: Panel command
     application.add_handler(CommandHandler("panel", admin_panel_command))
+    application.add_handler(CommandHandler("profiler", profiler_command))
+    application.add_handler(CommandHandler("lowstock", lowstock_command))
     
     # Handles payment submission 
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_payment_submission, block=False))
@@ -943,40 +1543,39 @@ def main() -> None:
     # Handles main menu button clicks (ReplyKeyboard)
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_main_menu))
     
-    # --- USER CALLBACKS (Buy Flow) ---
-    application.add_handler(CallbackQueryHandler(show_categories, pattern=r'^BACK_CATEGORIES$'))
-    application.add_handler(CallbackQueryHandler(show_products, pattern=r'^CAT_ID_'))
-    application.add_handler(CallbackQueryHandler(show_products, pattern=r'^BACK_TO_PRODUCTS_'))
-    application.add_handler(CallbackQueryHandler(show_product_details, pattern=r'^PROD_ID_'))
-    application.add_handler(CallbackQueryHandler(buy_now_action, pattern=r'^BUY_NOW$'))
-    
-    # --- ADMIN CALLBACKS (Panel Navigation & Manager Routes) ---
-    application.add_handler(CallbackQueryHandler(back_to_admin_panel, pattern=r'^ADMIN_PANEL_BACK$'))
-    application.add_handler(CallbackQueryHandler(handle_admin_menu_callback, pattern=r'^ADMIN_'))
-    
-    # ADMIN CALLBACKS (Order Actions & Navigation)
-    application.add_handler(CallbackQueryHandler(handle_admin_order_action, pattern=r'^ADMIN_(APPROVE|REJECT)_'))
-    application.add_handler(CallbackQueryHandler(handle_order_view_navigation, pattern=r'^ADMIN_ORDER_VIEW_')) 
+    # --- INLINE BUTTONS (Buy Flow, Admin Panel, Order Actions) ---
+    # One handler for every button outside the conversations above: a dict lookup on the action code
+    application.add_handler(CallbackQueryHandler(build_router().dispatch))
     
-    # NOTE: Job Scheduler for Stock Alert is permanently removed.
+    # Stock alerts need no scheduled job: stock_alerts checks each product as its stock changes
 
-    print("Bot is running and listening for updates...")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    metrics.instrument_handlers(application)
+    # Registered after instrumenting so the update counter itself is not timed
+    application.add_handler(TypeHandler(Update, count_profiled_update), group=-1)
+    return application
+
+def main() -> None:
+    """Start the bot and register all handlers."""
+    open_storage()
+    application = build_application()
+
+    if WEBHOOK_ENABLED:
+        # Telegram pushes each update as it happens (up to WEBHOOK_MAX_CONNECTIONS at once)
+        # instead of the bot long-polling for batches; the secret token rejects forged posts.
+        print(f"Bot is running and receiving updates by webhook on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH}...")
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET_TOKEN or secrets.token_urlsafe(32),
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=ALLOWED_UPDATES,
+        )
+    else:
+        print("Bot is running and listening for updates...")
+        application.run_polling(allowed_updates=ALLOWED_UPDATES)
 
 if __name__ == "__main__":
-    # Initialize database.json if it doesn't exist
-    if not os.path.exists('database.json'):
-        print("Creating initial database.json with dummy data.")
-        db = {
-            "users": {},
-            "categories": {"cat_1": {"name": "ChatGPT & AI", "banner": "N/A"}, "cat_2": {"name": "YouTube Premium", "banner": "N/A"}},
-            "products": {"prod_1": {"cat_id": "cat_1", "name": "ChatGPT Plus", "duration": "1 Month", "price": 250, "country": "Turkey", "rules": "• Don't change password\n• No refund after delivery", "photo": "N/A"}},
-            "stock": {"prod_1": [{"credential": "user@mail.com|pass123", "used": False}, {"credential": "user4@mail.com|pass456", "used": False}]},
-            "orders": {},
-            "logs": [],
-            "next_order_id": 100
-        }
-        with open('database.json', 'w') as f:
-             json.dump(db, f, indent=2)
-        
+    prepare_store()
     main()
@@ -0,0 +1,215 @@
+# metrics.py - Latency histograms for handlers, storage calls and Bot API requests, plus a Prometheus endpoint
+
+import asyncio
+import bisect
+import functools
+import inspect
+import logging
+import time
+
+from telegram.ext import ConversationHandler
+from telegram.request import HTTPXRequest
+
+from callbacks import Action, CallbackRouter
+
+logger = logging.getLogger(__name__)
+
+# Histogram bucket upper bounds in seconds (Prometheus "le" labels)
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Storage methods not worth timing: one-off setup, or not storage work at all
+_UNTIMED_STORE_METHODS = {"add_catalog_listener", "add_stock_listener", "add_activity_listener", "attach_archive", "gauges"}
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram with a count of calls that raised."""
+
+    __slots__ = ("counts", "count", "total", "errors")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)   # last slot: above the largest bucket
+        self.count = 0
+        self.total = 0.0
+        self.errors = 0
+
+    def observe(self, seconds, error=False):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.errors += error
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile (inf if beyond the last bucket)."""
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip((*BUCKETS, float('inf')), self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+class Metrics:
+    """Histograms per (kind, name), where kind is "handler", "storage" or "telegram", plus gauges.
+
+    instrument_handlers() and instrument_store() wrap the callables in place, so the
+    handlers and the store need no changes; InstrumentedRequest times Bot API calls.
+    Gauges are callables returning {name: value}, read when the metrics are shown.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.histograms = {}
+        self._gauges = []
+
+    def observe(self, kind, name, seconds, error=False):
+        histogram = self.histograms.get((kind, name))
+        if histogram is None:
+            histogram = self.histograms[(kind, name)] = Histogram()
+        histogram.observe(seconds, error)
+
+    def add_gauges(self, callback):
+        """Registers callback() -> {gauge name: number}."""
+        self._gauges.append(callback)
+
+    def gauges(self):
+        values = {}
+        for callback in self._gauges:
+            try:
+                values.update(callback())
+            except Exception:
+                logger.exception("Reading gauges from %r failed.", callback)
+        return values
+
+    # --- Instrumentation ---
+
+    def timed(self, kind, name, fn):
+        """Returns `fn` (sync or async) wrapped to record its latency and errors."""
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    result = await fn(*args, **kwargs)
+                except Exception:
+                    self.observe(kind, name, time.perf_counter() - start, error=True)
+                    raise
+                self.observe(kind, name, time.perf_counter() - start)
+                return result
+        else:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    result = fn(*args, **kwargs)
+                except Exception:
+                    self.observe(kind, name, time.perf_counter() - start, error=True)
+                    raise
+                self.observe(kind, name, time.perf_counter() - start)
+                return result
+        return wrapper
+
+    def instrument_store(self, store):
+        """Times every public method of a storage backend, by method name."""
+        for name, fn in inspect.getmembers(type(store), inspect.isfunction):
+            if not name.startswith('_') and name not in _UNTIMED_STORE_METHODS:
+                setattr(store, name, self.timed("storage", name, getattr(store, name)))
+        self.add_gauges(store.gauges)
+
+    def instrument_handlers(self, application):
+        """Times the callback of every registered handler, including those inside conversations
+        and each route of a callbacks.CallbackRouter (rather than its dispatcher)."""
+        for handlers in application.handlers.values():
+            for handler in handlers:
+                self._instrument_handler(handler)
+        self.add_gauges(lambda: {"update_queue_depth": application.update_queue.qsize()})
+
+    def _instrument_handler(self, handler):
+        if isinstance(handler, ConversationHandler):
+            for inner in (*handler.entry_points, *(h for hs in handler.states.values() for h in hs), *handler.fallbacks):
+                self._instrument_handler(inner)
+            return
+        router = getattr(handler.callback, '__self__', None)
+        if isinstance(router, CallbackRouter):
+            for route in router.routes.values():
+                route.handler = self.timed("handler", route.handler.__name__, route.handler)
+            return
+        name = handler.callback.__name__
+        if name == "<lambda>":
+            # Lambda wrappers are named after what they route: their callback pattern or action
+            pattern = getattr(handler, 'pattern', None)
+            if isinstance(getattr(pattern, '__self__', None), Action):
+                name = f"callback action {pattern.__self__.code}"
+            elif pattern is not None:
+                name = pattern.pattern
+        handler.callback = self.timed("handler", name, handler.callback)
+
+    # --- Reports ---
+
+    def rows(self, kind):
+        """[(name, histogram), ...] of one kind, most time spent first."""
+        return sorted(((name, h) for (k, name), h in self.histograms.items() if k == kind),
+                      key=lambda item: item[1].total, reverse=True)
+
+    def render_prometheus(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for kind in ("handler", "storage", "telegram"):
+            metric = f"bot_{kind}_seconds"
+            lines += [f"# HELP {metric} Latency of {kind} calls.", f"# TYPE {metric} histogram"]
+            for name, h in sorted((name, h) for (k, name), h in self.histograms.items() if k == kind):
+                label = name.replace('\\', '\\\\').replace('"', '\\"')
+                cumulative = 0
+                for bound, n in zip((*BUCKETS, "+Inf"), h.counts):
+                    cumulative += n
+                    lines.append(f'{metric}_bucket{{name="{label}",le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_sum{{name="{label}"}} {h.total:.6f}')
+                lines.append(f'{metric}_count{{name="{label}"}} {h.count}')
+            lines += [f"# HELP bot_{kind}_errors_total {kind.title()} calls that raised.",
+                      f"# TYPE bot_{kind}_errors_total counter"]
+            lines += [f'bot_{kind}_errors_total{{name="{name}"}} {h.errors}'
+                      for (k, name), h in sorted(self.histograms.items()) if k == kind]
+        for name, value in sorted(self.gauges().items()):
+            lines += [f"# TYPE bot_{name} gauge", f"bot_{name} {value}"]
+        lines += ["# TYPE bot_uptime_seconds gauge", f"bot_uptime_seconds {time.time() - self.started:.0f}"]
+        return "\n".join(lines) + "\n"
+
+    async def serve(self, host, port):
+        """Serves GET /metrics on a local port (plain asyncio, no web framework needed)."""
+        async def handle(reader, writer):
+            try:
+                request_line = await reader.readline()
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                if request_line.split(b' ')[1:2] == [b'/metrics']:
+                    status, body = "200 OK", self.render_prometheus().encode('utf-8')
+                else:
+                    status, body = "404 Not Found", b"Not found\n"
+                writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                             f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode('ascii') + body)
+                await writer.drain()
+            except (ConnectionError, asyncio.IncompleteReadError):
+                pass
+            finally:
+                writer.close()
+
+        return await asyncio.start_server(handle, host, port)
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest that records each Bot API call's latency under its method name."""
+
+    def __init__(self, metrics, **kwargs):
+        super().__init__(**kwargs)
+        self._metrics = metrics
+
+    async def do_request(self, url, method, *args, **kwargs):
+        api_method = url.rsplit('/', 1)[-1]
+        start = time.perf_counter()
+        try:
+            result = await super().do_request(url, method, *args, **kwargs)
+        except Exception:
+            self._metrics.observe("telegram", api_method, time.perf_counter() - start, error=True)
+            raise
+        self._metrics.observe("telegram", api_method, time.perf_counter() - start, error=result[0] >= 400)
+        return result
@@ -0,0 +1,149 @@
+# models.py - Compact typed records for users, categories, products, stock and orders
+
+import collections
+import enum
+import sys
+
+
+class OrderStatus(str, enum.Enum):
+    """Order status. Members are str, so they compare, hash and serialise as their plain value."""
+
+    WAITING_PAYMENT = "waiting_payment"
+    PENDING_APPROVAL = "pending_approval"
+    DELIVERED = "delivered"
+    REJECTED = "rejected"
+    EXPIRED = "expired"             # never paid within config.ORDER_PAYMENT_TIMEOUT (expiry.py)
+
+    __str__ = str.__str__
+    __format__ = str.__format__
+
+
+class Record:
+    """Base of the slotted records below; the slot names are the keys of the database.json layout.
+
+    Records replace the per-entity dicts, so field names are stored once per class
+    instead of once per entity. from_dict()/to_dict() convert to and from the JSON
+    layout (to_dict() leaves out unset fields, as the JSON always did) and
+    from_row() reads a sqlite3.Row with the same column names.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{k: data[k] for k in cls.__slots__ if k in data})
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(**{k: row[k] for k in cls.__slots__})
+
+    def to_dict(self):
+        return {k: v for k in self.__slots__ if (v := getattr(self, k)) is not None}
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(f'{k}={getattr(self, k)!r}' for k in self.__slots__)})"
+
+
+class User(Record):
+    __slots__ = ('username', 'name', 'total_spent', 'total_orders', 'completed_orders', 'pending_orders',
+                 'rejected_orders', 'first_order', 'last_order', 'level')
+
+    def __init__(self, username=None, name=None, total_spent=0, total_orders=0, completed_orders=0,
+                 pending_orders=0, rejected_orders=0, first_order=None, last_order=None, level=None):
+        self.username = username
+        self.name = name
+        self.total_spent = total_spent
+        self.total_orders = total_orders
+        self.completed_orders = completed_orders
+        self.pending_orders = pending_orders
+        self.rejected_orders = rejected_orders
+        self.first_order = first_order
+        self.last_order = last_order
+        self.level = level
+
+
+class Category(Record):
+    __slots__ = ('name', 'banner')
+
+    def __init__(self, name, banner=None):
+        self.name = name
+        self.banner = banner
+
+
+class Product(Record):
+    __slots__ = ('cat_id', 'name', 'duration', 'price', 'country', 'rules', 'photo')
+
+    def __init__(self, cat_id, name, price, duration=None, country=None, rules=None, photo=None):
+        self.cat_id = cat_id
+        self.name = name
+        self.price = price
+        self.duration = duration
+        self.country = country
+        self.rules = rules
+        self.photo = photo
+
+
+class Order(Record):
+    """One order. user_id is an int, status an OrderStatus (None only while being created)."""
+
+    __slots__ = ('user_id', 'product_id', 'price', 'status', 'created_at', 'txn_id', 'sender_number',
+                 'submitted_amount', 'delivery_credential')
+
+    def __init__(self, user_id, product_id, price, status, created_at, txn_id=None, sender_number=None,
+                 submitted_amount=None, delivery_credential=None):
+        self.user_id = int(user_id)
+        # Many orders share a product: keep one copy of its ID
+        self.product_id = sys.intern(product_id)
+        self.price = price
+        self.status = status and OrderStatus(status)
+        self.created_at = created_at
+        self.txn_id = txn_id
+        self.sender_number = sender_number
+        self.submitted_amount = submitted_amount
+        self.delivery_credential = delivery_credential
+
+
+class UsedStock(Record):
+    """A sold stock item in a product's ledger, with the order that received it (None if unknown)."""
+
+    __slots__ = ('credential', 'order_id')
+
+    def __init__(self, credential, order_id=None):
+        self.credential = credential
+        self.order_id = order_id
+
+    def to_dict(self):
+        return {"credential": self.credential, "order_id": self.order_id}
+
+
+class ProductStock(Record):
+    """A product's stock: unsold credentials in delivery order, and the ledger of sold ones."""
+
+    __slots__ = ('available', 'used')
+
+    def __init__(self, available=(), used=()):
+        self.available = collections.deque(available)
+        self.used = list(used)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['available'], (UsedStock.from_dict(item) for item in data['used']))
+
+    def to_dict(self):
+        return {"available": list(self.available), "used": [item.to_dict() for item in self.used]}
+
+
+def records_from_json(db):
+    """Converts a loaded database.json layout to records in place; users are keyed by int ID."""
+    db['users'] = {int(user_id): User.from_dict(u) for user_id, u in db['users'].items()}
+    db['categories'] = {cat_id: Category.from_dict(c) for cat_id, c in db['categories'].items()}
+    db['products'] = {prod_id: Product.from_dict(p) for prod_id, p in db['products'].items()}
+    db['stock'] = {prod_id: ProductStock.from_dict(s) for prod_id, s in db['stock'].items()}
+    db['orders'] = {order_id: Order.from_dict(o) for order_id, o in db['orders'].items()}
+
+
+def json_default(obj):
+    """json.dumps(default=...) hook writing records back in the database.json layout."""
+    if isinstance(obj, Record):
+        return obj.to_dict()
+    raise TypeError(f"{type(obj).__name__} is not JSON serializable")
@@ -0,0 +1,136 @@
+# persistence.py - PTB persistence for user_data, chat_data and conversation states, kept in the bot's store
+
+import asyncio
+import json
+import logging
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+logger = logging.getLogger(__name__)
+
+USER_DATA = "user_data"
+CHAT_DATA = "chat_data"
+CONVERSATION = "conversation:"     # + the ConversationHandler's name
+
+
+class StorePersistence(BasePersistence):
+    """Keeps user_data, chat_data and ConversationHandler states in the storage backend, next to the orders.
+
+    A restart therefore keeps in-flight payments (waiting_payment_for_order) and admin
+    conversations. PTB hands over the data of every user and chat that had updates
+    once per `update_interval` seconds, and once more on shutdown. Values that did not
+    change since they were last written are dropped; the rest are coalesced per key and
+    written with one store.save_bot_state() call, so a busy interval costs one write,
+    not one per update.
+
+    bot_data is not persisted (it holds on_startup's tasks and servers). Everything
+    kept in user_data and chat_data must be JSON-serialisable.
+    """
+
+    def __init__(self, store, update_interval=10):
+        super().__init__(store_data=PersistenceInput(bot_data=False, callback_data=False),
+                         update_interval=update_interval)
+        self.store = store
+        self._written = {}      # (kind, key) -> JSON of the value in the store
+        self._pending = {}      # (kind, key) -> (value or None to delete, its JSON)
+        self._write_handle = None
+
+    def _load(self, kind, decode_key):
+        data = {}
+        for key, value in self.store.get_bot_state(kind).items():
+            self._written[(kind, key)] = json.dumps(value, sort_keys=True)
+            data[decode_key(key)] = value
+        return data
+
+    def _stage(self, kind, key, value):
+        """Queues one value for the next write (None or {} deletes it); unchanged values are skipped."""
+        if value == {}:
+            value = None
+        try:
+            encoded = None if value is None else json.dumps(value, sort_keys=True)
+        except TypeError:
+            logger.exception("Not persisting %s %s: the value is not JSON-serialisable.", kind, key)
+            return
+        if self._written.get((kind, key)) == encoded:
+            self._pending.pop((kind, key), None)
+            return
+        self._pending[(kind, key)] = (value, encoded)
+        if self._write_handle is None:
+            # PTB passes one interval's changes in a single gather: write them together right after
+            self._write_handle = asyncio.get_running_loop().call_soon(self._write)
+
+    def _write(self):
+        if self._write_handle is not None:
+            self._write_handle.cancel()
+            self._write_handle = None
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        try:
+            self.store.save_bot_state([(kind, key, value) for (kind, key), (value, _) in pending.items()])
+        except Exception:
+            logger.exception("Persisting %d user/chat/conversation entries failed; retrying with the next batch.",
+                             len(pending))
+            self._pending = {**pending, **self._pending}
+            return
+        for (kind, key), (_, encoded) in pending.items():
+            if encoded is None:
+                self._written.pop((kind, key), None)
+            else:
+                self._written[(kind, key)] = encoded
+
+    # --- Loading (once, when the Application initializes) ---
+
+    async def get_user_data(self):
+        return self._load(USER_DATA, int)
+
+    async def get_chat_data(self):
+        return self._load(CHAT_DATA, int)
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        return self._load(CONVERSATION + name, lambda key: tuple(json.loads(key)))
+
+    # --- Updates ---
+
+    async def update_user_data(self, user_id, data):
+        self._stage(USER_DATA, str(user_id), data)
+
+    async def update_chat_data(self, chat_id, data):
+        self._stage(CHAT_DATA, str(chat_id), data)
+
+    async def update_conversation(self, name, key, new_state):
+        self._stage(CONVERSATION + name, json.dumps(list(key)), new_state)
+
+    async def drop_user_data(self, user_id):
+        self._stage(USER_DATA, str(user_id), None)
+
+    async def drop_chat_data(self, chat_id):
+        self._stage(CHAT_DATA, str(chat_id), None)
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    # The in-memory data is the live copy. In a cluster every worker loads everyone's
+    # entries, but each user's updates reach only one worker (cluster.py), and code
+    # acting on other users' data checks main.owns_user(); so only the owning worker
+    # ever writes a user's entries, and the stale copies elsewhere are never saved.
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        self._write()
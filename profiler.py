@@ -0,0 +1,122 @@
+# profiler.py - On-demand cProfile capture of the running bot, summarised per handler
+
+import asyncio
+import cProfile
+import inspect
+import io
+import pstats
+import time
+
+from telegram.ext import ConversationHandler
+
+from callbacks import CallbackRouter
+
+
+def handler_functions(application):
+    """Returns {pstats key (file, line, name): name} for every registered handler callback.
+
+    Callbacks wrapped by metrics.py are unwrapped, so the key is the handler's own
+    code; lambda routers are skipped (the function they route to shows up instead),
+    and a callbacks.CallbackRouter contributes the handler of each of its routes.
+    """
+    def walk(handlers):
+        for handler in handlers:
+            if isinstance(handler, ConversationHandler):
+                yield from walk((*handler.entry_points, *(h for hs in handler.states.values() for h in hs),
+                                 *handler.fallbacks))
+            else:
+                yield handler
+
+    def callbacks(handler):
+        router = getattr(handler.callback, '__self__', None)
+        if isinstance(router, CallbackRouter):
+            yield from (route.handler for route in router.routes.values())
+        else:
+            yield handler.callback
+
+    functions = {}
+    for handlers in application.handlers.values():
+        for callback in (c for handler in walk(handlers) for c in callbacks(handler)):
+            fn = inspect.unwrap(callback)
+            code = getattr(fn, '__code__', None)
+            if code is not None and fn.__name__ != "<lambda>":
+                functions[(code.co_filename, code.co_firstlineno, code.co_name)] = fn.__name__
+    return functions
+
+
+class ProfileCapture:
+    """One cProfile session over the event loop thread, for a number of seconds or updates.
+
+    cProfile follows the thread it is enabled on, and every handler runs on the event
+    loop, so concurrent handlers are all captured; work handed to worker threads
+    (journal writes, archive segments) is not. Only one capture runs at a time.
+    """
+
+    def __init__(self):
+        self._profile = None
+        self._updates_left = None
+        self._done = None
+        self.started = None
+
+    @property
+    def active(self):
+        return self._profile is not None
+
+    def start(self, max_updates=None):
+        """Starts profiling on the calling (event loop) thread."""
+        if self.active:
+            raise RuntimeError("A profile capture is already running.")
+        self._updates_left = max_updates
+        self._done = asyncio.Event()
+        self.started = time.monotonic()
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+
+    def count_update(self):
+        """Counts one incoming update; the capture ends once `max_updates` have arrived."""
+        if self._updates_left is not None and self.active:
+            self._updates_left -= 1
+            if self._updates_left <= 0:
+                self._done.set()
+
+    async def finish(self, max_seconds, settle=1.0):
+        """Waits for the update count (or `max_seconds`), lets in-flight updates settle, stops and returns pstats.Stats."""
+        try:
+            await asyncio.wait_for(self._done.wait(), timeout=max_seconds)
+            await asyncio.sleep(settle)
+        except asyncio.TimeoutError:
+            pass
+        profile, self._profile = self._profile, None
+        profile.disable()
+        return pstats.Stats(profile)
+
+
+def summarize(stats, handlers, top=15, per_handler=5, max_handlers=8):
+    """Plain-text report: hottest functions overall, then per handler its cumulative time and hottest callees."""
+    out = io.StringIO()
+    total = stats.total_tt
+    out.write(f"Hottest functions (own time, of {total:.3f}s sampled):\n")
+    ranked = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)
+    for (filename, line, name), (_, calls, tottime, cumtime, _) in ranked[:top]:
+        out.write(f"{tottime:8.3f}s {cumtime:8.3f}s cum {calls:>7}× {name} ({filename.rsplit('/', 1)[-1]}:{line})\n")
+
+    stats.calc_callees()
+    seen_handlers = sorted(((key, name) for key, name in handlers.items() if key in stats.stats),
+                           key=lambda item: stats.stats[item[0]][3], reverse=True)
+    if seen_handlers:
+        out.write("\nPer handler (cumulative time, hottest functions it called):\n")
+    for key, name in seen_handlers[:max_handlers]:
+        _, calls, _, cumtime, _ = stats.stats[key]
+        out.write(f"\n{name}: {cumtime:.3f}s over {calls} calls\n")
+        # Everything reachable from the handler in the call graph, ranked by own time
+        reachable, stack = set(), [key]
+        while stack:
+            for callee in stats.all_callees.get(stack.pop(), ()):
+                if callee not in reachable:
+                    reachable.add(callee)
+                    stack.append(callee)
+        reachable.discard(key)
+        for callee in sorted(reachable, key=lambda k: stats.stats[k][2], reverse=True)[:per_handler]:
+            filename, line, callee_name = callee
+            out.write(f"  {stats.stats[callee][2]:8.3f}s {callee_name} ({filename.rsplit('/', 1)[-1]}:{line})\n")
+    return out.getvalue()
@@ -0,0 +1,131 @@
+# reconcile.py - Matches a mobile-banking statement export (CSV) against orders pending approval
+
+import csv
+import decimal
+import io
+import re
+
+# Normalised header names (lower case, letters/digits only) accepted for each statement column
+TXN_COLUMNS = {"txnid", "trxid", "transactionid", "txn", "trx", "txnno", "trxno", "transactionno", "reference", "ref"}
+SENDER_COLUMNS = {"sender", "sendernumber", "senderno", "from", "fromnumber", "fromaccount", "account", "accountno",
+                  "msisdn", "mobile", "mobilenumber", "number", "wallet"}
+AMOUNT_COLUMNS = {"amount", "amt", "amountbdt", "amounttk", "credit", "creditamount", "received"}
+
+
+class StatementError(ValueError):
+    """The file is not a statement this importer understands (e.g. missing columns)."""
+
+
+def normalize_txn(txn_id):
+    return txn_id.strip().upper()
+
+
+def normalize_sender(number):
+    """Digits only, without the Bangladesh country code: "+880 1755-667788" -> "01755667788"."""
+    digits = re.sub(r'\D', '', number or "")
+    if digits.startswith("880") and len(digits) == 13:
+        digits = digits[2:]
+    return digits
+
+
+def parse_amount(value):
+    """Decimal amount from "1,250.00", "৳250", "250 BDT"…; None if there is no number."""
+    cleaned = re.sub(r'[^\d.]', '', value or "")
+    try:
+        return decimal.Decimal(cleaned) if cleaned else None
+    except decimal.InvalidOperation:
+        return None
+
+
+def _column(header, names):
+    for index, cell in enumerate(header):
+        if re.sub(r'[^a-z0-9]', '', cell.lower()) in names:
+            return index
+    return None
+
+
+def parse_statement(binary_stream):
+    """Yields (line_no, txn_id, sender, amount) per statement row, reading the CSV as a stream.
+
+    Rows missing a TXN ID or a readable amount are yielded with amount None (malformed).
+    Raises StatementError if the header has no TXN ID, sender or amount column.
+    """
+    reader = csv.reader(io.TextIOWrapper(binary_stream, encoding='utf-8-sig', errors='replace', newline=''))
+    header = next(reader, None)
+    if header is None:
+        raise StatementError("The file is empty.")
+    columns = (_column(header, TXN_COLUMNS), _column(header, SENDER_COLUMNS), _column(header, AMOUNT_COLUMNS))
+    if None in columns:
+        missing = [name for name, index in zip(("TXN ID", "sender", "amount"), columns) if index is None]
+        raise StatementError(f"Could not find the {', '.join(missing)} column(s) in the header row.")
+    txn_col, sender_col, amount_col = columns
+    width = max(columns)
+    for line_no, row in enumerate(reader, 2):
+        if not any(cell.strip() for cell in row):
+            continue
+        if len(row) <= width:
+            yield line_no, None, None, None
+            continue
+        yield line_no, normalize_txn(row[txn_col]) or None, normalize_sender(row[sender_col]), parse_amount(row[amount_col])
+
+
+class Reconciliation:
+    """Outcome of joining statement rows against the orders pending approval.
+
+    matched:   [(order_id, order)]               TXN, sender and amount all agree (and cover the price)
+    conflicts: [(line_no, txn_id, reason)]      the TXN belongs to a pending order but something disagrees
+    settled:   [(line_no, txn_id, order_id)]    the TXN belongs to an order already approved/rejected
+    unmatched: [(line_no, txn_id)]              no order carries this TXN
+    malformed: [line_no]                        row without a TXN ID or a readable amount
+    """
+
+    def __init__(self):
+        self.matched, self.conflicts, self.settled, self.unmatched, self.malformed = [], [], [], [], []
+
+
+def reconcile(rows, pending_orders, find_order_by_txn):
+    """Joins statement rows against pending orders with hashed lookups on TXN ID.
+
+    `pending_orders` is [(order_id, order)] of orders pending approval, `find_order_by_txn`
+    looks up any other order by TXN (Storage.get_order_by_txn). Each order is matched at
+    most once; a TXN listed twice in the statement is a conflict, not a second match.
+    """
+    result = Reconciliation()
+    by_txn = {}
+    for order_id, order in pending_orders:
+        by_txn.setdefault(normalize_txn(order.txn_id), []).append((order_id, order))
+
+    seen_txns = set()
+    for line_no, txn_id, sender, amount in rows:
+        if txn_id is None or amount is None:
+            result.malformed.append(line_no)
+            continue
+        if txn_id in seen_txns:
+            result.conflicts.append((line_no, txn_id, "TXN appears more than once in the statement"))
+            continue
+        seen_txns.add(txn_id)
+
+        candidates = by_txn.get(txn_id)
+        if not candidates:
+            settled = find_order_by_txn(txn_id)
+            if settled:
+                result.settled.append((line_no, txn_id, settled[0]))
+            else:
+                result.unmatched.append((line_no, txn_id))
+            continue
+        if len(candidates) > 1:
+            ids = ", ".join(order_id for order_id, _ in candidates)
+            result.conflicts.append((line_no, txn_id, f"TXN submitted for several orders ({ids})"))
+            continue
+
+        order_id, order = candidates[0]
+        reasons = []
+        if normalize_sender(order.sender_number) != sender:
+            reasons.append(f"sender {sender or '—'} ≠ submitted {order.sender_number}")
+        if amount != order.submitted_amount or amount < order.price:
+            reasons.append(f"amount {amount} ≠ submitted {order.submitted_amount} / price {order.price}")
+        if reasons:
+            result.conflicts.append((line_no, txn_id, f"{order_id}: " + "; ".join(reasons)))
+        else:
+            result.matched.append((order_id, order))
+    return result
@@ -0,0 +1,710 @@
+# sqlite_store.py - SQLite storage backend with indexed orders, users and stock tables
+
+import argparse
+import asyncio
+import contextlib
+import datetime
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import uuid
+
+from archive import OrderArchive
+from models import Category, Order, Product, User
+from storage import (JsonStore, Storage, OrderStateError, FINISHED_STATUSES, PENDING_STATUSES,
+                     USER_COUNTER_FIELDS, compute_user_counters, credential_fingerprint, order_number)
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    username TEXT,
+    name TEXT,
+    total_spent INTEGER NOT NULL DEFAULT 0,
+    total_orders INTEGER NOT NULL DEFAULT 0,
+    completed_orders INTEGER NOT NULL DEFAULT 0,
+    pending_orders INTEGER NOT NULL DEFAULT 0,
+    rejected_orders INTEGER NOT NULL DEFAULT 0,
+    first_order TEXT,
+    last_order TEXT,
+    level TEXT
+);
+CREATE TABLE IF NOT EXISTS categories (
+    cat_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    banner TEXT
+);
+CREATE TABLE IF NOT EXISTS products (
+    product_id TEXT PRIMARY KEY,
+    cat_id TEXT,
+    name TEXT NOT NULL,
+    duration TEXT,
+    price INTEGER NOT NULL,
+    country TEXT,
+    rules TEXT,
+    photo TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_products_cat ON products(cat_id);
+CREATE TABLE IF NOT EXISTS stock (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    product_id TEXT NOT NULL,
+    credential TEXT NOT NULL,
+    used INTEGER NOT NULL DEFAULT 0,
+    fingerprint BLOB
+);
+CREATE INDEX IF NOT EXISTS idx_stock_product_used ON stock(product_id, used);
+CREATE TABLE IF NOT EXISTS orders (
+    order_id TEXT PRIMARY KEY,
+    order_num INTEGER NOT NULL UNIQUE,
+    user_id INTEGER NOT NULL,
+    product_id TEXT NOT NULL,
+    price INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    txn_id TEXT,
+    sender_number TEXT,
+    submitted_amount INTEGER,
+    delivery_credential TEXT
+);
+DROP INDEX IF EXISTS idx_orders_user;
+DROP INDEX IF EXISTS idx_orders_status;
+CREATE INDEX IF NOT EXISTS idx_orders_user_num ON orders(user_id, order_num);
+CREATE INDEX IF NOT EXISTS idx_orders_status_num ON orders(status, order_num);
+CREATE INDEX IF NOT EXISTS idx_orders_txn ON orders(txn_id);
+CREATE INDEX IF NOT EXISTS idx_orders_sender ON orders(sender_number);
+CREATE INDEX IF NOT EXISTS idx_orders_id_nocase ON orders(order_id COLLATE NOCASE);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS bot_state (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (kind, key)
+);
+CREATE TABLE IF NOT EXISTS catalog_changes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL
+);
+"""
+
+# Columns are named after the models.py record fields, so rows convert with Record.from_row()
+USER_FIELDS = User.__slots__
+PRODUCT_FIELDS = Product.__slots__
+ORDER_FIELDS = Order.__slots__
+
+
+def _values(record):
+    """Column values for a record, in __slots__ order."""
+    return [getattr(record, k) for k in record.__slots__]
+
+
+class SqliteStore(Storage):
+    """Storage backend on a single SQLite file.
+
+    Every handler query is served by a primary key or one of the indexes on
+    orders(user_id, order_num), orders(status, order_num), orders(txn_id), orders(sender_number),
+    orders(order_id COLLATE NOCASE), products(cat_id) and stock(product_id, used).
+    Each mutation is its own transaction, so order IDs are allocated atomically and
+    a crash never leaves a half-written record. BEGIN IMMEDIATE takes SQLite's write
+    lock before an order's status is checked, so transitions stay atomic even with
+    several processes on the same file. Aggregates shown on the stats, stock
+    and profile screens live in the counters table and the users' counter columns,
+    and are updated inside the same transactions.
+
+    Catalog changes are also written to the catalog_changes table. With
+    `watch_interval` set (each worker of cluster.py), start() polls that table and the
+    archive index every `watch_interval` seconds, so catalog caches and archive
+    lookups follow changes made by the other processes too.
+    """
+
+    def __init__(self, path='database.sqlite3', watch_interval=None):
+        super().__init__()
+        self.path = path
+        self.watch_interval = watch_interval
+        self.conn = None
+        self._watcher = None
+        self._changes_seen = 0
+
+    def load(self):
+        self.conn = sqlite3.connect(self.path, isolation_level=None, timeout=30)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self._upgrade_schema()
+        self.conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('next_order_id', 100)")
+        if self.conn.execute("SELECT 1 FROM counters LIMIT 1").fetchone() is None:
+            with self.transaction() as conn:
+                self._write_counters(conn, self._compute_counters(conn))
+        self._changes_seen = self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM catalog_changes").fetchone()[0]
+        return self
+
+    def _upgrade_schema(self):
+        """Brings a database created by an older version up to SCHEMA."""
+        columns = {row['name'] for row in self.conn.execute("PRAGMA table_info(stock)")}
+        if 'fingerprint' not in columns:
+            with self.transaction() as conn:
+                conn.execute("ALTER TABLE stock ADD COLUMN fingerprint BLOB")
+                rows = conn.execute("SELECT id, credential FROM stock").fetchall()
+                conn.executemany("UPDATE stock SET fingerprint = ? WHERE id = ?",
+                                 ((credential_fingerprint(row['credential']), row['id']) for row in rows))
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_stock_fingerprint ON stock(fingerprint)")
+
+    def start(self):
+        """Starts watching for other processes' changes, if `watch_interval` is set."""
+        if self.watch_interval and self._watcher is None:
+            self._watcher = asyncio.create_task(self._run_watcher())
+
+    async def _run_watcher(self):
+        while True:
+            await asyncio.sleep(self.watch_interval)
+            try:
+                self.sync_changes()
+            except (sqlite3.Error, OSError):
+                logger.exception("Reading changes made by other processes failed; retrying.")
+
+    def sync_changes(self):
+        """Replays catalog changes committed since the last call (by any process) to the catalog
+        listeners, and reloads the archive index if another process rewrote it."""
+        rows = self.conn.execute("SELECT id, kind, key FROM catalog_changes WHERE id > ? ORDER BY id",
+                                 (self._changes_seen,)).fetchall()
+        for row in rows:
+            self._changes_seen = row['id']
+            self._catalog_changed(row['kind'], row['key'])
+        if self.archive is not None:
+            self.archive.refresh()
+
+    async def close(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+            self._watcher = None
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def gauges(self):
+        size = 0
+        for path in (self.path, f"{self.path}-wal"):
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                pass
+        return {"db_file_bytes": size, "pending_writes": 0}
+
+    def take_legacy_logs(self):
+        # Older versions (and migrate_json_to_sqlite) kept the activity log in a logs table
+        if self.conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'logs'").fetchone() is None:
+            return []
+        with self.transaction() as conn:
+            lines = [row['line'] for row in conn.execute("SELECT line FROM logs ORDER BY id")]
+            conn.execute("DROP TABLE logs")
+        return lines
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """BEGIN IMMEDIATE ... COMMIT, rolled back if the block raises."""
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.conn
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    # --- Counters ---
+
+    def _bump(self, conn, name, delta=1):
+        conn.execute("INSERT INTO counters (name, value) VALUES (?, ?) "
+                     "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value", (name, delta))
+
+    def _move_stock(self, conn, prod_id, added=0, sold=0):
+        """Updates the stock counters for items added to or sold from a product's stock.
+
+        Returns (prod_id, before, after) of its unsold count, for Storage._stock_changed()
+        once committed. Selling out or coming back is also written to catalog_changes,
+        for the catalog caches of other processes on the file.
+        """
+        before = self._counter(f"stock_available[{prod_id}]")
+        for key, delta in (("stock_available", added - sold), ("stock_used", sold)):
+            if delta:
+                self._bump(conn, key, delta)
+                self._bump(conn, f"{key}[{prod_id}]", delta)
+        after = before + added - sold
+        if (before == 0) != (after == 0):
+            conn.execute("INSERT INTO catalog_changes (kind, key) VALUES ('product', ?)", (prod_id,))
+        return prod_id, before, after
+
+    def _counter(self, name):
+        row = self.conn.execute("SELECT value FROM counters WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0
+
+    def _move_order(self, conn, order, new_status):
+        """Adjusts the status counters and the owner's counter columns for one transition.
+
+        `order` needs user_id, price and the current status (None for a new order).
+        """
+        old_status = order['status']
+        if old_status:
+            self._bump(conn, f"orders[{old_status}]", -1)
+        self._bump(conn, f"orders[{new_status}]")
+        was_pending, is_pending = old_status in PENDING_STATUSES, new_status in PENDING_STATUSES
+        delivered = new_status == "delivered"
+        conn.execute(
+            "UPDATE users SET total_orders = total_orders + ?, pending_orders = pending_orders + ?, "
+            "completed_orders = completed_orders + ?, rejected_orders = rejected_orders + ?, "
+            "total_spent = total_spent + ? WHERE user_id = ?",
+            (int(old_status is None), int(is_pending) - int(was_pending), int(delivered),
+             int(new_status == "rejected"), order['price'] if delivered else 0, str(order['user_id'])),
+        )
+
+    def _require_status(self, conn, order_id, status, columns="user_id, price, status"):
+        order = conn.execute(f"SELECT {columns} FROM orders WHERE order_id = ?", (order_id,)).fetchone()
+        if not order or order['status'] != status:
+            raise OrderStateError(order_id, order and order['status'])
+        return order
+
+    def _compute_counters(self, conn):
+        counters = {"users": conn.execute("SELECT COUNT(*) FROM users").fetchone()[0],
+                    "stock_available": 0, "stock_used": 0}
+        for status, n in conn.execute("SELECT status, COUNT(*) FROM orders GROUP BY status"):
+            counters[f"orders[{status}]"] = n
+        live = {order_id for order_id, in conn.execute("SELECT order_id FROM orders")}
+        for _, status, _ in self._archived_records(live):
+            key = f"orders[{status}]"
+            counters[key] = counters.get(key, 0) + 1
+        for prod_id, used, n in conn.execute("SELECT product_id, used, COUNT(*) FROM stock GROUP BY product_id, used"):
+            key = "stock_used" if used else "stock_available"
+            counters[f"{key}[{prod_id}]"] = n
+            counters[key] += n
+        return counters
+
+    def _write_counters(self, conn, counters):
+        conn.execute("DELETE FROM counters")
+        conn.executemany("INSERT INTO counters (name, value) VALUES (?, ?)", counters.items())
+
+    # --- Queries ---
+
+    def get_user(self, user_id):
+        row = self.conn.execute("SELECT * FROM users WHERE user_id = ?", (str(user_id),)).fetchone()
+        return User.from_row(row) if row else None
+
+    def count_users(self):
+        return self._counter("users")
+
+    def list_user_ids(self):
+        return [int(row['user_id']) for row in self.conn.execute("SELECT user_id FROM users")]
+
+    def list_categories(self):
+        rows = self.conn.execute("SELECT * FROM categories ORDER BY rowid")
+        return [(row['cat_id'], Category.from_row(row)) for row in rows]
+
+    def list_products(self):
+        rows = self.conn.execute("SELECT * FROM products ORDER BY rowid")
+        return [(row['product_id'], Product.from_row(row)) for row in rows]
+
+    def products_in_category(self, cat_id):
+        rows = self.conn.execute("SELECT * FROM products WHERE cat_id = ? ORDER BY rowid", (cat_id,))
+        return [(row['product_id'], Product.from_row(row)) for row in rows]
+
+    def get_product(self, prod_id):
+        row = self.conn.execute("SELECT * FROM products WHERE product_id = ?", (prod_id,)).fetchone()
+        return Product.from_row(row) if row else None
+
+    def get_order(self, order_id):
+        row = self.conn.execute("SELECT * FROM orders WHERE order_id = ?", (order_id,)).fetchone()
+        return Order.from_row(row) if row else None
+
+    def resolve_order_id(self, term):
+        row = self.conn.execute("SELECT order_id FROM orders WHERE order_id = ? COLLATE NOCASE LIMIT 1",
+                                (term,)).fetchone()
+        return row['order_id'] if row else None
+
+    def get_order_by_txn(self, txn_id):
+        row = self.conn.execute("SELECT * FROM orders WHERE txn_id = ? ORDER BY order_num LIMIT 1",
+                                (txn_id,)).fetchone()
+        return (row['order_id'], Order.from_row(row)) if row else None
+
+    def orders_by_txn_prefix(self, prefix, limit=10):
+        if not prefix:
+            return []
+        # Half-open range [prefix, prefix-with-last-char-bumped) so the txn_id index is used
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        rows = self.conn.execute("SELECT * FROM orders WHERE txn_id >= ? AND txn_id < ? ORDER BY txn_id LIMIT ?",
+                                 (prefix, upper, limit))
+        return [(row['order_id'], Order.from_row(row)) for row in rows]
+
+    def orders_by_sender(self, sender_number):
+        rows = self.conn.execute("SELECT * FROM orders WHERE sender_number = ? ORDER BY order_num", (sender_number,))
+        return [(row['order_id'], Order.from_row(row)) for row in rows]
+
+    def orders_for_user(self, user_id):
+        rows = self.conn.execute("SELECT * FROM orders WHERE user_id = ? ORDER BY order_num", (user_id,))
+        return [(row['order_id'], Order.from_row(row)) for row in rows]
+
+    def orders_with_status(self, status):
+        rows = self.conn.execute("SELECT * FROM orders WHERE status = ? ORDER BY order_num", (status,))
+        return [(row['order_id'], Order.from_row(row)) for row in rows]
+
+    def _orders_page(self, user_id, status, after, before, limit):
+        # Both directions are range scans on the (user_id|status, order_num) indexes
+        where, key = ("user_id = ?", user_id) if user_id is not None else ("status = ?", status)
+        if after is not None:
+            rows = self.conn.execute(f"SELECT * FROM orders WHERE {where} AND order_num > ? ORDER BY order_num LIMIT ?",
+                                     (key, after, limit + 1)).fetchall()
+            has_newer = len(rows) > limit
+            rows = rows[:limit]
+            has_older = self._any_order(where, key, "order_num <= ?", after)
+        else:
+            bound, args = ("AND order_num < ?", (key, before)) if before is not None else ("", (key,))
+            rows = self.conn.execute(f"SELECT * FROM orders WHERE {where} {bound} ORDER BY order_num DESC LIMIT ?",
+                                     (*args, limit + 1)).fetchall()
+            has_older = len(rows) > limit
+            rows = rows[limit - 1::-1] if has_older else rows[::-1]
+            has_newer = before is not None and self._any_order(where, key, "order_num >= ?", before)
+        return [(row['order_id'], Order.from_row(row)) for row in rows], has_older, has_newer
+
+    def _any_order(self, where, key, bound, cursor):
+        return self.conn.execute(f"SELECT 1 FROM orders WHERE {where} AND {bound} LIMIT 1",
+                                 (key, cursor)).fetchone() is not None
+
+    def order_status_counts(self):
+        rows = self.conn.execute("SELECT name, value FROM counters WHERE name LIKE 'orders[%' AND value != 0")
+        return {name[len("orders["):-1]: value for name, value in rows}
+
+    def stock_counts(self, prod_id=None):
+        suffix = f"[{prod_id}]" if prod_id is not None else ""
+        return self._counter(f"stock_available{suffix}"), self._counter(f"stock_used{suffix}")
+
+    def verify_counters(self):
+        drift = []
+        with self.transaction() as conn:
+            want = self._compute_counters(conn)
+            have = dict(conn.execute("SELECT name, value FROM counters").fetchall())
+            for name in sorted(set(want) | set(have)):
+                if have.get(name, 0) != want.get(name, 0):
+                    drift.append(f"{name}: {have.get(name, 0)} → {want.get(name, 0)}")
+            self._write_counters(conn, want)
+
+            live = {order_id for order_id, in conn.execute("SELECT order_id FROM orders")}
+            computed = compute_user_counters(itertools.chain(conn.execute("SELECT user_id, status, price FROM orders"),
+                                                             self._archived_records(live)))
+            zero = dict.fromkeys(USER_COUNTER_FIELDS, 0)
+            for row in conn.execute(f"SELECT user_id, {', '.join(USER_COUNTER_FIELDS)} FROM users").fetchall():
+                user_want = computed.get(int(row['user_id']), zero)
+                wrong = {k: v for k, v in user_want.items() if row[k] != v}
+                if wrong:
+                    drift += [f"user {row['user_id']} {k}: {row[k]} → {v}" for k, v in wrong.items()]
+                    conn.execute(f"UPDATE users SET {', '.join(f'{k} = ?' for k in wrong)} WHERE user_id = ?",
+                                 (*wrong.values(), row['user_id']))
+        if drift:
+            self._activity("COUNTERS RECOMPUTED", f"{len(drift)} corrections")
+        return drift
+
+    def get_setting(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+        return json.loads(row['value']) if row else default
+
+    def get_bot_state(self, kind):
+        return {row['key']: json.loads(row['value'])
+                for row in self.conn.execute("SELECT key, value FROM bot_state WHERE kind = ?", (kind,))}
+
+    # --- Mutations ---
+
+    def register_user(self, user_id, user):
+        with self.transaction() as conn:
+            cur = conn.execute(
+                f"INSERT OR IGNORE INTO users (user_id, {', '.join(USER_FIELDS)}) "
+                f"VALUES (?, {', '.join('?' * len(USER_FIELDS))})",
+                (str(user_id), *_values(user)),
+            )
+            if cur.rowcount:
+                self._bump(conn, "users")
+
+    def add_category(self, name, banner):
+        cat_id = f"cat_{uuid.uuid4().hex[:4]}"
+        with self.transaction() as conn:
+            conn.execute("INSERT INTO categories (cat_id, name, banner) VALUES (?, ?, ?)", (cat_id, name, banner))
+            conn.execute("INSERT INTO catalog_changes (kind, key) VALUES ('category', ?)", (cat_id,))
+        self._catalog_changed("category", cat_id)
+        self._activity("CATEGORY ADDED", name)
+        return cat_id
+
+    def add_stock(self, prod_id, credentials):
+        product_name = self.get_product(prod_id).name
+        batch, total = {}, 0
+        for credential in credentials:
+            total += 1
+            batch.setdefault(credential_fingerprint(credential), credential)
+        with self.transaction() as conn:
+            fingerprints, existing = list(batch), set()
+            for i in range(0, len(fingerprints), 500):
+                chunk = fingerprints[i:i + 500]
+                existing.update(row[0] for row in conn.execute(
+                    f"SELECT fingerprint FROM stock WHERE fingerprint IN ({', '.join('?' * len(chunk))})", chunk))
+            fresh = [(fingerprint, credential) for fingerprint, credential in batch.items() if fingerprint not in existing]
+            conn.executemany("INSERT INTO stock (product_id, credential, fingerprint) VALUES (?, ?, ?)",
+                             ((prod_id, credential, fingerprint) for fingerprint, credential in fresh))
+            change = self._move_stock(conn, prod_id, added=len(fresh))
+        if fresh:
+            self._activity("STOCK ADDED", f"{len(fresh)} items ({product_name})")
+            self._stock_changed(*change)
+        return len(fresh), total - len(fresh)
+
+    def create_order(self, user_id, prod_id, price):
+        with self.transaction() as conn:
+            order_num = conn.execute("SELECT value FROM meta WHERE key = 'next_order_id'").fetchone()[0]
+            conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'next_order_id'")
+            order_id = f"order_{order_num}"
+            conn.execute(
+                "INSERT INTO orders (order_id, order_num, user_id, product_id, price, status, created_at) "
+                "VALUES (?, ?, ?, ?, ?, 'waiting_payment', ?)",
+                (order_id, order_num, user_id, prod_id, price, datetime.datetime.now().isoformat()),
+            )
+            self._move_order(conn, {"user_id": user_id, "price": price, "status": None}, "waiting_payment")
+        self._activity("ORDER CREATED", order_id)
+        return order_id
+
+    def submit_payment(self, order_id, txn_id, sender_number, amount):
+        with self.transaction() as conn:
+            order = self._require_status(conn, order_id, "waiting_payment")
+            self._move_order(conn, order, "pending_approval")
+            conn.execute(
+                "UPDATE orders SET status = 'pending_approval', txn_id = ?, sender_number = ?, submitted_amount = ? "
+                "WHERE order_id = ?",
+                (txn_id, sender_number, amount, order_id),
+            )
+        self._activity("PAYMENT SUBMITTED", order_id)
+
+    def approve_order(self, order_id):
+        with self.transaction() as conn:
+            order = self._require_status(conn, order_id, "pending_approval", "user_id, product_id, price, status")
+            item = conn.execute(
+                "SELECT id, credential FROM stock WHERE product_id = ? AND used = 0 ORDER BY id LIMIT 1",
+                (order['product_id'],),
+            ).fetchone()
+            if item is None:
+                return None
+            conn.execute("UPDATE stock SET used = 1 WHERE id = ?", (item['id'],))
+            change = self._move_stock(conn, order['product_id'], sold=1)
+            self._move_order(conn, order, "delivered")
+            conn.execute("UPDATE orders SET status = 'delivered', delivery_credential = ? WHERE order_id = ?",
+                         (item['credential'], order_id))
+        self._activity("ORDER APPROVED", order_id)
+        self._stock_changed(*change)
+        return item['credential']
+
+    def reject_order(self, order_id):
+        with self.transaction() as conn:
+            order = self._require_status(conn, order_id, "pending_approval")
+            self._move_order(conn, order, "rejected")
+            conn.execute("UPDATE orders SET status = 'rejected' WHERE order_id = ?", (order_id,))
+        self._activity("ORDER REJECTED", order_id)
+
+    def _fetch_orders(self, conn, order_ids, columns):
+        """Returns {order_id: row} for the given IDs, queried in chunks of 500."""
+        rows = {}
+        for i in range(0, len(order_ids), 500):
+            chunk = order_ids[i:i + 500]
+            rows.update((row['order_id'], row) for row in conn.execute(
+                f"SELECT order_id, {columns} FROM orders WHERE order_id IN ({', '.join('?' * len(chunk))})", chunk))
+        return rows
+
+    def approve_orders(self, order_ids):
+        order_ids = list(dict.fromkeys(order_ids))
+        delivered, out_of_stock, not_pending = {}, [], []
+        with self.transaction() as conn:
+            orders = self._fetch_orders(conn, order_ids, "user_id, product_id, price, status")
+            by_product = {}
+            for order_id in order_ids:
+                order = orders.get(order_id)
+                if not order or order['status'] != "pending_approval":
+                    not_pending.append(order_id)
+                else:
+                    by_product.setdefault(order['product_id'], []).append(order_id)
+            # One stock query per product for the whole batch
+            allocated, changes = {}, []
+            for prod_id, prod_orders in by_product.items():
+                items = conn.execute(
+                    "SELECT id, credential FROM stock WHERE product_id = ? AND used = 0 ORDER BY id LIMIT ?",
+                    (prod_id, len(prod_orders)),
+                ).fetchall()
+                allocated.update((order_id, item) for order_id, item in zip(prod_orders, items))
+                out_of_stock.extend(prod_orders[len(items):])
+                if items:
+                    changes.append(self._move_stock(conn, prod_id, sold=len(items)))
+            for order_id in order_ids:
+                item = allocated.get(order_id)
+                if item is not None:
+                    delivered[order_id] = item['credential']
+                    self._move_order(conn, orders[order_id], "delivered")
+            conn.executemany("UPDATE stock SET used = 1 WHERE id = ?", ((item['id'],) for item in allocated.values()))
+            conn.executemany("UPDATE orders SET status = 'delivered', delivery_credential = ? WHERE order_id = ?",
+                             ((credential, order_id) for order_id, credential in delivered.items()))
+        for order_id in delivered:
+            self._activity("ORDER APPROVED", order_id)
+        for change in changes:
+            self._stock_changed(*change)
+        return delivered, out_of_stock, not_pending
+
+    def reject_orders(self, order_ids):
+        order_ids = list(dict.fromkeys(order_ids))
+        rejected, not_pending = [], []
+        with self.transaction() as conn:
+            orders = self._fetch_orders(conn, order_ids, "user_id, price, status")
+            for order_id in order_ids:
+                order = orders.get(order_id)
+                if order and order['status'] == "pending_approval":
+                    self._move_order(conn, order, "rejected")
+                    rejected.append(order_id)
+                else:
+                    not_pending.append(order_id)
+            conn.executemany("UPDATE orders SET status = 'rejected' WHERE order_id = ?",
+                             ((order_id,) for order_id in rejected))
+        for order_id in rejected:
+            self._activity("ORDER REJECTED", order_id)
+        return rejected, not_pending
+
+    def expire_orders(self, order_ids):
+        order_ids = list(dict.fromkeys(order_ids))
+        expired, not_waiting = [], []
+        with self.transaction() as conn:
+            orders = self._fetch_orders(conn, order_ids, "user_id, price, status")
+            for order_id in order_ids:
+                order = orders.get(order_id)
+                if order and order['status'] == "waiting_payment":
+                    self._move_order(conn, order, "expired")
+                    expired.append(order_id)
+                else:
+                    not_waiting.append(order_id)
+            conn.executemany("UPDATE orders SET status = 'expired' WHERE order_id = ?",
+                             ((order_id,) for order_id in expired))
+        for order_id in expired:
+            self._activity("ORDER EXPIRED", order_id)
+        return expired, not_waiting
+
+    def remove_archived_orders(self, order_ids):
+        order_ids = list(order_ids)
+        removed = 0
+        with self.transaction() as conn:
+            for i in range(0, len(order_ids), 500):
+                chunk = order_ids[i:i + 500]
+                removed += conn.execute(
+                    f"DELETE FROM orders WHERE order_id IN ({', '.join('?' * len(chunk))}) "
+                    f"AND status IN ({', '.join('?' * len(FINISHED_STATUSES))})",
+                    (*chunk, *FINISHED_STATUSES),
+                ).rowcount
+        if removed:
+            self._activity("ORDERS ARCHIVED", f"{removed} orders")
+
+    def set_setting(self, key, value):
+        with self.transaction() as conn:
+            conn.execute("INSERT INTO settings (key, value) VALUES (?, ?) "
+                         "ON CONFLICT(key) DO UPDATE SET value = excluded.value", (key, json.dumps(value)))
+
+    def save_bot_state(self, changes):
+        if not changes:
+            return
+        with self.transaction() as conn:
+            conn.executemany("INSERT INTO bot_state (kind, key, value) VALUES (?, ?, ?) "
+                             "ON CONFLICT(kind, key) DO UPDATE SET value = excluded.value",
+                             ((kind, key, json.dumps(value)) for kind, key, value in changes if value is not None))
+            conn.executemany("DELETE FROM bot_state WHERE kind = ? AND key = ?",
+                             ((kind, key) for kind, key, value in changes if value is None))
+
+
+# --- One-shot migration from database.json ---
+
+def migrate_json_to_sqlite(json_path, sqlite_path, journal_path=None, archive=None):
+    """Copies database.json (plus any unreplayed journal records) into a new SQLite file.
+
+    `archive` is the loaded archive.OrderArchive of the JSON store: archived orders stay
+    there, but the status counters must keep counting them. Refuses to touch an existing
+    SQLite file so it can never clobber live data. Returns a dict of row counts per table.
+    """
+    if os.path.exists(sqlite_path):
+        raise FileExistsError(f"{sqlite_path} already exists; refusing to migrate over it.")
+
+    source = JsonStore(json_path, journal_path=journal_path)
+    if archive is not None:
+        source.attach_archive(archive)
+    db = source.load()
+    source.close_journal()
+
+    target = SqliteStore(sqlite_path)
+    if archive is not None:
+        target.attach_archive(archive)
+    target.load()
+    counts = {}
+    with target.transaction() as conn:
+        conn.executemany(
+            f"INSERT INTO users (user_id, {', '.join(USER_FIELDS)}) VALUES (?, {', '.join('?' * len(USER_FIELDS))})",
+            ((str(uid), *_values(u)) for uid, u in db['users'].items()),
+        )
+        conn.executemany(
+            "INSERT INTO categories (cat_id, name, banner) VALUES (?, ?, ?)",
+            ((cid, c.name, c.banner) for cid, c in db['categories'].items()),
+        )
+        conn.executemany(
+            f"INSERT INTO products (product_id, {', '.join(PRODUCT_FIELDS)}) "
+            f"VALUES (?, {', '.join('?' * len(PRODUCT_FIELDS))})",
+            ((pid, *_values(p)) for pid, p in db['products'].items()),
+        )
+        for pid, entry in db['stock'].items():
+            conn.executemany("INSERT INTO stock (product_id, credential, used, fingerprint) VALUES (?, ?, 1, ?)",
+                             ((pid, item.credential, credential_fingerprint(item.credential)) for item in entry.used))
+            conn.executemany("INSERT INTO stock (product_id, credential, used, fingerprint) VALUES (?, ?, 0, ?)",
+                             ((pid, cred, credential_fingerprint(cred)) for cred in entry.available))
+        conn.executemany(
+            f"INSERT INTO orders (order_id, order_num, {', '.join(ORDER_FIELDS)}) "
+            f"VALUES (?, ?, {', '.join('?' * len(ORDER_FIELDS))})",
+            ((oid, order_number(oid), *_values(o)) for oid, o in db['orders'].items()),
+        )
+        legacy_logs = source.take_legacy_logs()
+        if legacy_logs:
+            # Handed on to the activity log by SqliteStore.take_legacy_logs on first start
+            conn.execute("CREATE TABLE logs (id INTEGER PRIMARY KEY AUTOINCREMENT, line TEXT NOT NULL)")
+            conn.executemany("INSERT INTO logs (line) VALUES (?)", ((line,) for line in legacy_logs))
+        conn.executemany("INSERT INTO settings (key, value) VALUES (?, ?)",
+                         ((key, json.dumps(value)) for key, value in db['settings'].items()))
+        conn.executemany("INSERT INTO bot_state (kind, key, value) VALUES (?, ?, ?)",
+                         ((kind, key, json.dumps(value))
+                          for kind, entries in db['bot_state'].items() for key, value in entries.items()))
+        conn.execute("UPDATE meta SET value = ? WHERE key = 'next_order_id'", (db['next_order_id'],))
+        counters = target._compute_counters(conn)
+        target._write_counters(conn, counters)
+        # The JSON store's own counters should match what was recomputed from its orders
+        expected = {f"orders[{status}]": n for status, n in db['counters']['orders'].items() if n}
+        migrated = {name: n for name, n in counters.items() if name.startswith("orders[") and n}
+        if migrated != expected:
+            logger.warning("Order counters recomputed while migrating (%s) differ from %s's (%s); "
+                           "use Stats → Recount from scratch to check.", migrated, json_path, expected)
+        for table in ('users', 'categories', 'products', 'stock', 'orders'):
+            counts[table] = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    target.conn.close()
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate database.json into a new SQLite database.")
+    parser.add_argument("json_path", nargs="?", default="database.json")
+    parser.add_argument("sqlite_path", nargs="?", default="database.sqlite3")
+    parser.add_argument("--journal", default=None, help="journal file (default: database.journal next to json_path)")
+    parser.add_argument("--archive", default="archive", help="archive directory of the JSON store")
+    args = parser.parse_args()
+    counts = migrate_json_to_sqlite(args.json_path, args.sqlite_path, args.journal, OrderArchive(args.archive).load())
+    print(f"Migrated {args.json_path} -> {args.sqlite_path}: "
+          + ", ".join(f"{n} {table}" for table, n in counts.items()))
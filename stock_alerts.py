@@ -0,0 +1,83 @@
+# stock_alerts.py - Low-stock alerts, checked per product as its stock changes (no periodic scan)
+
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Setting holding the per-product low-water marks: {prod_id: number of unsold items}
+THRESHOLDS_SETTING = "low_stock_thresholds"
+
+
+class StockAlerts:
+    """Alerts the admin when a product's unsold stock drops to its low-water mark, and when it sells out.
+
+    The store reports every change of a product's unsold count with the count before
+    and after (Storage.add_stock_listener), so only the product that changed is
+    checked, and only when it changes. An alert fires when a change crosses the mark
+    going down, so a product is reported once per dip, not on every later sale.
+    Marks are per product (the THRESHOLDS_SETTING setting), else `default_threshold`.
+
+    Store listeners are synchronous, so alerts are queued and sent by the task
+    start() runs; alerts raised before start() are dropped.
+    """
+
+    def __init__(self, store, default_threshold=5):
+        self.store = store
+        self.default_threshold = default_threshold
+        self._queue = None
+        self._sender = None
+        store.add_stock_listener(self.stock_changed)
+
+    def thresholds(self):
+        """{prod_id: low-water mark} set by the admin; other products use default_threshold."""
+        return self.store.get_setting(THRESHOLDS_SETTING, {})
+
+    def threshold(self, prod_id):
+        return self.thresholds().get(prod_id, self.default_threshold)
+
+    def set_threshold(self, prod_id, threshold):
+        """Sets a product's low-water mark; None returns it to the default."""
+        thresholds = dict(self.thresholds())
+        if threshold is None:
+            thresholds.pop(prod_id, None)
+        else:
+            thresholds[prod_id] = threshold
+        self.store.set_setting(THRESHOLDS_SETTING, thresholds)
+
+    def stock_changed(self, prod_id, before, after):
+        if after >= before:
+            return
+        if after == 0:
+            text = f"❌ **SOLD OUT:** {self._name(prod_id)} has no stock left. It is shown as sold out until stock is added."
+        elif before > self.threshold(prod_id) >= after:
+            text = f"⚠️ **LOW STOCK:** {self._name(prod_id)} is down to **{after}** items."
+        else:
+            return
+        if self._queue is not None:
+            self._queue.put_nowait(text)
+
+    def _name(self, prod_id):
+        product = self.store.get_product(prod_id)
+        return product.name if product else prod_id
+
+    # --- Sending ---
+
+    def start(self, send):
+        """Starts sending alerts with `send(text)` (a coroutine function) on the running event loop."""
+        if self._sender is None:
+            self._queue = asyncio.Queue()
+            self._sender = asyncio.create_task(self._run(send))
+
+    async def _run(self, send):
+        while True:
+            text = await self._queue.get()
+            try:
+                await send(text)
+            except Exception:
+                logger.exception("Sending a stock alert failed: %s", text)
+
+    def close(self):
+        if self._sender is not None:
+            self._sender.cancel()
+            self._sender = self._queue = None
@@ -0,0 +1,65 @@
+# stock_import.py - Streaming parser for stock credentials (pasted text or uploaded .txt/.csv files)
+
+import csv
+import io
+import re
+
+# Bot API download limit; larger documents cannot be fetched by the bot at all
+MAX_FILE_BYTES = 20 * 1024 * 1024
+EXTENSIONS = (".txt", ".csv")
+
+CREDENTIAL_RE = re.compile(r'.+\|.+')
+# First-row cells that mark a CSV header rather than a credential
+HEADER_WORDS = {"email", "e-mail", "mail", "login", "user", "username", "account", "password", "pass"}
+
+
+class ImportStats:
+    """Counts for the import reply; `malformed` also keeps the first few bad lines."""
+
+    def __init__(self):
+        self.malformed = 0
+        self.malformed_samples = []
+
+    def bad_line(self, line_no, text):
+        self.malformed += 1
+        if len(self.malformed_samples) < 5:
+            self.malformed_samples.append((line_no, text[:60]))
+
+
+def parse_lines(lines, stats):
+    """Yields one credential per valid "login|password" line; blank lines are skipped, others counted as malformed."""
+    for line_no, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        if CREDENTIAL_RE.match(line):
+            yield line
+        else:
+            stats.bad_line(line_no, line)
+
+
+def parse_csv(text_stream, stats):
+    """Yields credentials from CSV rows: "login,password[,...]" or a single "login|password" column."""
+    for row_no, row in enumerate(csv.reader(text_stream), 1):
+        cells = [cell.strip() for cell in row if cell.strip()]
+        if not cells:
+            continue
+        if row_no == 1 and cells[0].lower() in HEADER_WORDS:
+            continue
+        if len(cells) == 1:
+            if CREDENTIAL_RE.match(cells[0]):
+                yield cells[0]
+            else:
+                stats.bad_line(row_no, cells[0])
+        elif "|" in cells[0] or "|" in cells[1]:
+            stats.bad_line(row_no, ",".join(cells))
+        else:
+            yield f"{cells[0]}|{cells[1]}"
+
+
+def parse_file(binary_stream, filename, stats):
+    """Yields credentials from an uploaded file, decoding and parsing it line by line (never whole in memory)."""
+    text_stream = io.TextIOWrapper(binary_stream, encoding='utf-8-sig', errors='replace', newline='')
+    if filename.lower().endswith(".csv"):
+        return parse_csv(text_stream, stats)
+    return parse_lines(text_stream, stats)
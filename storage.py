@@ -0,0 +1,1178 @@
+# storage.py - Storage backend interface and the JSON backend (resident memory + journal + snapshot)
+
+import asyncio
+import bisect
+import collections
+import contextlib
+import copy
+import datetime
+import hashlib
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+from models import Category, Order, OrderStatus, ProductStock, UsedStock, User, json_default, records_from_json
+
+logger = logging.getLogger(__name__)
+
+
+# Order statuses a customer still sees as "pending" on their profile
+PENDING_STATUSES = (OrderStatus.WAITING_PAYMENT, OrderStatus.PENDING_APPROVAL)
+
+# Final order statuses; such orders are eventually moved to the cold archive (archive.py)
+FINISHED_STATUSES = (OrderStatus.DELIVERED, OrderStatus.REJECTED, OrderStatus.EXPIRED)
+
+# Per-user counters kept on each user record and updated on every order transition
+USER_COUNTER_FIELDS = ("total_orders", "completed_orders", "pending_orders", "rejected_orders", "total_spent")
+
+
+def empty_db():
+    """Returns a fresh, empty database layout."""
+    return {"users": {}, "categories": {}, "products": {}, "stock": {}, "orders": {}, "next_order_id": 100,
+            "settings": {}, "bot_state": {}, "counters": {"orders": {}, "stock_available": 0, "stock_used": 0}}
+
+
+def order_number(order_id):
+    """The numeric part of an order ID ("order_123" -> 123), which orders are sorted and paged by."""
+    return int(order_id.rsplit('_', 1)[-1])
+
+
+def compute_user_counters(orders):
+    """Recomputes USER_COUNTER_FIELDS from scratch from (user_id, status, price) per order, keyed by int user ID."""
+    users = {}
+    for user_id, status, price in orders:
+        c = users.setdefault(int(user_id), dict.fromkeys(USER_COUNTER_FIELDS, 0))
+        c['total_orders'] += 1
+        if status == "delivered":
+            c['completed_orders'] += 1
+            c['total_spent'] += price
+        elif status == "rejected":
+            c['rejected_orders'] += 1
+        elif status in PENDING_STATUSES:
+            c['pending_orders'] += 1
+    return users
+
+
+def credential_fingerprint(credential):
+    """16-byte digest identifying a credential regardless of spacing around its "|" fields."""
+    normalized = "|".join(part.strip() for part in credential.strip().split("|"))
+    return hashlib.blake2b(normalized.encode('utf-8'), digest_size=16).digest()
+
+
+def _stock_entry(db, prod_id):
+    """Returns a product's models.ProductStock, creating an empty one if it has none yet."""
+    entry = db['stock'].get(prod_id)
+    if entry is None:
+        entry = db['stock'][prod_id] = ProductStock()
+    return entry
+
+
+def migrate_stock_layout(db):
+    """Converts stock in a loaded database.json to the queue + ledger layout in place.
+
+    The old layout was one list per product of {"credential", "used"} flags, which had
+    to be scanned from the start on every approval. Unused items keep their order in
+    the queue; used items move to the ledger, tagged with the order that received them.
+    """
+    delivered_by = None
+    for prod_id, entry in db['stock'].items():
+        if isinstance(entry, list):
+            if delivered_by is None:
+                delivered_by = {o.get('delivery_credential'): oid for oid, o in db['orders'].items()
+                                if o.get('delivery_credential')}
+            db['stock'][prod_id] = {
+                "available": [item['credential'] for item in entry if not item['used']],
+                "used": [{"credential": item['credential'], "order_id": delivered_by.get(item['credential'])}
+                         for item in entry if item['used']],
+            }
+
+
+class OrderStateError(Exception):
+    """An order transition was requested from the wrong status (e.g. approving it twice)."""
+
+    def __init__(self, order_id, status):
+        super().__init__(f"{order_id} is {status or 'missing'}")
+        self.order_id = order_id
+        self.status = status
+
+
+class EntityLocks:
+    """Per-entity asyncio locks: `async with store.locks("order", order_id): ...`.
+
+    Serialises read-check-act sequences on one order or user that span awaits, while
+    unrelated entities proceed concurrently. Locks exist only while held or awaited.
+    """
+
+    def __init__(self):
+        self._locks = {}
+
+    @contextlib.asynccontextmanager
+    async def __call__(self, kind, key):
+        name = (kind, str(key))
+        entry = self._locks.get(name)
+        if entry is None:
+            entry = self._locks[name] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[name]
+
+
+class Storage:
+    """Interface shared by every storage backend (JsonStore below, SqliteStore in sqlite_store.py).
+
+    Handlers only talk to the store through these methods, so backends are interchangeable.
+    Reads return the records of models.py (User, Category, Product, Order); treat them
+    as read-only and change state through the mutation methods.
+
+    Each mutation is atomic on its own and order transitions check the current status,
+    raising OrderStateError instead of applying twice. Handlers that must keep a
+    multi-step flow consistent across awaits hold `store.locks` for the entity.
+
+    Caches of catalog data register with add_catalog_listener() and are told
+    exactly which category or product changed; a product selling out or coming back
+    into stock counts as a change. Every change of a product's unsold stock count is
+    reported to add_stock_listener() callbacks (stock_alerts.py). The activity log is
+    not kept here: mutations report events to add_activity_listener() callbacks (activity_log.py).
+
+    Old finished orders move to an attached archive.OrderArchive. Order queries only
+    see the hot store, except search_orders() and orders_page() for a user, which
+    also reach archived orders; the counters keep counting archived orders.
+    """
+
+    def __init__(self):
+        self.locks = EntityLocks()
+        self.archive = None
+        self._catalog_listeners = []
+        self._stock_listeners = []
+        self._activity_listeners = []
+
+    def add_catalog_listener(self, callback):
+        """Registers callback(kind, key), called after a "category" or "product" is added or changed."""
+        self._catalog_listeners.append(callback)
+
+    def _catalog_changed(self, kind, key):
+        for callback in self._catalog_listeners:
+            callback(kind, key)
+
+    def add_stock_listener(self, callback):
+        """Registers callback(prod_id, before, after), called after a product's unsold stock count changes."""
+        self._stock_listeners.append(callback)
+
+    def _stock_changed(self, prod_id, before, after):
+        if (before == 0) != (after == 0):
+            # Sold out or back in stock: the catalog screens show availability
+            self._catalog_changed("product", prod_id)
+        for callback in self._stock_listeners:
+            callback(prod_id, before, after)
+
+    def add_activity_listener(self, callback):
+        """Registers callback(event, detail), called after each mutation, e.g. ("ORDER APPROVED", "order_101")."""
+        self._activity_listeners.append(callback)
+
+    def _activity(self, event, detail=""):
+        for callback in self._activity_listeners:
+            callback(event, detail)
+
+    def attach_archive(self, archive):
+        """Attaches the archive.OrderArchive that old finished orders are moved to."""
+        self.archive = archive
+
+    def _archived_records(self, live_order_ids):
+        """(user_id, status, price) per archived order, for recomputing the counters.
+
+        Orders still in the hot store are skipped: they are counted there. That happens
+        when the archiver stopped between writing the archive and removing the orders;
+        its next pass removes them.
+        """
+        return self.archive.records(exclude=live_order_ids) if self.archive is not None else ()
+
+    # --- Lifecycle ---
+
+    def load(self):
+        """Opens the store (once, at startup)."""
+        raise NotImplementedError
+
+    def start(self):
+        """Starts background work on the running event loop, if the backend has any."""
+
+    async def close(self):
+        """Persists anything outstanding and releases the store."""
+
+    def take_legacy_logs(self):
+        """Returns (oldest first) and removes the activity log lines older versions kept in the store."""
+        return []
+
+    def gauges(self):
+        """Returns {name: number} about the store's files and unwritten changes, for metrics.py."""
+        return {}
+
+    # --- Queries ---
+
+    def get_user(self, user_id):
+        raise NotImplementedError
+
+    def count_users(self):
+        raise NotImplementedError
+
+    def list_user_ids(self):
+        """Returns the ID of every registered user."""
+        raise NotImplementedError
+
+    def list_categories(self):
+        """Returns [(cat_id, category), ...]."""
+        raise NotImplementedError
+
+    def list_products(self):
+        """Returns [(prod_id, product), ...]."""
+        raise NotImplementedError
+
+    def products_in_category(self, cat_id):
+        """Returns [(prod_id, product), ...] for one category."""
+        raise NotImplementedError
+
+    def get_product(self, prod_id):
+        raise NotImplementedError
+
+    def get_order(self, order_id):
+        raise NotImplementedError
+
+    def resolve_order_id(self, term):
+        """Returns the stored order ID matching `term` case-insensitively, or None."""
+        raise NotImplementedError
+
+    def get_order_by_txn(self, txn_id):
+        """Returns (order_id, order) for a submitted TXN ID, or None."""
+        raise NotImplementedError
+
+    def orders_by_txn_prefix(self, prefix, limit=10):
+        """Returns up to `limit` [(order_id, order), ...] whose TXN ID starts with `prefix`."""
+        raise NotImplementedError
+
+    def orders_by_sender(self, sender_number):
+        """Returns [(order_id, order), ...] paid from one sender number, oldest first."""
+        raise NotImplementedError
+
+    def orders_for_user(self, user_id):
+        """Returns [(order_id, order), ...] for one user, oldest first."""
+        raise NotImplementedError
+
+    def orders_with_status(self, status):
+        """Returns [(order_id, order), ...] in one status, oldest first."""
+        raise NotImplementedError
+
+    def orders_page(self, user_id=None, status=None, after=None, before=None, limit=10):
+        """One page of a user's orders (archived ones included), or of the orders in one status, oldest first.
+
+        `after` and `before` are order_number() cursors (exclusive): with `after` the page
+        holds the next `limit` orders above it, otherwise the `limit` orders just below
+        `before` (None: the newest). Returns ([(order_id, order), ...], has_older, has_newer).
+        """
+        page = self._orders_page(user_id, status, after, before, limit)
+        if user_id is None or self.archive is None:
+            return page
+        hot, hot_older, hot_newer = page
+        cold, cold_older, cold_newer = self.archive.orders_page(user_id, after, before, limit)
+        # Both halves hold the `limit` orders nearest the cursor, so the merged page is among them
+        merged = sorted(dict(cold + hot).items(), key=lambda item: order_number(item[0]))
+        if after is not None:
+            return merged[:limit], hot_older or cold_older, hot_newer or cold_newer or len(merged) > limit
+        return merged[-limit:], hot_older or cold_older or len(merged) > limit, hot_newer or cold_newer
+
+    def _orders_page(self, user_id, status, after, before, limit):
+        """orders_page() over the hot store only."""
+        raise NotImplementedError
+
+    def order_status_counts(self):
+        """Returns {status: count} over all orders (maintained counter)."""
+        raise NotImplementedError
+
+    def stock_counts(self, prod_id=None):
+        """Returns (available, used) stock items for one product, or in total (maintained counters)."""
+        raise NotImplementedError
+
+    def verify_counters(self):
+        """Recomputes every maintained counter from scratch, repairs any drift and
+        returns a list of human-readable corrections (empty when nothing drifted)."""
+        raise NotImplementedError
+
+    def get_setting(self, key, default=None):
+        """Returns a bot-wide setting (any JSON value) set by the admin, e.g. the current offer."""
+        raise NotImplementedError
+
+    def get_bot_state(self, kind):
+        """Returns {key: value} saved under `kind` with save_bot_state() (persistence.py)."""
+        raise NotImplementedError
+
+    def search_orders(self, term):
+        """Admin search; returns [(order_id, order, match_type), ...].
+
+        Tries, in order: exact Order ID, exact TXN ID, User ID and sender number
+        (for numeric terms), then TXN ID prefix. Every step is an index lookup, in
+        the hot store and then in the archive.
+        """
+        sources = [self] if self.archive is None else [self, self.archive]
+        for source in sources:
+            order_id = source.resolve_order_id(term)
+            if order_id:
+                return [(order_id, source.get_order(order_id), "Order ID")]
+        txn = term.upper()
+        for source in sources:
+            match = source.get_order_by_txn(txn)
+            if match:
+                return [(match[0], match[1], "TXN ID")]
+        results = {}
+        for source in sources:
+            if term.isdigit():
+                results.update((oid, (oid, o, "User ID")) for oid, o in source.orders_for_user(int(term)))
+            results.update((oid, (oid, o, "Sender Number")) for oid, o in source.orders_by_sender(term))
+        results = list(results.values())
+        if not results:
+            for source in sources:
+                results += [(oid, o, "TXN ID prefix") for oid, o in source.orders_by_txn_prefix(txn)]
+        return results
+
+    # --- Mutations ---
+
+    def register_user(self, user_id, user):
+        """Stores a new models.User."""
+        raise NotImplementedError
+
+    def add_category(self, name, banner):
+        """Creates a category and returns its ID."""
+        raise NotImplementedError
+
+    def add_stock(self, prod_id, credentials):
+        """Appends the credentials not already in stock to a product's stock, in one write.
+
+        A credential counts as a duplicate if any product's stock (sold or not) or an
+        earlier line of the same batch has the same credential_fingerprint().
+        Returns (added, duplicates).
+        """
+        raise NotImplementedError
+
+    def create_order(self, user_id, prod_id, price):
+        """Allocates the next order ID, creates a waiting_payment order and returns the ID."""
+        raise NotImplementedError
+
+    def submit_payment(self, order_id, txn_id, sender_number, amount):
+        """waiting_payment -> pending_approval; raises OrderStateError otherwise."""
+        raise NotImplementedError
+
+    def approve_order(self, order_id):
+        """pending_approval -> delivered with the next unused stock item.
+
+        Returns the credential, or None (and changes nothing) if the product is out of
+        stock. Raises OrderStateError if the order is not pending approval.
+        """
+        raise NotImplementedError
+
+    def reject_order(self, order_id):
+        """pending_approval -> rejected; raises OrderStateError otherwise."""
+        raise NotImplementedError
+
+    def approve_orders(self, order_ids):
+        """Batch approve_order: allocates stock for the whole batch in one pass and one write.
+
+        Orders are served in the given order, each product's unused stock oldest first.
+        Returns (delivered, out_of_stock, not_pending): a dict of order ID -> credential,
+        and the IDs left unchanged because their product ran out or they were not
+        pending approval (never raises OrderStateError).
+        """
+        raise NotImplementedError
+
+    def reject_orders(self, order_ids):
+        """Batch reject_order in one write; returns (rejected, not_pending) lists of order IDs."""
+        raise NotImplementedError
+
+    def expire_orders(self, order_ids):
+        """Batch waiting_payment -> expired in one write; returns (expired, not_waiting) lists of order IDs."""
+        raise NotImplementedError
+
+    def archivable_orders(self, cutoff):
+        """Returns [(order_id, order), ...] of finished orders created before `cutoff` (an ISO timestamp).
+
+        Expired orders are included whatever their age: nobody works on them any more.
+        """
+        return [(order_id, order) for status in FINISHED_STATUSES
+                for order_id, order in self.orders_with_status(status)
+                if status is OrderStatus.EXPIRED or order.created_at < cutoff]
+
+    def remove_archived_orders(self, order_ids):
+        """Drops finished orders already written to the archive from the hot store, in one write.
+
+        The counters are left alone: archived orders still count in stats and profiles.
+        """
+        raise NotImplementedError
+
+    def set_setting(self, key, value):
+        raise NotImplementedError
+
+    def save_bot_state(self, changes):
+        """Saves [(kind, key, value), ...] in one write; a value of None deletes the key.
+
+        This is PTB's user_data, chat_data and conversation states (persistence.py):
+        keys are strings and values any JSON value.
+        """
+        raise NotImplementedError
+
+
+# --- Journal record handlers ---
+# Every mutation is a small JSON record. The same functions apply it live and
+# replay it from the journal on startup, so both paths always agree.
+
+def _move_order(db, order, new_status):
+    """Moves an order to a new status and keeps the global and per-user counters in step."""
+    counts = db['counters']['orders']
+    old_status = order.status
+    if old_status:
+        counts[old_status] -= 1
+    counts[new_status] = counts.get(new_status, 0) + 1
+    order.status = new_status
+
+    user = db['users'].get(order.user_id)
+    if not user:
+        return
+    if old_status is None:
+        user.total_orders += 1
+    was_pending, is_pending = old_status in PENDING_STATUSES, new_status in PENDING_STATUSES
+    if was_pending != is_pending:
+        user.pending_orders += 1 if is_pending else -1
+    if new_status is OrderStatus.DELIVERED:
+        user.completed_orders += 1
+        user.total_spent += order.price
+    elif new_status is OrderStatus.REJECTED:
+        user.rejected_orders += 1
+
+def _apply_user_registered(db, rec):
+    db['users'][int(rec['user_id'])] = User.from_dict(rec['user'])
+
+def _apply_category_added(db, rec):
+    db['categories'][rec['cat_id']] = Category.from_dict(rec['category'])
+
+def _apply_stock_added(db, rec):
+    _stock_entry(db, rec['product_id']).available.extend(rec['credentials'])
+    db['counters']['stock_available'] += len(rec['credentials'])
+
+def _apply_order_created(db, rec):
+    order = db['orders'][rec['order_id']] = Order.from_dict({**rec['order'], "status": None})
+    _move_order(db, order, OrderStatus(rec['order']['status']))
+    db['next_order_id'] = max(db['next_order_id'], rec['order_num'] + 1)
+
+def _apply_payment_submitted(db, rec):
+    order = db['orders'][rec['order_id']]
+    _move_order(db, order, OrderStatus.PENDING_APPROVAL)
+    order.txn_id = rec['txn_id']
+    order.sender_number = rec['sender_number']
+    order.submitted_amount = rec['amount']
+
+def _apply_order_approved(db, rec):
+    order = db['orders'][rec['order_id']]
+    entry = _stock_entry(db, order.product_id)
+    if entry.available and entry.available[0] == rec['credential']:
+        entry.available.popleft()
+    else:
+        entry.available.remove(rec['credential'])
+    entry.used.append(UsedStock(rec['credential'], rec['order_id']))
+    db['counters']['stock_available'] -= 1
+    db['counters']['stock_used'] += 1
+    _move_order(db, order, OrderStatus.DELIVERED)
+    order.delivery_credential = rec['credential']
+
+def _apply_order_rejected(db, rec):
+    _move_order(db, db['orders'][rec['order_id']], OrderStatus.REJECTED)
+
+def _apply_orders_approved(db, rec):
+    for order_id, credential in rec['approvals']:
+        _apply_order_approved(db, {"order_id": order_id, "credential": credential})
+
+def _apply_orders_rejected(db, rec):
+    for order_id in rec['order_ids']:
+        _move_order(db, db['orders'][order_id], OrderStatus.REJECTED)
+
+def _apply_orders_expired(db, rec):
+    for order_id in rec['order_ids']:
+        _move_order(db, db['orders'][order_id], OrderStatus.EXPIRED)
+
+def _apply_orders_archived(db, rec):
+    for order_id in rec['order_ids']:
+        del db['orders'][order_id]
+
+def _apply_counters_recomputed(db, rec):
+    db['counters'] = rec['counters']
+    for user_id, fields in rec['users'].items():
+        user = db['users'].get(int(user_id))
+        if user:
+            for field, value in fields.items():
+                setattr(user, field, value)
+
+def _apply_setting_changed(db, rec):
+    db['settings'][rec['key']] = rec['value']
+
+def _apply_bot_state_saved(db, rec):
+    for kind, key, value in rec['changes']:
+        entries = db['bot_state'].setdefault(kind, {})
+        if value is None:
+            entries.pop(key, None)
+        else:
+            entries[key] = value
+
+def _apply_log(db, rec):
+    pass  # Activity-only records written by older versions (see JsonStore.take_legacy_logs)
+
+# Records that create orders or move them to another status, and the IDs of those orders
+_MOVED_ORDERS = {
+    "order_created": lambda rec: (rec['order_id'],),
+    "payment_submitted": lambda rec: (rec['order_id'],),
+    "order_approved": lambda rec: (rec['order_id'],),
+    "order_rejected": lambda rec: (rec['order_id'],),
+    "orders_approved": lambda rec: [order_id for order_id, _ in rec['approvals']],
+    "orders_rejected": lambda rec: rec['order_ids'],
+    "orders_expired": lambda rec: rec['order_ids'],
+}
+
+_APPLY = {
+    "user_registered": _apply_user_registered,
+    "category_added": _apply_category_added,
+    "stock_added": _apply_stock_added,
+    "order_created": _apply_order_created,
+    "payment_submitted": _apply_payment_submitted,
+    "order_approved": _apply_order_approved,
+    "order_rejected": _apply_order_rejected,
+    "orders_approved": _apply_orders_approved,
+    "orders_rejected": _apply_orders_rejected,
+    "orders_expired": _apply_orders_expired,
+    "orders_archived": _apply_orders_archived,
+    "counters_recomputed": _apply_counters_recomputed,
+    "setting_changed": _apply_setting_changed,
+    "bot_state_saved": _apply_bot_state_saved,
+    "log": _apply_log,
+}
+
+
+class JsonStore(Storage):
+    """Keeps the database resident in memory, journals every change and compacts periodically.
+
+    database.json is a snapshot that is only ever replaced by an atomic rename. Mutations
+    go through the methods below, which apply a small record in memory and queue it for
+    the append-only journal. Queued records are written every `flush_interval` seconds or
+    once `flush_threshold` are pending. Every `compact_interval` seconds, or when the
+    journal grows past `compact_bytes`, the journal is folded into a fresh snapshot,
+    serialised in a thread from a copy-on-write copy of the tables (see _freeze).
+    On startup the snapshot is loaded and newer journal records are replayed on top.
+    """
+
+    def __init__(self, path='database.json', journal_path=None, flush_interval=5, flush_threshold=100,
+                 compact_interval=300, compact_bytes=1024 * 1024):
+        super().__init__()
+        self.path = path
+        self.journal_path = journal_path or f"{os.path.splitext(path)[0]}.journal"
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self.compact_interval = compact_interval
+        self.compact_bytes = compact_bytes
+        self.data = None
+        self._seq = 0
+        self._pending = []
+        self._legacy_logs = []
+        self._journal = None
+        self._journal_bytes = 0
+        self._last_compact = time.monotonic()
+        self._io_lock = threading.Lock()
+        self._appended_seq = 0      # last record in the journal file
+        self._snapshot_seq = 0      # last record in the snapshot file
+        self._frozen = None         # copy being written by compact_async (see _freeze)
+        self._wakeup = None
+        self._flusher = None
+
+    # --- Loading & replay ---
+
+    def load(self):
+        """Loads the snapshot and replays the journal on top of it (once, at startup)."""
+        try:
+            with open(self.path, 'r') as f:
+                self.data = json.load(f)
+        except FileNotFoundError:
+            self.data = empty_db()
+        # A JSONDecodeError is deliberately not caught: the snapshot is only ever
+        # replaced atomically, so a broken file needs a human, not an empty store.
+        migrate_stock_layout(self.data)
+        records_from_json(self.data)
+        # Older versions kept the activity log (newest first) in the snapshot
+        self._legacy_logs = list(reversed(self.data.pop('logs', [])))
+        self.data.setdefault('settings', {})
+        self.data.setdefault('bot_state', {})
+        if 'counters' not in self.data:
+            # Snapshot from before counters were maintained: seed them (and the
+            # per-user fields, which were never fully kept up to date) once.
+            self.data['counters'] = self._compute_counters()
+            orders = ((o.user_id, o.status, o.price) for o in self.data['orders'].values())
+            for user_id, fields in compute_user_counters(orders).items():
+                user = self.data['users'].get(user_id)
+                if user:
+                    for field, value in fields.items():
+                        setattr(user, field, value)
+        self._build_indexes()
+        self._seq = self._snapshot_seq = self.data.get('journal_seq', 0)
+        replayed = self._replay()
+        self._appended_seq = self._seq
+        if replayed:
+            logger.info("Replayed %d journal records from %s.", replayed, self.journal_path)
+        self._journal = open(self.journal_path, 'ab')
+        self._journal_bytes = self._journal.tell()
+        self._last_compact = time.monotonic()
+        return self.data
+
+    def _replay(self):
+        replayed = 0
+        good_offset = 0
+        try:
+            f = open(self.journal_path, 'rb+')
+        except FileNotFoundError:
+            return 0
+        with f:
+            for line in f:
+                try:
+                    # Records are appended with their newline, so a last line without one
+                    # is torn even when it parses; keeping it would glue the next append to it.
+                    if not line.endswith(b'\n'):
+                        raise ValueError("unterminated record")
+                    rec = json.loads(line)
+                except ValueError:
+                    # Torn tail from a crash mid-append: drop it so later appends stay readable.
+                    logger.warning("Discarding incomplete journal record at byte %d.", good_offset)
+                    f.truncate(good_offset)
+                    break
+                good_offset += len(line)
+                if rec['seq'] <= self._seq:
+                    continue
+                self._apply(rec)
+                self._seq = rec['seq']
+                replayed += 1
+        return replayed
+
+    def _apply(self, rec):
+        orders = self.data['orders']
+        moved = _MOVED_ORDERS[rec['op']](rec) if rec['op'] in _MOVED_ORDERS else ()
+        old_statuses = [orders[order_id].status if order_id in orders else None for order_id in moved]
+        if self._frozen is not None:
+            self._preserve(rec, moved)
+        if rec['op'] == "orders_archived":
+            for order_id in rec['order_ids']:
+                self._unindex_order(order_id, orders[order_id])
+        _APPLY[rec['op']](self.data, rec)
+        for order_id, old_status in zip(moved, old_statuses):
+            self._index_status(order_id, old_status, orders[order_id].status)
+        if rec['op'] == "order_created":
+            self._index_order(rec['order_id'], orders[rec['order_id']])
+        elif rec['op'] == "payment_submitted":
+            self._index_payment(rec['order_id'], self.data['orders'][rec['order_id']])
+        elif rec['op'] == "stock_added":
+            self._stock_fingerprints.update(credential_fingerprint(c) for c in rec['credentials'])
+        if rec.get('log'):
+            # Journal record from an older version that carried an activity log line
+            stamp = datetime.datetime.fromisoformat(rec['at']).strftime('%H:%M %d %b')
+            self._legacy_logs.append(f"[{stamp}] {rec['log']}")
+
+    def _commit(self, op, **fields):
+        """Applies a mutation record in memory and queues it for the journal."""
+        self._seq += 1
+        rec = {"seq": self._seq, "op": op, "at": datetime.datetime.now().isoformat(), **fields}
+        self._apply(rec)
+        self._pending.append(json.dumps(rec, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n')
+        if self._wakeup is not None and len(self._pending) >= self.flush_threshold:
+            self._wakeup.set()
+        return rec
+
+    # --- Secondary indexes (memory only, rebuilt on load, maintained by _apply) ---
+
+    def _build_indexes(self):
+        self._order_ids_ci = {}                        # order_id.lower() -> order_id
+        self._orders_by_user = collections.defaultdict(list)   # user_id (int) -> sorted [(order_number, order_id)]
+        self._orders_by_status = collections.defaultdict(list)  # status -> sorted [(order_number, order_id)]
+        self._orders_by_txn = collections.defaultdict(list)    # TXN ID -> [order_id]
+        self._orders_by_sender = collections.defaultdict(list)  # sender number -> [order_id]
+        self._txn_sorted = []                          # sorted TXN IDs, for prefix search
+        self._stock_fingerprints = set()               # credential_fingerprint() of every stock item, sold or not
+        for entry in self.data['stock'].values():
+            self._stock_fingerprints.update(credential_fingerprint(c) for c in entry.available)
+            self._stock_fingerprints.update(credential_fingerprint(item.credential) for item in entry.used)
+        for order_id, order in self.data['orders'].items():
+            self._index_order(order_id, order)
+            self._orders_by_status[order.status].append((order_number(order_id), order_id))
+            if order.txn_id:
+                self._index_payment(order_id, order, keep_sorted=False)
+        self._txn_sorted.sort()
+        for entries in (*self._orders_by_user.values(), *self._orders_by_status.values()):
+            entries.sort()
+
+    def _index_order(self, order_id, order):
+        self._order_ids_ci[order_id.lower()] = order_id
+        # Order numbers only grow, so appending keeps the list sorted
+        self._orders_by_user[order.user_id].append((order_number(order_id), order_id))
+
+    def _unindex_order(self, order_id, order):
+        """Removes an order from every index (it is leaving the hot store)."""
+        entry = (order_number(order_id), order_id)
+        del self._order_ids_ci[order_id.lower()]
+        for entries in (self._orders_by_user[order.user_id], self._orders_by_status[order.status]):
+            del entries[bisect.bisect_left(entries, entry)]
+        if order.txn_id:
+            txn_orders = self._orders_by_txn[order.txn_id]
+            txn_orders.remove(order_id)
+            if not txn_orders:
+                del self._orders_by_txn[order.txn_id]
+                del self._txn_sorted[bisect.bisect_left(self._txn_sorted, order.txn_id)]
+            self._orders_by_sender[order.sender_number].remove(order_id)
+
+    def _index_status(self, order_id, old_status, new_status):
+        if old_status == new_status:
+            return
+        entry = (order_number(order_id), order_id)
+        if old_status is not None:
+            entries = self._orders_by_status[old_status]
+            del entries[bisect.bisect_left(entries, entry)]
+        bisect.insort(self._orders_by_status[new_status], entry)
+
+    def _index_payment(self, order_id, order, keep_sorted=True):
+        txn_id = order.txn_id
+        if txn_id not in self._orders_by_txn:
+            if keep_sorted:
+                bisect.insort(self._txn_sorted, txn_id)
+            else:
+                self._txn_sorted.append(txn_id)
+        self._orders_by_txn[txn_id].append(order_id)
+        self._orders_by_sender[order.sender_number].append(order_id)
+
+    def _orders(self, order_ids):
+        orders = self.data['orders']
+        return [(order_id, orders[order_id]) for order_id in order_ids]
+
+    # --- Queries ---
+
+    def get_user(self, user_id):
+        return self.data['users'].get(int(user_id))
+
+    def count_users(self):
+        return len(self.data['users'])
+
+    def list_user_ids(self):
+        return list(self.data['users'])
+
+    def list_categories(self):
+        return list(self.data['categories'].items())
+
+    def list_products(self):
+        return list(self.data['products'].items())
+
+    def products_in_category(self, cat_id):
+        return [(prod_id, p) for prod_id, p in self.data['products'].items() if p.cat_id == cat_id]
+
+    def get_product(self, prod_id):
+        return self.data['products'].get(prod_id)
+
+    def get_order(self, order_id):
+        return self.data['orders'].get(order_id)
+
+    def resolve_order_id(self, term):
+        return self._order_ids_ci.get(term.lower())
+
+    def get_order_by_txn(self, txn_id):
+        order_ids = self._orders_by_txn.get(txn_id)
+        return (order_ids[0], self.data['orders'][order_ids[0]]) if order_ids else None
+
+    def orders_by_txn_prefix(self, prefix, limit=10):
+        if not prefix:
+            return []
+        order_ids = []
+        i = bisect.bisect_left(self._txn_sorted, prefix)
+        while i < len(self._txn_sorted) and self._txn_sorted[i].startswith(prefix) and len(order_ids) < limit:
+            order_ids += self._orders_by_txn[self._txn_sorted[i]]
+            i += 1
+        return self._orders(order_ids[:limit])
+
+    def orders_by_sender(self, sender_number):
+        return self._orders(self._orders_by_sender.get(sender_number, ()))
+
+    def orders_for_user(self, user_id):
+        return self._orders(order_id for _, order_id in self._orders_by_user.get(int(user_id), ()))
+
+    def orders_with_status(self, status):
+        return self._orders(order_id for _, order_id in self._orders_by_status.get(status, ()))
+
+    def _orders_page(self, user_id, status, after, before, limit):
+        if user_id is not None:
+            entries = self._orders_by_user.get(int(user_id), ())
+        else:
+            entries = self._orders_by_status.get(status, ())
+        if after is not None:
+            start = bisect.bisect_left(entries, (after + 1,))
+            end = min(start + limit, len(entries))
+        else:
+            end = len(entries) if before is None else bisect.bisect_left(entries, (before,))
+            start = max(end - limit, 0)
+        return self._orders(order_id for _, order_id in entries[start:end]), start > 0, end < len(entries)
+
+    def order_status_counts(self):
+        return {status: n for status, n in self.data['counters']['orders'].items() if n}
+
+    def stock_counts(self, prod_id=None):
+        if prod_id is not None:
+            entry = self.data['stock'].get(prod_id)
+            return (len(entry.available), len(entry.used)) if entry else (0, 0)
+        return self.data['counters']['stock_available'], self.data['counters']['stock_used']
+
+    def _compute_counters(self):
+        orders = {}
+        for _, status, _ in self._order_records():
+            orders[status] = orders.get(status, 0) + 1
+        return {
+            "orders": orders,
+            "stock_available": sum(len(e.available) for e in self.data['stock'].values()),
+            "stock_used": sum(len(e.used) for e in self.data['stock'].values()),
+        }
+
+    def _order_records(self):
+        """(user_id, status, price) per order, hot and archived."""
+        hot = ((o.user_id, o.status, o.price) for o in self.data['orders'].values())
+        return itertools.chain(hot, self._archived_records(self.data['orders']))
+
+    def verify_counters(self):
+        drift = []
+        counters = self._compute_counters()
+        current = self.data['counters']
+        for status in sorted(set(counters['orders']) | set(current['orders'])):
+            have, want = current['orders'].get(status, 0), counters['orders'].get(status, 0)
+            if have != want:
+                drift.append(f"orders[{status}]: {have} → {want}")
+        for key in ("stock_available", "stock_used"):
+            if current[key] != counters[key]:
+                drift.append(f"{key}: {current[key]} → {counters[key]}")
+
+        fixed_users = {}
+        computed = compute_user_counters(self._order_records())
+        zero = dict.fromkeys(USER_COUNTER_FIELDS, 0)
+        for user_id, user in self.data['users'].items():
+            want = computed.get(user_id, zero)
+            wrong = {k: v for k, v in want.items() if getattr(user, k) != v}
+            if wrong:
+                fixed_users[user_id] = wrong
+                drift += [f"user {user_id} {k}: {getattr(user, k)} → {v}" for k, v in wrong.items()]
+
+        if drift:
+            self._commit("counters_recomputed", counters=counters, users=fixed_users)
+            self._activity("COUNTERS RECOMPUTED", f"{len(drift)} corrections")
+        return drift
+
+    def take_legacy_logs(self):
+        lines, self._legacy_logs = self._legacy_logs, []
+        return lines
+
+    def get_setting(self, key, default=None):
+        return self.data['settings'].get(key, default)
+
+    def get_bot_state(self, kind):
+        return dict(self.data['bot_state'].get(kind, {}))
+
+    # --- Mutations ---
+
+    def register_user(self, user_id, user):
+        self._commit("user_registered", user_id=str(user_id), user=user.to_dict())
+
+    def add_category(self, name, banner):
+        cat_id = f"cat_{uuid.uuid4().hex[:4]}"
+        self._commit("category_added", cat_id=cat_id, category={"name": name, "banner": banner})
+        self._catalog_changed("category", cat_id)
+        self._activity("CATEGORY ADDED", name)
+        return cat_id
+
+    def add_stock(self, prod_id, credentials):
+        product_name = self.data['products'][prod_id].name
+        fresh, seen, total = [], set(), 0
+        for credential in credentials:
+            total += 1
+            fingerprint = credential_fingerprint(credential)
+            if fingerprint not in self._stock_fingerprints and fingerprint not in seen:
+                seen.add(fingerprint)
+                fresh.append(credential)
+        if fresh:
+            before, _ = self.stock_counts(prod_id)
+            self._commit("stock_added", product_id=prod_id, credentials=fresh)
+            self._activity("STOCK ADDED", f"{len(fresh)} items ({product_name})")
+            self._stock_changed(prod_id, before, before + len(fresh))
+        return len(fresh), total - len(fresh)
+
+    def create_order(self, user_id, prod_id, price):
+        order_num = self.data['next_order_id']
+        order_id = f"order_{order_num}"
+        self._commit("order_created", order_id=order_id, order_num=order_num,
+                     order={"user_id": user_id, "product_id": prod_id, "price": price,
+                            "status": "waiting_payment", "created_at": datetime.datetime.now().isoformat()})
+        self._activity("ORDER CREATED", order_id)
+        return order_id
+
+    def _require_status(self, order_id, status):
+        order = self.data['orders'].get(order_id)
+        if not order or order.status != status:
+            raise OrderStateError(order_id, order and order.status)
+        return order
+
+    def submit_payment(self, order_id, txn_id, sender_number, amount):
+        self._require_status(order_id, "waiting_payment")
+        self._commit("payment_submitted", order_id=order_id, txn_id=txn_id, sender_number=sender_number, amount=amount)
+        self._activity("PAYMENT SUBMITTED", order_id)
+
+    def approve_order(self, order_id):
+        order = self._require_status(order_id, "pending_approval")
+        available = _stock_entry(self.data, order.product_id).available
+        if not available:
+            return None
+        credential, before = available[0], len(available)
+        self._commit("order_approved", order_id=order_id, credential=credential)
+        self._activity("ORDER APPROVED", order_id)
+        self._stock_changed(order.product_id, before, before - 1)
+        return credential
+
+    def reject_order(self, order_id):
+        self._require_status(order_id, "pending_approval")
+        self._commit("order_rejected", order_id=order_id)
+        self._activity("ORDER REJECTED", order_id)
+
+    def approve_orders(self, order_ids):
+        delivered, out_of_stock, not_pending = {}, [], []
+        unused = {}  # prod_id -> iterator over its available stock, shared by the batch
+        sold = collections.Counter()
+        for order_id in dict.fromkeys(order_ids):
+            order = self.data['orders'].get(order_id)
+            if not order or order.status != "pending_approval":
+                not_pending.append(order_id)
+                continue
+            prod_id = order.product_id
+            if prod_id not in unused:
+                unused[prod_id] = iter(_stock_entry(self.data, prod_id).available)
+            credential = next(unused[prod_id], None)
+            if credential is None:
+                out_of_stock.append(order_id)
+            else:
+                delivered[order_id] = credential
+                sold[prod_id] += 1
+        if delivered:
+            before = {prod_id: self.stock_counts(prod_id)[0] for prod_id in sold}
+            self._commit("orders_approved", approvals=list(delivered.items()))
+            for order_id in delivered:
+                self._activity("ORDER APPROVED", order_id)
+            for prod_id, count in sold.items():
+                self._stock_changed(prod_id, before[prod_id], before[prod_id] - count)
+        return delivered, out_of_stock, not_pending
+
+    def reject_orders(self, order_ids):
+        rejected, not_pending = [], []
+        for order_id in dict.fromkeys(order_ids):
+            order = self.data['orders'].get(order_id)
+            (rejected if order and order.status == "pending_approval" else not_pending).append(order_id)
+        if rejected:
+            self._commit("orders_rejected", order_ids=rejected)
+            for order_id in rejected:
+                self._activity("ORDER REJECTED", order_id)
+        return rejected, not_pending
+
+    def expire_orders(self, order_ids):
+        expired, not_waiting = [], []
+        for order_id in dict.fromkeys(order_ids):
+            order = self.data['orders'].get(order_id)
+            (expired if order and order.status == "waiting_payment" else not_waiting).append(order_id)
+        if expired:
+            self._commit("orders_expired", order_ids=expired)
+            for order_id in expired:
+                self._activity("ORDER EXPIRED", order_id)
+        return expired, not_waiting
+
+    def remove_archived_orders(self, order_ids):
+        orders = self.data['orders']
+        order_ids = [order_id for order_id in order_ids
+                     if order_id in orders and orders[order_id].status in FINISHED_STATUSES]
+        if order_ids:
+            self._commit("orders_archived", order_ids=order_ids)
+            self._activity("ORDERS ARCHIVED", f"{len(order_ids)} orders")
+
+    def set_setting(self, key, value):
+        self._commit("setting_changed", key=key, value=value)
+
+    def save_bot_state(self, changes):
+        if changes:
+            # Stored as a copy: the values are PTB's live user_data, which handlers keep changing
+            # while compact_async serialises the store in a thread
+            self._commit("bot_state_saved", changes=[[kind, key, None if value is None else json.loads(json.dumps(value))]
+                                                     for kind, key, value in changes])
+
+    def gauges(self):
+        size = 0
+        for path in (self.path, self.journal_path):
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                pass
+        return {"db_file_bytes": size, "journal_bytes": self._journal_bytes, "pending_writes": len(self._pending)}
+
+    # --- Journal writes & compaction ---
+
+    def close_journal(self):
+        """Releases the journal handle without compacting (read-only use, e.g. migration)."""
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    def _append(self, lines, seq):
+        with self._io_lock:
+            self._journal.write(b''.join(lines))
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            self._journal_bytes += sum(len(line) for line in lines)
+            self._appended_seq = seq
+
+    def _write_snapshot(self, payload, seq):
+        tmp_path = f"{self.path}.tmp"
+        with self._io_lock:
+            if seq < self._snapshot_seq:
+                return  # a newer snapshot was written meanwhile (close() during a compaction)
+            with open(tmp_path, 'w') as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            self._snapshot_seq = seq
+            # Records up to journal_seq are now in the snapshot; replay would skip them anyway.
+            # Newer ones appended meanwhile stay until the next compaction.
+            if self._appended_seq <= seq:
+                self._journal.truncate(0)
+                self._journal_bytes = 0
+
+    @staticmethod
+    def _snapshot_payload(data):
+        # Records are written back in the database.json layout (users keyed by str ID)
+        return json.dumps(data, indent=2, default=json_default)
+
+    def _freeze(self):
+        """A copy of the database as of the last applied record, for serialising off the event loop.
+
+        Only the tables are copied, not the records in them, so this takes milliseconds
+        where json.dumps takes seconds. Until the copy is serialised, records are copied
+        on write: before _apply changes one in place, the live table gets a copy of it to
+        change and the frozen one keeps the original, which nothing touches again (_preserve).
+        """
+        self.data['journal_seq'] = self._seq
+        frozen = {key: dict(value) if isinstance(value, dict) else value for key, value in self.data.items()}
+        counters = self.data['counters']
+        frozen['counters'] = {**counters, 'orders': dict(counters['orders'])}
+        frozen['bot_state'] = {kind: dict(entries) for kind, entries in self.data['bot_state'].items()}
+        return frozen
+
+    def _preserve(self, rec, moved):
+        """Gives the live tables their own copies of the records `rec` is about to change in place."""
+        orders = self.data['orders']
+        order_ids = [order_id for order_id in moved if order_id in orders]
+        user_ids = [orders[order_id].user_id for order_id in order_ids]
+        prod_ids = []
+        if rec['op'] == "order_created":
+            user_ids = [rec['order']['user_id']]
+        elif rec['op'] in ("order_approved", "orders_approved"):
+            prod_ids = [orders[order_id].product_id for order_id in order_ids]
+        elif rec['op'] == "stock_added":
+            prod_ids = [rec['product_id']]
+        elif rec['op'] == "counters_recomputed":
+            user_ids = [int(user_id) for user_id in rec['users']]
+        for table, keys in (("orders", order_ids), ("users", user_ids), ("stock", prod_ids)):
+            live, frozen = self.data[table], self._frozen[table]
+            for key in keys:
+                record = live.get(key)
+                if record is not None and record is frozen.get(key):
+                    # ProductStock's constructor copies its queue and ledger
+                    live[key] = ProductStock(record.available, record.used) if table == "stock" else copy.copy(record)
+
+    def flush(self):
+        """Appends queued records to the journal right away."""
+        if not self._pending:
+            return False
+        lines, self._pending = self._pending, []
+        self._append(lines, self._seq)
+        return True
+
+    async def flush_async(self):
+        """Appends queued records to the journal from a worker thread."""
+        if not self._pending:
+            return False
+        lines, self._pending = self._pending, []
+        try:
+            await asyncio.to_thread(self._append, lines, self._seq)
+        except OSError:
+            logger.exception("Journal append to %s failed, will retry.", self.journal_path)
+            self._pending[:0] = lines
+            return False
+        return True
+
+    def compact(self):
+        """Folds the journal into a new snapshot synchronously."""
+        self.flush()
+        self.data['journal_seq'] = self._seq
+        self._write_snapshot(self._snapshot_payload(self.data), self._seq)
+        self._last_compact = time.monotonic()
+
+    async def compact_async(self):
+        """Folds the journal into a new snapshot; copies the tables on the loop, serialises and writes from a thread."""
+        await self.flush_async()
+        self._frozen = frozen = self._freeze()
+        try:
+            payload = await asyncio.to_thread(self._snapshot_payload, frozen)
+        finally:
+            self._frozen = None
+        try:
+            await asyncio.to_thread(self._write_snapshot, payload, frozen['journal_seq'])
+        except OSError:
+            logger.exception("Snapshot compaction of %s failed, journal kept.", self.path)
+            return False
+        self._last_compact = time.monotonic()
+        return True
+
+    def _compaction_due(self):
+        return (self._journal_bytes >= self.compact_bytes
+                or time.monotonic() - self._last_compact >= self.compact_interval)
+
+    async def _run_flusher(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush_async()
+            if self._journal_bytes and self._compaction_due():
+                await self.compact_async()
+
+    def start(self):
+        """Starts the background flusher/compactor on the running event loop."""
+        if self._flusher is None:
+            self._wakeup = asyncio.Event()
+            self._flusher = asyncio.create_task(self._run_flusher())
+
+    async def close(self):
+        """Stops the background task, then flushes and compacts one last time."""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+            self._wakeup = None
+        if self._journal is not None:
+            self.compact()
+            self._journal.close()
+            self._journal = None
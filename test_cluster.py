@@ -0,0 +1,50 @@
+# test_cluster.py - Tests for cluster.py's update ordering (python -m unittest test_cluster)
+
+import asyncio
+import unittest
+
+from telegram import Chat, Message, Update, User
+
+from cluster import UserOrderedUpdateProcessor
+
+
+def message_from(user_id, update_id):
+    user = User(user_id, "u", False)
+    return Update(update_id, message=Message(update_id, None, Chat(user_id, Chat.PRIVATE), from_user=user, text="hi"))
+
+
+class UserOrderedUpdateProcessorTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_burst_from_one_user_does_not_block_another(self):
+        processor = UserOrderedUpdateProcessor(max_concurrent_updates=4)
+        release = asyncio.Event()
+        handled = []
+
+        async def handle(user_id, update_id):
+            if user_id == 1:
+                await release.wait()
+            handled.append((user_id, update_id))
+
+        burst = [asyncio.create_task(processor.process_update(message_from(1, n), handle(1, n))) for n in range(10)]
+        await asyncio.sleep(0)
+        await asyncio.wait_for(processor.process_update(message_from(2, 99), handle(2, 99)), timeout=1)
+        self.assertEqual(handled, [(2, 99)])
+        self.assertEqual(processor.current_concurrent_updates, 1)
+
+        release.set()
+        await asyncio.gather(*burst)
+        self.assertEqual(handled[1:], [(1, n) for n in range(10)])
+
+    async def test_updates_without_sender_are_processed(self):
+        processor = UserOrderedUpdateProcessor(max_concurrent_updates=1)
+        done = asyncio.Event()
+
+        async def handle():
+            done.set()
+
+        await processor.process_update(object(), handle())
+        self.assertTrue(done.is_set())
+
+
+if __name__ == "__main__":
+    unittest.main()